@@ -29,10 +29,35 @@ crc_snv = pd.read_csv("./data/crc_snv_sorted.csv")
 # WebSTR API 
 webstr_link = "http://webstr-api.ucsd.edu/repeats"
 
+# Repeats already downloaded per request: (ETag, records). The API answers 304 Not Modified while the
+# ETag is still current, so unchanged repeats of a gene are not transferred again.
+webstr_responses = {}
+
+def get_webstr(params):
+    key = tuple(sorted(params.items()))
+    headers = {}
+    if key in webstr_responses:
+        headers["If-None-Match"] = webstr_responses[key][0]
+    resp = requests.get(webstr_link, params = params, headers = headers)
+    if resp.status_code == 304:
+        return webstr_responses[key][1], resp.headers.get("X-Next-Cursor")
+    resp.raise_for_status()
+    if "ETag" in resp.headers:
+        webstr_responses[key] = (resp.headers["ETag"], resp.json())
+    return resp.json(), resp.headers.get("X-Next-Cursor")
+
+def get_webstr_repeats(gene_name):
+    # follow the cursor through all pages of repeats of the gene
+    params = {'gene_names' : gene_name}
+    records, cursor = get_webstr(params)
+    while cursor:
+        page, cursor = get_webstr({**params, 'cursor' : cursor})
+        records = records + page
+    return records
+
 def retrieve_str(gene_name, sample):
     # retrieve STRs from database
-    resp = requests.get(webstr_link, params = {'gene_names' : gene_name})
-    df_str = pd.DataFrame.from_records(resp.json())
+    df_str = pd.DataFrame.from_records(get_webstr_repeats(gene_name))
     df_str["tmp_id"] = df_str["chr"].str.cat(df_str["start"].astype("str"), sep = "_")
     
     if sample == "normal samples":
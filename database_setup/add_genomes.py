@@ -4,6 +4,7 @@ sys.path.append("..")
 import argparse
 from strAPI.repeats.models import Genome
 from gtf_to_sql import connection_setup
+from dataset_version import bump_dataset_version
 
 def make_db_genome(genome_info):
 
@@ -43,6 +44,7 @@ def main():
             g_obj = make_db_genome(g)
             session.add(g_obj)
     session.commit()
+    bump_dataset_version(session)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
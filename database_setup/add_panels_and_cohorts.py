@@ -5,6 +5,7 @@ sys.path.append("..")
 import argparse
 from strAPI.repeats.models import TRPanel, Cohort, Genome
 from gtf_to_sql import connection_setup
+from dataset_version import bump_dataset_version
 
 def make_db_trpanel(session, trpanel_info):
 
@@ -87,6 +88,7 @@ def main():
         c_obj = make_db_cohort(session, c)
         session.add(c_obj)
     session.commit()
+    bump_dataset_version(session)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
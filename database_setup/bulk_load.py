@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+""" Bulk writing of plain rows for the import scripts. PostgreSQL gets the rows through COPY, other
+databases (SQLite) through a single executemany per batch. Rows are dicts keyed by column name or
+tuples in column order.
+"""
+import sys
+sys.path.append("..")
+
+import io
+import time
+
+from sqlalchemy import func, select, text, Integer
+
+def csv_field(value) -> str:
+    """ A value as a field of COPY ... CSV: None as an unquoted empty field, which COPY reads as NULL,
+    strings quoted so an empty string stays an empty string
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+def csv_line(values) -> str:
+    return ",".join(csv_field(value) for value in values) + "\n"
+
+def copy_rows(session, table, columns, rows):
+    """ COPY rows into table over the psycopg2 connection of the session """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(csv_line([row[column] for column in columns] if isinstance(row, dict) else row))
+    buffer.seek(0)
+
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+def insert_rows(session, table, columns, rows):
+    """ INSERT rows into table with one executemany """
+    rows = [row if isinstance(row, dict) else dict(zip(columns, row)) for row in rows]
+    session.execute(table.insert(), rows)
+
+def bulk_insert(session, model, columns, rows) -> int:
+    """ Write a batch of rows into the table of a SQLModel class in the current transaction
+
+    Parameters
+    session:    Session connected to the database
+    model:      SQLModel table class, e.g. Repeat
+    columns:    Column names, all rows must provide a value for each of them
+    rows:       List of dicts or tuples
+
+    Returns
+    Number of rows written
+    """
+    if not rows:
+        return 0
+    table = model.__table__
+    if session.get_bind().dialect.name == "postgresql":
+        copy_rows(session, table, columns, rows)
+    else:
+        insert_rows(session, table, columns, rows)
+    return len(rows)
+
+def frame_rows(frame) -> list:
+    """ Rows of a pd.DataFrame as tuples of plain Python values, missing values become None """
+    frame = frame.astype(object)
+    return list(frame.where(frame.notna(), None).itertuples(index=False, name=None))
+
+def integer_columns(model, frame):
+    """ frame with the columns that are integer columns of the table of model as nullable Int64.
+    pandas turns integer columns with missing values (after reindex, map or merge) into float64,
+    whose values would otherwise be written as e.g. '1234.0'. Non integral values raise a TypeError.
+    """
+    columns = {
+        column.name: "Int64" for column in model.__table__.columns
+        if isinstance(column.type, Integer) and column.name in frame.columns and frame[column.name].dtype != "int64"
+    }
+    return frame.astype(columns) if columns else frame
+
+def bulk_insert_frame(session, model, frame, batch_size=100000) -> int:
+    """ bulk_insert() the rows of a pd.DataFrame whose columns are named after the table columns,
+    batch_size rows at a time. Returns the number of rows written
+    """
+    frame = integer_columns(model, frame)
+    columns = list(frame.columns)
+    for batch_start in range(0, len(frame), batch_size):
+        bulk_insert(session, model, columns, frame_rows(frame.iloc[batch_start:batch_start + batch_size]))
+    return len(frame)
+
+class IdAllocator(object):
+    """ Hands out primary keys for rows that are written with explicit ids, so link rows can reference
+    rows of the same batch. On PostgreSQL the ids are drawn from the id sequence of the table, so
+    several loaders can write to it at the same time. Elsewhere (SQLite) they continue after the
+    current maximum and only one loader may write to the table at a time.
+    """
+    # ids drawn from the sequence at once by __call__
+    PREFETCH = 1000
+
+    def __init__(self, session, model):
+        self.session = session
+        self.table_name = model.__table__.name
+        self.use_sequence = session.get_bind().dialect.name == "postgresql"
+        if not self.use_sequence:
+            self.next_id = (session.execute(select(func.max(model.id))).scalar() or 0) + 1
+        self.prefetched = []
+
+    def __call__(self) -> int:
+        if not self.prefetched:
+            self.prefetched = list(reversed(self.block(self.PREFETCH)))
+        return self.prefetched.pop()
+
+    def block(self, count: int) -> list:
+        """ count ids at once, in increasing order """
+        if count == 0:
+            return []
+        if self.use_sequence:
+            return sorted(self.session.execute(
+                text("SELECT nextval(pg_get_serial_sequence(:table_name, 'id')) FROM generate_series(1, :count)"),
+                {"table_name": self.table_name, "count": count}
+            ).scalars())
+        allocated = list(range(self.next_id, self.next_id + count))
+        self.next_id += count
+        return allocated
+
+class Throughput(object):
+    """ Counts written rows per table and reports them with the rate since the start """
+    def __init__(self):
+        self.start = time.time()
+        self.rows = dict()
+
+    def add(self, table_name: str, count: int) -> None:
+        self.rows[table_name] = self.rows.get(table_name, 0) + count
+
+    def report(self) -> str:
+        elapsed = max(time.time() - self.start, 1e-6)
+        return ", ".join(
+            f"{table_name}: {count} rows ({count / elapsed:.0f} rows/s)" for table_name, count in self.rows.items()
+        ) + f" in {elapsed:.1f}s"
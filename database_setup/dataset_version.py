@@ -0,0 +1,52 @@
+import sys
+sys.path.append("..")
+
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from strAPI.repeats.models import DatasetVersion
+
+# dataset_version holds a single row with this id
+DATASET_VERSION_ID = 1
+
+def seed_dataset_version(session):
+    """ Insert the dataset_version row if the table is empty, so bump_dataset_version() only has to
+    update it. Called by setup_db.py when the schema is created.
+    """
+    if session.execute(select(DatasetVersion.id)).first() is None:
+        session.add(DatasetVersion(id=DATASET_VERSION_ID, version=1))
+    session.commit()
+
+def bump_dataset_version(session, summary_refreshed: bool=False):
+    """ Increment the dataset version stamp and commit. Should be called at the end of every import
+    script, running API instances will then reload their cached panel and genome tables.
+
+    The version is incremented with a single UPDATE statement, so import scripts that run at the same
+    time (the chromosome partitions of db_setup.py) do not overwrite each other's increments.
+
+    Parameters
+    summary_refreshed (bool): True if the repeat_summary table is up to date with the new version
+
+    Returns
+    version (int):  The new dataset version
+    """
+    values = {"version": DatasetVersion.version + 1, "updated_at": datetime.utcnow()}
+    if summary_refreshed:
+        # the right hand side reads the version before the update
+        values["summary_version"] = DatasetVersion.version + 1
+    result = session.execute(update(DatasetVersion).values(**values))
+    if result.rowcount == 0:
+        # database created before setup_db.py seeded the row; if another import inserts it at the
+        # same time the primary key rejects the second row and that import increments it instead
+        try:
+            with session.begin_nested():
+                session.add(DatasetVersion(id=DATASET_VERSION_ID, version=1,
+                    summary_version=1 if summary_refreshed else None))
+        except IntegrityError:
+            session.execute(update(DatasetVersion).values(**values))
+    version = session.execute(select(func.max(DatasetVersion.version))).scalar()
+    session.commit()
+
+    return version
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+""" Gene metadata (symbol, name and entrez id) for ensembl gene ids, as used by gtf_to_sql.py.
+
+Lookups go through a local SQLite cache first. Genes that are not cached are passed to a resolver:
+MyGeneResolver fetches them from mygene.info in concurrent batches, FileResolver reads them from a
+local file for builds without network access. Whatever the resolver returns is written back to the
+cache, for mygene.info including the genes it could not find, so repeated imports do not query it
+again.
+"""
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mygene
+import pandas as pd
+
+QUERY_FIELDS = ["name", "symbol", "entrezgene"]
+
+def empty_gene_info():
+    """ Placeholder for genes without any information """
+    return {field: None for field in QUERY_FIELDS}
+
+class GeneInfoCache(object):
+    """ SQLite file mapping ensembl gene ids to their gene information. Genes that mygene.info does
+    not know are stored with all fields empty.
+    """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS gene_info "
+            "(ensembl_id TEXT PRIMARY KEY, symbol TEXT, name TEXT, entrezgene TEXT)"
+        )
+
+    def get(self, ensembl_ids) -> dict:
+        """ Cached information of the given genes, genes that are not in the cache are left out """
+        ensembl_ids = list(ensembl_ids)
+        gene_infos = dict()
+        # stay below the SQLite limit of host parameters per statement
+        for batch_start in range(0, len(ensembl_ids), 500):
+            batch = ensembl_ids[batch_start:batch_start + 500]
+            rows = self.connection.execute(
+                f"SELECT ensembl_id, symbol, name, entrezgene FROM gene_info WHERE ensembl_id IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            for ensembl_id, symbol, name, entrezgene in rows:
+                gene_infos[ensembl_id] = {"symbol": symbol, "name": name, "entrezgene": entrezgene}
+        return gene_infos
+
+    def put(self, gene_infos: dict) -> None:
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO gene_info (ensembl_id, symbol, name, entrezgene) VALUES (?, ?, ?, ?)",
+            [
+                (ensembl_id, info["symbol"], info["name"], info["entrezgene"])
+                for ensembl_id, info in gene_infos.items()
+            ]
+        )
+        self.connection.commit()
+
+class MyGeneResolver(object):
+    """ Fetches gene information from mygene.info, batch_size genes per request and up to workers
+    requests at the same time
+    """
+    # a gene that mygene.info does not know is cached as such
+    remember_not_found = True
+
+    def __init__(self, batch_size=1000, workers=4, retries=3):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.retries = retries
+
+    def fetch_batch(self, ensembl_ids) -> list:
+        for attempt in range(self.retries):
+            try:
+                return mygene.MyGeneInfo().getgenes(ensembl_ids, fields=",".join(QUERY_FIELDS), verbose=False)
+            except Exception:
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def __call__(self, ensembl_ids) -> dict:
+        ensembl_ids = sorted(ensembl_ids)
+        batches = [ensembl_ids[i:i + self.batch_size] for i in range(0, len(ensembl_ids), self.batch_size)]
+        gene_infos = dict()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for response in executor.map(self.fetch_batch, batches):
+                for result in response:
+                    if result.get("notfound"):
+                        continue
+                    # something was found, but a field can still be missing
+                    gene_info = {field: result.get(field) for field in QUERY_FIELDS}
+                    if gene_info["entrezgene"] is not None:
+                        gene_info["entrezgene"] = str(gene_info["entrezgene"])
+                    gene_infos[result["query"]] = gene_info
+        return gene_infos
+
+class FileResolver(object):
+    """ Reads gene information from a local csv, tsv or parquet file with the columns ensembl_id,
+    symbol, name and entrezgene, for imports without network access
+    """
+    # a gene missing from the file can still be found online later
+    remember_not_found = False
+
+    def __init__(self, path):
+        if path.endswith(".parquet"):
+            frame = pd.read_parquet(path)
+        else:
+            frame = pd.read_csv(path, sep="\t" if path.endswith((".tsv", ".txt")) else ",", dtype=str)
+        frame = frame.astype(object).where(frame.notna(), None)
+        self.gene_infos = {
+            row["ensembl_id"]: {field: row[field] for field in QUERY_FIELDS} for row in frame.to_dict("records")
+        }
+
+    def __call__(self, ensembl_ids) -> dict:
+        return {ensembl_id: self.gene_infos[ensembl_id] for ensembl_id in ensembl_ids if ensembl_id in self.gene_infos}
+
+def resolve_gene_info(ensembl_ids, cache=None, resolver=None) -> dict:
+    """ Gene information for every ensembl gene id
+
+    Parameters
+    ensembl_ids:    Ensembl gene ids without version number
+    cache:          GeneInfoCache consulted first and updated with the resolved genes, or None
+    resolver:       Callable mapping a list of ensembl ids to a dict of the ones it found (MyGeneResolver,
+                    FileResolver), or None to only use the cache
+
+    Returns
+    Dict mapping every ensembl id to a dict with the QUERY_FIELDS, all None for genes without information
+    """
+    ensembl_ids = set(ensembl_ids)
+    gene_infos = cache.get(ensembl_ids) if cache is not None else dict()
+    missing = ensembl_ids - gene_infos.keys()
+    print(f"Gene information for {len(gene_infos)} out of {len(ensembl_ids)} genes found in the cache")
+
+    if missing and resolver is not None:
+        resolved = resolver(missing)
+        if resolver.remember_not_found:
+            resolved.update({ensembl_id: empty_gene_info() for ensembl_id in missing - resolved.keys()})
+        if cache is not None:
+            cache.put(resolved)
+        gene_infos.update(resolved)
+
+    for ensembl_id in ensembl_ids - gene_infos.keys():
+        gene_infos[ensembl_id] = empty_gene_info()
+    not_found = sum(1 for info in gene_infos.values() if all(value is None for value in info.values()))
+    print(f"No gene information could be found for {not_found} out of {len(ensembl_ids)} genes")
+    return gene_infos
+
+def gene_info_resolver(gene_info_file=None, offline=False, batch_size=1000, workers=4):
+    """ Resolver for the command line options of the import scripts: the file if one is given,
+    otherwise mygene.info unless running offline
+    """
+    if gene_info_file is not None:
+        if not os.path.exists(gene_info_file):
+            raise FileNotFoundError(f"No gene information file was found at {gene_info_file}")
+        return FileResolver(gene_info_file)
+    if offline:
+        return None
+    return MyGeneResolver(batch_size=batch_size, workers=workers)
@@ -9,29 +9,46 @@ import pandas as pd
 import urllib.parse
 import urllib.request
 import gtfparse
-from sqlalchemy import Index
+from sqlalchemy import Index, select
 from sqlalchemy import exc
 from sqlalchemy.engine import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import NoResultFound
-import mygene
-from strAPI.repeats.models import Gene, Transcript, Exon, Genome
+from strAPI.repeats.models import Gene, Transcript, Exon, ExonTranscriptsLink, Genome
+from dataset_version import bump_dataset_version
+from gene_info import GeneInfoCache, resolve_gene_info, gene_info_resolver
+from bulk_load import bulk_insert_frame, IdAllocator, Throughput
+from strAPI.utils.binning import region_bin
 
 GENE_TYPE_NAME = "gene"
+# Feature rows that describe an exon, they follow the exon row they belong to in the gtf file
+EXON_FEATURES = ["exon", "CDS", "start_codon", "stop_codon"]
+GTF_COLUMNS = ["seqname", "feature", "start", "end", "strand", "gene_id", "gene_type", "transcript_id", "exon_id"]
+
+GENE_COLUMNS = [
+    "id", "ensembl_id", "ensembl_version_id", "entrez_id", "name", "description", "chr", "start", "end", "bin",
+    "strand", "genome_id"
+]
+TRANSCRIPT_COLUMNS = ["id", "ensembl_transcript", "start", "end", "gene_id"]
+EXON_COLUMNS = ["id", "ensembl_exon", "start", "end", "cds", "start_codon", "stop_codon"]
+
 def get_genome_annotations(gtf_handle, protein_coding=True):
     """ Parsing and optional filtering of gtf genome annotation file into pd.DataFrame
     """
-    gtf_df = gtfparse.read_gtf(gtf_handle)
+    gtf_df = gtfparse.read_gtf(
+        gtf_handle,
+        usecols=GTF_COLUMNS,
+        features={GENE_TYPE_NAME, "transcript", *EXON_FEATURES},
+        result_type="pandas"
+    )
 
     if protein_coding:
         # Select only protein coding genes from the gtf
         gtf_df = gtf_df.loc[(gtf_df["gene_type"] != "protein_coding")]
 
-    return gtf_df
+    return gtf_df.reset_index(drop=True)
 
-def add_genes(session, gtf_df, genome):
-    """ Get desired field values for all genes from a gtf data frame. For each gene in the gtf file,
-    create a Gene instance. Finally, add all encountered Genes to the session
+def add_genes(session, gtf_df, genome, gene_infos, throughput):
+    """ Get desired field values for all genes from a gtf data frame and write them to the genes table
 
     Parameters 
     session:        A SQLAlchemy session that is connected to a database where information from the genome
@@ -39,66 +56,46 @@ def add_genes(session, gtf_df, genome):
     gtf_df (pd.DataFrame):  
                     Pandas data frame of gtf genome annotation file. Specifically one produced
                     using gtfparse.read_gtf()
+    genome:         Genome the genes belong to
+    gene_infos:     Dict mapping ensembl gene ids to their symbol, name and entrezgene, see query_gene_info()
+    throughput:     bulk_load.Throughput counting the written rows
+
+    Returns
+    pd.Series mapping gtf gene_id (with version number) to the id of the gene in the database
     """
-    gene_list = []
-    gene_infos = query_gene_info(gtf_df)
-    
+    genes = gtf_df.loc[(gtf_df["feature"] == GENE_TYPE_NAME)]
+    ensembl_ids = genes["gene_id"].str.split(".").str[0]  # emsebl gene id without version number
+    infos = pd.DataFrame.from_dict(
+        {ensembl_id: gene_infos[ensembl_id] for ensembl_id in ensembl_ids.unique()}, orient="index"
+    ).reindex(ensembl_ids)
+
+    gene_rows = pd.DataFrame({
+        "id": IdAllocator(session, Gene).block(len(genes)),
+        "ensembl_id": ensembl_ids.values,
+        "ensembl_version_id": genes["gene_id"].values,
+        "entrez_id": infos["entrezgene"].values,
+        "name": infos["symbol"].values,
+        "description": infos["name"].values,
+        "chr": genes["seqname"].values,
+        "start": genes["start"].values,
+        "end": genes["end"].values,
+        "bin": [region_bin(start, end) for start, end in zip(genes["start"], genes["end"])],
+        "strand": genes["strand"].values,
+        "genome_id": genome.id
+    })
+    throughput.add("genes", bulk_insert_frame(session, Gene, gene_rows[GENE_COLUMNS]))
+    return pd.Series(gene_rows["id"].values, index=gene_rows["ensembl_version_id"].values)
+
+def query_gene_info(gtf_df, cache=None, resolver=None):
+    """ Gene information (symbol, name and entrezgene) for all genes in a gtf data frame, see
+    gene_info.resolve_gene_info()
+    """
+    ensembl_ids = set(gtf_df.loc[(gtf_df["feature"] == GENE_TYPE_NAME), "gene_id"].str.split(".").str[0])
+    return resolve_gene_info(ensembl_ids, cache=cache, resolver=resolver)
 
-    for index, row in gtf_df.loc[(gtf_df["feature"] == "gene")].iterrows():
-        ensembl_id = row["gene_id"].split(".")[0]  # emsebl gene id without version number
-        gene_info = gene_infos[ensembl_id]
-
-        gene = Gene(
-                ensembl_id = ensembl_id,
-                ensembl_version_id = row["gene_id"],
-                entrez_id = gene_info["entrezgene"],
-                name = gene_info["symbol"],
-                description = gene_info["name"],
-                chr = row["seqname"],
-                start = row["start"],
-                end = row["end"],
-                strand = row["strand"],
-                genome_id = genome.id
-            )
-       
-        gene_list.append(gene)
-        genome.genes.append(gene)
-    session.add_all(gene_list)
-
-def query_gene_info(gtf_df, query_fields=["name", "symbol", "entrezgene"]):    
-    ensembl_ids = set()
-    for index, row in gtf_df.loc[(gtf_df["feature"] == "gene")].iterrows():
-        ensembl_ids.add(row["gene_id"].split(".")[0])
-    response = mygene.MyGeneInfo().getgenes(ensembl_ids, fields=",".join(query_fields))
-    
-    gene_infos = dict()
-    not_found_counter = 0
-    for result in response:
-        try:
-            # create placeholder dict if no info was found
-            if result['notfound']:
-                gene_infos[result['query']] = {                    
-                    "symbol": None,
-                    "name": None,
-                    "entrezgene": None,
-                }
-                not_found_counter += 1
-                continue
-        except KeyError:
-            # something was found, but need to check for each field whether it was found or not
-            # otherwise they will be missing and KeyErrors will be raised later on
-            for field in query_fields:
-                    try:
-                        result[field]
-                    except KeyError:
-                        result[field] = None
-        gene_infos[result['query']] = result
-    print(f"No gene information could be found for {not_found_counter} out of {len(ensembl_ids)} genes")
-    return gene_infos
-
-def add_transcripts(session, gtf_df):
-    """ Get desired field values for all transcripts from a gtf data frame, add them to their respective
-    genes in the session
+def add_transcripts(session, gtf_df, gene_ids, throughput):
+    """ Get desired field values for all transcripts from a gtf data frame and write them to the
+    transcripts table, linked to their genes
 
     Parameters
     session:        A SQLAlchemy session that is connected to a database where information from the genome
@@ -106,21 +103,31 @@ def add_transcripts(session, gtf_df):
     gtf_df (pd.DataFrame):  
                     Pandas data frame of gtf genome annotation file. Specifically one produced
                     using gtfparse.read_gtf()
+    gene_ids:       pd.Series mapping gtf gene_id to database id, as returned by add_genes()
+    throughput:     bulk_load.Throughput counting the written rows
+
+    Returns
+    pd.Series mapping ensembl transcript id to the id of the transcript in the database
     """
-    for index, row in gtf_df.loc[(gtf_df["feature"] == "transcript")].iterrows():     
-        ensembl_id = row["gene_id"].split(".")[0]  # emsebl gene id without version number
-        gene = session.query(Gene).filter_by(ensembl_id = ensembl_id).one()
-        gene.transcripts.append(
-            Transcript(
-                ensembl_transcript=row["transcript_id"],
-                start=row["start"],
-                end=row["end"]
-            )
-        )
-
-def add_exons(session, gtf_df):
-    """ Get desired field values for all exons from a gtf data frame, add them to their transcripts
-    in the session
+    transcripts = gtf_df.loc[(gtf_df["feature"] == "transcript")]
+    transcript_rows = pd.DataFrame({
+        "id": IdAllocator(session, Transcript).block(len(transcripts)),
+        "ensembl_transcript": transcripts["transcript_id"].values,
+        "start": transcripts["start"].values,
+        "end": transcripts["end"].values,
+        "gene_id": transcripts["gene_id"].map(gene_ids).astype("Int64").values
+    })
+    missing = transcript_rows["gene_id"].isna()
+    if missing.any():
+        raise ValueError(f"{missing.sum()} transcripts belong to genes that are not in the gtf file, "
+                         f"e.g. {transcript_rows.loc[missing, 'ensembl_transcript'].iloc[0]}")
+
+    throughput.add("transcripts", bulk_insert_frame(session, Transcript, transcript_rows[TRANSCRIPT_COLUMNS]))
+    return pd.Series(transcript_rows["id"].values, index=transcript_rows["ensembl_transcript"].values)
+
+def add_exons(session, gtf_df, transcript_ids, throughput):
+    """ Get desired field values for all exons from a gtf data frame, write the exons that are not in
+    the database yet and link all of them to their transcripts
     
     Parameters
     session:        A SQLAlchemy session that is connected to a database where information from the genome
@@ -128,39 +135,44 @@ def add_exons(session, gtf_df):
     gtf_df (pd.DataFrame):  
                     Pandas data frame of gtf genome annotation file. Specifically one produced
                     using gtfparse.read_gtf()
+    transcript_ids: pd.Series mapping ensembl transcript id to database id, as returned by add_transcripts()
+    throughput:     bulk_load.Throughput counting the written rows
     """        
     # Multiple successive rows in the gtf file describe different features for one exon: exon, CDS, start_codon and stop_codon
     ## One exon can also appear multiple times in the same gtf file (for different transcripts)
-    for index, row in gtf_df[gtf_df["feature"].isin({"exon", "CDS", "start_codon", "stop_codon"})].iterrows():
-        if row["feature"] == "exon":   
-            skip = False
-            # get the transript the exon belongs to from the session
-            transcript = session.query(Transcript).filter_by(ensembl_transcript = row["transcript_id"]).one()
-            # get exon id from the row            
-            ensembl_exon=row["exon_id"]            
-            try:
-                # if an Exon with this id was already generated for a prior Transcript, just add the Exon to
-                ## the current Transcript. Also skip the next few rows that contain info on Exon features as 
-                ### they should already be known from previous encounter
-                existing_exon = session.query(Exon).filter_by(ensembl_exon=ensembl_exon).one()
-                transcript.exons.append(existing_exon)
-                skip = True
-            except NoResultFound:
-                # Exon was not observed before, make new Exon and parse feature information from the next few rows in the file
-                new_exon = Exon(ensembl_exon=row["exon_id"], start=row["start"], end=row["end"], cds=False)            
-                transcript.exons.append(new_exon)
-
-        elif row["feature"] == "CDS" and not skip:
-            # does the exon contain coding sequence?
-            new_exon.cds = True
-
-        elif row["feature"] == "start_codon" and not skip:
-            # does the exon contain a start codon? If so: store the first position of the start codon
-            new_exon.start_codon = row["start"]
-
-        elif row["feature"] == "stop_codon" and not skip:
-            # does the exon contain a stop codon? If so: store the first position of the stop codon
-            new_exon.stop_codon = row["start"]
+    features = gtf_df.loc[gtf_df["feature"].isin(EXON_FEATURES), ["feature", "start", "end", "transcript_id", "exon_id"]]
+    # number every feature row with the exon row it follows
+    features = features.assign(exon_row=(features["feature"] == "exon").cumsum())
+    exons = features.loc[features["feature"] == "exon"].set_index("exon_row")
+
+    # An Exon is made from its first encounter in the file (unless it is in the database already), the
+    ## feature rows after later encounters are skipped as they should already be known
+    existing_exon_ids = pd.Series(dict(session.execute(select(Exon.ensembl_exon, Exon.id)).all()), dtype="int64")
+    new_exons = exons.loc[~exons["exon_id"].duplicated() & ~exons["exon_id"].isin(existing_exon_ids.index)]
+
+    def feature_rows(feature):
+        return features.loc[(features["feature"] == feature) & features["exon_row"].isin(new_exons.index)]
+
+    exon_rows = pd.DataFrame({
+        "id": IdAllocator(session, Exon).block(len(new_exons)),
+        "ensembl_exon": new_exons["exon_id"].values,
+        "start": new_exons["start"].values,
+        "end": new_exons["end"].values,
+        # does the exon contain coding sequence?
+        "cds": new_exons.index.isin(feature_rows("CDS")["exon_row"]),
+        # first position of the start and stop codon contained in the exon, if any (reindex leaves
+        ## NaN for the other exons, Int64 keeps the positions integers)
+        "start_codon": feature_rows("start_codon").groupby("exon_row")["start"].last().reindex(new_exons.index).astype("Int64").values,
+        "stop_codon": feature_rows("stop_codon").groupby("exon_row")["start"].last().reindex(new_exons.index).astype("Int64").values
+    })
+    throughput.add("exons", bulk_insert_frame(session, Exon, exon_rows[EXON_COLUMNS]))
+
+    exon_ids = pd.concat([existing_exon_ids, pd.Series(exon_rows["id"].values, index=exon_rows["ensembl_exon"].values)])
+    links = pd.DataFrame({
+        "exon_id": exons["exon_id"].map(exon_ids).astype("Int64").values,
+        "transcript_id": exons["transcript_id"].map(transcript_ids).astype("Int64").values
+    }).drop_duplicates()
+    throughput.add("exons_transcripts", bulk_insert_frame(session, ExonTranscriptsLink, links))
 
 def connection_setup(db_path):
     # check if database exists
@@ -188,6 +200,18 @@ def cla_parser():
     parser.add_argument(
         "--assembly", "-a", type=str, required=True, help="Genome assembly name in db"
     )
+    parser.add_argument(
+        "--gene_info_cache", type=str, default="gene_info.sqlite", help="SQLite file caching gene symbols, names and entrez ids between imports"
+    )
+    parser.add_argument(
+        "--gene_info_file", type=str, default=None, help="Read gene information from this csv, tsv or parquet file (columns ensembl_id, symbol, name, entrezgene) instead of mygene.info"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="Do not query mygene.info, genes that are neither cached nor in --gene_info_file get no symbol, name or entrez id"
+    )
+    parser.add_argument(
+        "--mygene_workers", type=int, default=4, help="Number of concurrent requests to mygene.info"
+    )
 
     return parser.parse_args()
 
@@ -212,14 +236,22 @@ def main():
 
     genome = session.query(Genome).filter(Genome.version == assembly).one()
 
-    # add genes, transcripts and exons from the gtf file to the session
-    add_genes(session, gtf_df, genome)
-    add_transcripts(session, gtf_df)
-    add_exons(session, gtf_df)
+    gene_infos = query_gene_info(
+        gtf_df,
+        cache=GeneInfoCache(args.gene_info_cache),
+        resolver=gene_info_resolver(args.gene_info_file, offline=args.offline, workers=args.mygene_workers)
+    )
+
+    # write genes, transcripts and exons from the gtf file to the database
+    throughput = Throughput()
+    gene_ids = add_genes(session, gtf_df, genome, gene_infos, throughput)
+    transcript_ids = add_transcripts(session, gtf_df, gene_ids, throughput)
+    add_exons(session, gtf_df, transcript_ids, throughput)
 
     # commit new additions to the database before adding indexes, otherwise sqlalchemy will complain
     ## that the 'database is locked'
     session.commit()
+    print(f"Inserted {throughput.report()}")
 
     # add indexes to row that will likely be queried a lot
     # ensembl ID columns for Gene, Transcript, Exon
@@ -229,6 +261,7 @@ def main():
 
     # commit
     session.commit()
+    bump_dataset_version(session)
 
 if __name__ == "__main__":
     main()
@@ -13,78 +13,73 @@ Script can be run multiple times. It will update existing records and insert new
 import argparse
 import logging
 from gtf_to_sql import connection_setup
+from dataset_version import bump_dataset_version
 import pandas as pd
+from sqlalchemy import select
 
 from strAPI.repeats.models import Gene, Repeat, CRCExprRepeatLenCorr, TRPanel
-
-
-def update_db_record(df_row, session, genes_by_code, inserted_entities):
-
-    gangstr_crc_hg38_panel = session.query(TRPanel).filter_by(name='gangstr_crc_hg38').first()
-        
-    def get_repeat(tmp_id, range=False):
+from strAPI.utils.intervals import IntervalIndex
+from upsert import upsert_frame
+
+
+class RepeatLookup(object):
+    """ Repeats of the gangstr_crc_hg38 tr panel held in memory, found by start position or by a
+    position within them
+    """
+    def __init__(self, session):
+        gangstr_crc_hg38_panel = session.query(TRPanel).filter_by(name='gangstr_crc_hg38').first()
+        self.by_start = dict()
+        self.by_region = IntervalIndex()
+        repeats = session.execute(select(Repeat.id, Repeat.chr, Repeat.start, Repeat.end).where(
+            Repeat.trpanel_id == gangstr_crc_hg38_panel.id).order_by(Repeat.id))
+        for repeat in repeats:
+            self.by_start.setdefault((repeat.chr, repeat.start), []).append(repeat)
+            self.by_region.add(repeat.chr, repeat.start, repeat.end, repeat)
+
+    def get_repeat(self, tmp_id, range=False):
         chr, start = tmp_id.split("_")
+        chr = chr.lower()
         start = int(start)
-        # filterning only repeats from gangstr_crc_hg38 tr panel
-        query = session.query(Repeat).filter_by(chr=chr.lower()).filter_by(
-            trpanel_id=gangstr_crc_hg38_panel.id)
         if range:
-            query = query.filter(Repeat.start<=start).filter(Repeat.end>start)
+            result = [repeat for repeat in self.by_region.overlapping(chr, start, start) if repeat.end > start]
         else:
-            query = query.filter_by(start=start)
+            result = self.by_start.get((chr, start), [])
 
-        result = query.limit(2).all()
         if len(result) > 1:
             logging.warning(f"More than one repeat found for {tmp_id} \n{result[0]} \n{result[1]}")
 
         return result[0] if len(result) > 0 else None
 
-    repeat = get_repeat(df_row["tmp_id"].strip())
-    gene = genes_by_code.get(df_row["gene"].strip())
 
-    repeat_id = None
-    gene_id = None
- 
+def find_repeat(tmp_id, repeats):
+    """ The repeat at the position of tmp_id (chr_start), or the repeat containing it """
+    repeat = repeats.get_repeat(tmp_id)
     if repeat is None:
-        logging.info(
-            f"Repeat {len(inserted_entities)} with code {df_row['tmp_id']} not found in database. Range search can help.")
-        repeat = get_repeat(df_row["tmp_id"].strip(), range=True)
+        logging.info(f"Repeat with code {tmp_id} not found in database. Range search can help.")
+        repeat = repeats.get_repeat(tmp_id, range=True)
         if repeat is None:
-            logging.info(
-                    f"Repeat {len(inserted_entities)} with code {df_row['tmp_id']} not found in database.")
-        
-    if gene is None:
-        logging.info(
-            f"Gene {len(inserted_entities)} with code {df_row['gene']} not found in database.")
-
-    if repeat is not None and gene is not None:
-        gene_id = gene.id
-        repeat_id = repeat.id
-    else:
-        return
-
-    entity = session.query(CRCExprRepeatLenCorr).filter_by(
-        repeat_id=repeat_id,
-        gene_id=gene_id
-    ).first()
-
-    if entity is None:
-
-        entity = CRCExprRepeatLenCorr(
-            repeat_id   = repeat_id,
-            gene_id     = gene_id
-        )
-
-        session.add(entity)
-    
-    entity.gene_id = gene_id
-    entity.repeat_id = repeat_id
-    entity.coefficient = df_row["coefficient"]
-    entity.intercept = df_row["intercept"]
-    entity.p_value = df_row["pvalue_coef"]
-    entity.p_value_corrected = df_row["pvalue_corrected"]
-
-    inserted_entities.append(entity)
+            logging.info(f"Repeat with code {tmp_id} not found in database.")
+    return repeat
+
+def make_db_records(data_frame, genes_by_code, repeats):
+    """ crc_expr_repeatlen_corr rows for the csv rows whose repeat and gene are in the database """
+    repeat_ids = [
+        None if repeat is None else repeat.id
+        for repeat in (find_repeat(tmp_id.strip(), repeats) for tmp_id in data_frame["tmp_id"])
+    ]
+    gene_ids = data_frame["gene"].str.strip().map(genes_by_code)
+    for gene_code in data_frame.loc[gene_ids.isna(), "gene"]:
+        logging.info(f"Gene with code {gene_code} not found in database.")
+
+    records = pd.DataFrame({
+        "repeat_id": pd.array(repeat_ids, dtype="Int64"),
+        "gene_id": gene_ids.astype("Int64").values,
+        "coefficient": data_frame["coefficient"].values,
+        "intercept": data_frame["intercept"].values,
+        "p_value": data_frame["pvalue_coef"].values,
+        "p_value_corrected": data_frame["pvalue_corrected"].values
+    })
+    return records.dropna(subset=["repeat_id", "gene_id"])
 
 
 def cla_parser():
@@ -109,25 +104,25 @@ def main():
     logging.info("Connecting to the database")
     engine, session = connection_setup(db_path)
 
-    inserted_entities = []
-
     logging.info("Getting all genes from database")
-    genes_by_ensemble_code = {}
-    for gene in session.query(Gene).all():
-        genes_by_ensemble_code[gene.ensembl_id] = gene
+    genes_by_ensemble_code = dict(session.execute(select(Gene.ensembl_id, Gene.id)).all())
     logging.info(f"Got {len(genes_by_ensemble_code)} genes from database")
 
+    logging.info("Getting gangstr_crc_hg38 repeats from database")
+    repeats = RepeatLookup(session)
+
     logging.info("Inserting gene expretion and repeat length correlation")
     data_frame = pd.read_csv(input_path)
     input_csv_len = len(data_frame)
-    data_frame.apply(lambda row: update_db_record(row, session,
-                     genes_by_ensemble_code, inserted_entities), axis=1)
+    records = make_db_records(data_frame, genes_by_ensemble_code, repeats)
+    inserted_entities = upsert_frame(session, CRCExprRepeatLenCorr, records, update=True)
     logging.info(
         f"""
-            Inserted or updated {len(inserted_entities)} entities out of {input_csv_len}
+            Inserted or updated {inserted_entities} entities out of {input_csv_len}
         """)
 
     session.commit()
+    bump_dataset_version(session)
 
     logging.info("Inserting gene expretion and repeat length correlation")
 
@@ -1,16 +1,32 @@
 #!/usr/bin/env python3
+""" Import of the EnsembleTR panel: links the EnsembleTR repeats in the database to their genes and
+adds their 1000 Genomes allele frequencies.
+
+Every chromosome file is streamed in chunks and joined to the repeats in the database by
+coordinates, links and allele frequencies that are already in the database are skipped, so the
+import can be rerun. Chromosome files are processed in parallel worker processes.
+"""
 import argparse
 import pandas as pd
 import numpy as np 
 import json
-from sqlalchemy import exc 
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select
 import sys 
 import os
 
 sys.path.append("..")
 
-from strAPI.repeats.models import Gene, Repeat, TRPanel, AlleleFrequency
+from strAPI.repeats.models import Gene, Repeat, GenesRepeatsLink, AlleleFrequency
 from gtf_to_sql import connection_setup
+from dataset_version import bump_dataset_version
+from bulk_load import bulk_insert_frame, Throughput
+
+# Rows read from a repeats or allele frequency file at once
+CHUNK_SIZE = 100000
+# 1000 Genomes populations in the allele frequency files
+POPULATIONS = ["AFR", "AMR", "EAS", "SAS", "EUR"]
+AFREQ_COLUMNS = ["population", "n_effective", "frequency", "het", "num_called", "repeat_id"]
 
 def cla_parser():
     parser = argparse.ArgumentParser()
@@ -19,7 +35,22 @@ def cla_parser():
         "--db", "-d", type=str, required=True, help="Path to db"
     )
     parser.add_argument(
-        "--afreqs", "-a", type=str, default=True, required=True, help="Import allele frequencies"
+        "--afreqs", "-a", type=str, default=True, required=True, help="Import allele frequencies (true or false)"
+    )
+    parser.add_argument(
+        "--repeats_dir", type=str, default="../data/repeats/EnsembleTR/repeats/", help="Directory with one repeats file per chromosome"
+    )
+    parser.add_argument(
+        "--afreqs_dir", type=str, default="../data/repeats/EnsembleTR/afreqs/", help="Directory with the afreq_het_<chr>.csv allele frequency files"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=CHUNK_SIZE, help="Number of rows read from a file at once"
+    )
+    parser.add_argument(
+        "--files", type=str, nargs="+", default=None, help="Only import these files of --repeats_dir"
+    )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=os.cpu_count(), help="Number of chromosome files imported in parallel"
     )
      
     return parser.parse_args()
@@ -59,131 +90,164 @@ def make_correct_csv_repeats(repeats_df):
     """
     return repeats_df
 
+class DatabaseRows(object):
+    """ EnsembleTR repeats in the database with their existing gene links and allele frequencies,
+    loaded per chromosome the first time it is encountered. Gene links inserted by this import are
+    added to gene_links as well.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.repeats = dict()
+        self.gene_links = []
+        self.afreq_repeat_ids = set()
+
+    def load(self, chroms):
+        for chrom in set(chroms) - self.repeats.keys():
+            ensembltr_repeats = (Repeat.source == 'EnsembleTR', Repeat.chr == chrom)
+            repeats = pd.DataFrame(
+                self.session.execute(select(Repeat.id, Repeat.chr, Repeat.start, Repeat.end).where(*ensembltr_repeats)).all(),
+                columns=["repeat_id", "chr", "start", "end"]
+            )
+            duplicated = repeats.duplicated(["chr", "start", "end"])
+            if duplicated.any():
+                print(f"WARNING: {duplicated.sum()} EnsembleTR repeats on {chrom} share their coordinates with another one, using the first")
+            self.repeats[chrom] = repeats.loc[~duplicated]
+
+            self.gene_links.append(pd.DataFrame(
+                self.session.execute(select(GenesRepeatsLink.repeat_id, GenesRepeatsLink.gene_id).join(
+                    Repeat, Repeat.id == GenesRepeatsLink.repeat_id).where(*ensembltr_repeats)).all(),
+                columns=["repeat_id", "gene_id"]
+            ))
+            self.afreq_repeat_ids.update(self.session.execute(select(AlleleFrequency.repeat_id).join(
+                Repeat, Repeat.id == AlleleFrequency.repeat_id).where(*ensembltr_repeats).distinct()).scalars())
+
+    def match(self, repeats_df):
+        """ repeats_df with the id of the database repeat at the same coordinates, rows without one are dropped """
+        chroms = repeats_df["chr"].unique()
+        self.load(chroms)
+        db_repeats = pd.concat([self.repeats[chrom] for chrom in chroms])
+        return repeats_df.merge(db_repeats, on=["chr", "start", "end"], how="inner")
+
+    def new_gene_links(self, links):
+        """ links (repeat_id, gene_id) that are not in the database yet, they are recorded as existing
+        so the same link in a later chunk is skipped
+        """
+        existing = pd.concat(self.gene_links)
+        links = links.merge(existing, on=["repeat_id", "gene_id"], how="left", indicator=True)
+        links = links.loc[links["_merge"] == "left_only", ["repeat_id", "gene_id"]]
+        self.gene_links.append(links)
+        return links
+
+def make_gene_links(repeats_df, gene_ids):
+    """ genes_repeats rows for matched repeats, from their list of gene ids ('-' for none) """
+    links = repeats_df[["repeat_id", "gene"]].explode("gene")
+    links = links.loc[links["gene"].notna() & (links["gene"] != "-")]
+    links = links.assign(gene_id=links["gene"].map(gene_ids))
+    unknown = links["gene_id"].isna()
+    if unknown.any():
+        print(f"Couldn't find {unknown.sum()} genes in our db, e.g. {links.loc[unknown, 'gene'].iloc[0]}")
+    links = links.loc[~unknown, ["repeat_id", "gene_id"]].astype("int64")
+    return links.drop_duplicates()
+
+def make_allele_frequencies(afreqs_df):
+    """ allele_frequencies rows, one per population and allele, from the per repeat rows of an
+    afreq_het file joined to their repeat_id
+    """
+    rows = []
+    for population in POPULATIONS:
+        for repeat_id, afreqs, het, num_called in zip(
+                afreqs_df["repeat_id"], afreqs_df[f"afreq_{population}"],
+                afreqs_df[f"het_{population}"], afreqs_df[f"numcalled_{population}"]):
+            if not isinstance(afreqs, str) or not afreqs:
+                continue
+            for length, frequency in json.loads(afreqs).items():
+                rows.append((f"1000 Genomes {population}", int(float(length)), frequency, het, num_called, repeat_id))
+    afreq_rows = pd.DataFrame(rows, columns=AFREQ_COLUMNS)
+    afreq_rows["num_called"] = pd.to_numeric(afreq_rows["num_called"]).astype("Int64")
+    return afreq_rows
+
+def import_chromosome(db_path, repeats_path, afreqs_folder, import_allele_freqs, chunksize):
+    """ Import one repeats file and its allele frequency file in a single transaction
+
+    Returns
+    Dict with the number of rows read, matched and written
+    """
+    engine, session = connection_setup(db_path)
+    gene_ids = pd.Series(dict(session.execute(select(Gene.ensembl_version_id, Gene.id)).all()), dtype="int64")
+    db_rows = DatabaseRows(session)
+    counts = {"repeats read": 0, "repeats found": 0, "genes_repeats": 0, "allele_frequencies": 0}
+    repeat_ids = []
+    current_chr = None
+
+    print(repeats_path)
+    for repeats_df in pd.read_table(repeats_path, converters={'Gene': json.loads}, chunksize=chunksize):
+        repeats_df = make_correct_csv_repeats(repeats_df)
+        if current_chr is None:
+            current_chr = repeats_df['chr'].iloc[0]
+
+        matched = db_rows.match(repeats_df)
+        counts["repeats read"] += len(repeats_df)
+        counts["repeats found"] += len(matched)
+        links = db_rows.new_gene_links(make_gene_links(matched, gene_ids))
+        counts["genes_repeats"] += bulk_insert_frame(session, GenesRepeatsLink, links)
+        repeat_ids.append(matched[["ID", "repeat_id"]])
+
+    if import_allele_freqs and current_chr is not None:
+        repeat_ids = pd.concat(repeat_ids).drop_duplicates("ID")
+        # file rows with different IDs can match the same database repeat, which gets the allele
+        # frequencies of the first one only
+        duplicated = repeat_ids.duplicated("repeat_id")
+        if duplicated.any():
+            print(f"WARNING: {duplicated.sum()} EnsembleTR IDs on {current_chr} match a repeat that was matched before, skipping their allele frequencies")
+            repeat_ids = repeat_ids.loc[~duplicated]
+        # repeats that got their allele frequencies in an earlier import are skipped
+        repeat_ids = repeat_ids.loc[~repeat_ids["repeat_id"].isin(db_rows.afreq_repeat_ids)]
+
+        afreqs_file = os.path.join(afreqs_folder, 'afreq_het_' + current_chr + '.csv')
+        print(afreqs_file)
+        afreq_dtypes = {f"afreq_{population}": str for population in POPULATIONS}
+        for afreqs_df in pd.read_table(afreqs_file, dtype=afreq_dtypes, keep_default_na=False, na_values={
+                column: [""] for population in POPULATIONS for column in (f"het_{population}", f"numcalled_{population}")},
+                chunksize=chunksize):
+            afreqs_df = afreqs_df.merge(repeat_ids, on="ID", how="inner")
+            counts["allele_frequencies"] += bulk_insert_frame(session, AlleleFrequency, make_allele_frequencies(afreqs_df))
+
+    session.commit()
+    print(f"{repeats_path}: found {counts['repeats found']} of {counts['repeats read']} repeats in db, "
+          f"added {counts['genes_repeats']} gene links and {counts['allele_frequencies']} allele frequencies")
+    return counts
+
+def import_job(job):
+    return import_chromosome(*job)
+
 def main():
     args = cla_parser()
     db_path = args.db
     db_path = db_path.replace("postgres://", "postgresql+psycopg2://") 
 
-    import_allele_freqs = args.afreqs
+    import_allele_freqs = str(args.afreqs).lower() in ("true", "yes", "1")
     
-    repeats_folder = '../data/repeats/EnsembleTR/repeats/'
-    afreqs_folder = '../data/repeats/EnsembleTR/afreqs/'
-    repeats_files = [f for f in os.listdir(repeats_folder) if os.path.isfile(os.path.join(repeats_folder, f))]
-   
-    for repeats_file in repeats_files:
-        print(repeats_folder + repeats_file)
-        repeats_df = pd.read_table(repeats_folder + repeats_file, converters={'Gene': json.loads})
-        repeats_df = make_correct_csv_repeats(repeats_df)
-   
-        current_chr = repeats_df['chr'].iloc[0]
+    repeats_folder = args.repeats_dir
+    repeats_files = sorted(
+        os.path.join(repeats_folder, f) for f in os.listdir(repeats_folder)
+        if os.path.isfile(os.path.join(repeats_folder, f)) and (args.files is None or f in args.files)
+    )
+    workers = max(1, min(args.workers, len(repeats_files)))
+    if db_path.startswith("sqlite"):
+        # SQLite allows only one writer at a time
+        workers = 1
 
-        afreqs_file = afreqs_folder + 'afreq_het_' + current_chr +'.csv'
-        print(afreqs_file)
-        
-        afreqs_df = pd.read_table(afreqs_file, converters={'afreq_AFR': json.loads('' or '{}'),
-                                                           'afreq_AMR': json.loads('' or '{}'), 
-                                                           'afreq_EAS': json.loads('' or '{}'),
-                                                            'afreq_SAS': json.loads('' or '{}'),
-                                                            'afreq_EUR': json.loads('' or '{}') },
-                                                         )
-
-        engine, session = connection_setup(db_path)
-        print(afreqs_df)
-
-        for i, repeat in repeats_df.iterrows():
-            print("Checking if repeat already exists")
-            #print(Repeat.__table__.columns.keys())
-            db_repeat = session.query(Repeat).filter ( 
-                            Repeat.source == 'EnsembleTR',
-                            Repeat.start == repeat.start,
-                            Repeat.end == repeat.end,
-                            Repeat.chr == repeat.chr
-                        ).one_or_none()
-            #print(db_repeat)
-            if db_repeat is not None: 
-                print("Found repeat in db")
-                gene_ids = repeat["gene"]
-                print(gene_ids)
-                afreqs = afreqs_df[afreqs_df.ID == repeat.ID] 
-                if False:
-                    db_afreqs = None
-                    #db_afreqs = session.query(AlleleFrequency).filter(AlleleFrequency.repeat_id ==  db_repeat.id).one_or_none()
-            
-                    if db_afreqs is None:
-                        print("Starting to populate afreqs")
-                        # "1000 Genomes Africa" 
-                        afr_freqs = json.loads(afreqs["afreq_AFR"].values[0])
-                        for l, freq in afr_freqs.items():
-                            db_afreqs = AlleleFrequency(
-                                population = "1000 Genomes AFR",
-                                n_effective = int(float(l)),
-                                frequency = freq,
-                                het = afreqs["het_AFR"],
-                                num_called = afreqs["numcalled_AFR"],
-                                repeat_id = db_repeat.id
-                            )
-                            
-                            db_repeat.allfreqs.append(db_afreqs)
-                        amr_freqs = json.loads(afreqs["afreq_AMR"].values[0])
-                        for l, freq in amr_freqs.items():
-                            db_afreqs = AlleleFrequency(
-                                population = "1000 Genomes AMR",
-                                n_effective = int(float(l)),
-                                frequency = freq,
-                                het = afreqs["het_AMR"],
-                                num_called = afreqs["numcalled_AMR"],
-                                repeat_id = db_repeat.id
-                            )
-                            db_repeat.allfreqs.append(db_afreqs)
-                        eas_freqs = json.loads(afreqs["afreq_EAS"].values[0])
-                        for l, freq in eas_freqs.items():
-                            db_afreqs = AlleleFrequency(
-                                population = "1000 Genomes EAS",
-                                n_effective = int(float(l)),
-                                frequency = freq,
-                                het = afreqs["het_EAS"],
-                                num_called = afreqs["numcalled_EAS"],
-                                repeat_id = db_repeat.id
-                            )
-                            db_repeat.allfreqs.append(db_afreqs)
-                        sas_freqs = json.loads(afreqs["afreq_SAS"].values[0])
-                        for l, freq in sas_freqs.items():
-                            db_afreqs = AlleleFrequency(
-                                population = "1000 Genomes SAS",
-                                n_effective = int(float(l)),
-                                frequency = freq,
-                                het = afreqs["het_SAS"],
-                                num_called = afreqs["numcalled_SAS"],
-                                repeat_id = db_repeat.id
-                            )
-                            db_repeat.allfreqs.append(db_afreqs)
-                        eur_freqs = json.loads(afreqs["afreq_EUR"].values[0])
-                        for l, freq in eur_freqs.items():
-                            db_afreqs = AlleleFrequency(
-                                population = "1000 Genomes EUR",
-                                n_effective = int(float(l)),
-                                frequency = freq,
-                                het = afreqs["het_EUR"],
-                                num_called = afreqs["numcalled_EUR"],
-                                repeat_id = db_repeat.id
-                            )
-                            db_repeat.allfreqs.append(db_afreqs)
-                  
-                for gene_id in gene_ids:
-                    if gene_id != "-":
-                        try:
-                            print(gene_id)
-                            db_gene = session.query(Gene).filter(Gene.ensembl_version_id == gene_id).one()
-                            # Add relationship to gene 
-                            db_gene.repeats.append(db_repeat)
-                            print(db_repeat.id, db_gene.id)
-                        except exc.NoResultFound: 
-                            print("couldnt find gene in our db")
-                
-            else: 
-                print("Coulnd't find this repeat in db")
-        
-        session.commit()
+    throughput = Throughput()
+    jobs = [(db_path, repeats_file, args.afreqs_dir, import_allele_freqs, args.chunksize) for repeats_file in repeats_files]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(import_job, jobs) if workers > 1 else map(import_job, jobs)
+        for counts in results:
+            for name, count in counts.items():
+                throughput.add(name, count)
+    print(f"Imported {throughput.report()}")
+
+    engine, session = connection_setup(db_path)
+    bump_dataset_version(session)
  
 if __name__ == "__main__":
     main()
@@ -6,10 +6,23 @@ import sys
 sys.path.append("..")
 
 from tral.repeat_list.repeat_list import RepeatList
+from sqlalchemy import select
 
-from strAPI.repeats.models import Gene, Repeat, TRPanel
+from strAPI.repeats.models import Gene, Repeat, TRPanel, Transcript, GenesRepeatsLink, RepeatTranscriptsLink
 from gtf_to_sql import connection_setup
-from strAPI.utils.constants import UPSTREAM, CHROMOSOME_LENGTHS
+from dataset_version import bump_dataset_version
+from bulk_load import bulk_insert, IdAllocator, Throughput
+from strAPI.utils.constants import UPSTREAM
+from strAPI.utils.binning import region_bin
+from strAPI.utils.intervals import gene_region, gene_index
+
+# Number of repeats written to the database at once
+BATCH_SIZE = 10000
+
+REPEAT_COLUMNS = [
+    "id", "source", "chr", "msa", "start", "end", "bin", "l_effective", "n_effective", "region_length",
+    "score_type", "score", "p_value", "divergence", "trpanel_id"
+]
 
 def load_repeatlists(directory, targets=None):
     # collect all pickle files from input directory
@@ -33,14 +46,14 @@ def load_repeatlists(directory, targets=None):
         yield(file_name, repeat_list)
 
 def repeat_in_element(repeat, element, upstream=None):
+    """ Does the repeat overlap the element (a Gene, Transcript or a row with their start and end
+    columns)? With upstream, the region upstream of the gene (strand aware) is included as well.
+    """
     region_start, region_end = element.start, element.end
     if upstream:
-        if not isinstance(element, Gene):
+        if not hasattr(element, "strand"):
             raise NotImplementedError("Including upstream region is currently only supported for Gene database entries")
-        if element.strand == "+":
-            region_start = max(region_start - UPSTREAM, 1)
-        else:
-            region_end = min(region_end + UPSTREAM, CHROMOSOME_LENGTHS[element.chr])
+        region_start, region_end = gene_region(element, upstream)
 
     repeat_end = repeat.begin + repeat.repeat_region_length - 1
     if region_start <= repeat.begin <= region_end:
@@ -49,26 +62,54 @@ def repeat_in_element(repeat, element, upstream=None):
         return True
     return False
 
-def make_db_repeat(repeat, score_type):
-    if not hasattr(repeat, "TRD"):
-        repeat.TRD = None
-
-    # initialize instance of database Repeat
-    db_repeat = Repeat(
-        source = repeat.TRD,
-        msa = ",".join(repeat.msa), # convert msa from list() to ',' separated str()
-        start = repeat.begin,
-        end = repeat.begin + repeat.repeat_region_length - 1, # calculate end position
-        l_effective = repeat.l_effective,
-        n_effective = repeat.n_effective,
-        region_length = repeat.repeat_region_length,
-        score_type = score_type,
-        score = repeat.d_score[score_type],
-        p_value = repeat.d_pvalue[score_type],
-        divergence = repeat.d_divergence[score_type]
-    )
-
-    return db_repeat
+def make_repeat_row(repeat, score_type, repeat_id, chrom, trpanel_id):
+    """ Row of the repeats table for a TRAL repeat, for bulk_insert() """
+    end = repeat.begin + repeat.repeat_region_length - 1
+    return {
+        "id": repeat_id,
+        "source": getattr(repeat, "TRD", None) or "unknown",  # default of Repeat.source
+        "chr": chrom,
+        "msa": ",".join(repeat.msa),
+        "start": repeat.begin,
+        "end": end,
+        "bin": region_bin(repeat.begin, end),
+        "l_effective": repeat.l_effective,
+        "n_effective": repeat.n_effective,
+        "region_length": repeat.repeat_region_length,
+        "score_type": score_type,
+        "score": repeat.d_score[score_type],
+        "p_value": repeat.d_pvalue[score_type],
+        "divergence": repeat.d_divergence[score_type],
+        "trpanel_id": trpanel_id
+    }
+
+def load_genes(session):
+    """ Genes and transcripts as plain rows
+
+    Returns
+    (list of gene rows, {gene id: [transcript rows]})
+    """
+    transcripts = dict()
+    for transcript in session.execute(select(Transcript.id, Transcript.gene_id, Transcript.start, Transcript.end)):
+        transcripts.setdefault(transcript.gene_id, []).append(transcript)
+
+    genes = session.execute(select(Gene.id, Gene.chr, Gene.strand, Gene.start, Gene.end)).all()
+    return genes, transcripts
+
+class RepeatBatch(object):
+    """ Repeat rows and their link rows, written together by flush() """
+    def __init__(self):
+        self.repeats = []
+        self.gene_links = []
+        self.transcript_links = []
+
+    def flush(self, session, throughput) -> None:
+        # repeats first, the link tables reference them
+        throughput.add("repeats", bulk_insert(session, Repeat, REPEAT_COLUMNS, self.repeats))
+        throughput.add("genes_repeats", bulk_insert(session, GenesRepeatsLink, ["repeat_id", "gene_id"], self.gene_links))
+        throughput.add("repeats_transcripts",
+            bulk_insert(session, RepeatTranscriptsLink, ["repeat_id", "transcript_id"], set(self.transcript_links)))
+        self.__init__()
 
 def cla_parser():
     parser = argparse.ArgumentParser()
@@ -82,6 +123,9 @@ def cla_parser():
     parser.add_argument(
         "--score_type", "-s", type=str, required=True, help="Which score type will be included in DB? options: phylo, phylo_gap01, phylo_gap001"
     )
+    parser.add_argument(
+        "--targets", "-t", type=str, nargs="+", default=None, help="Only insert the repeats from these pickle files (names without .pickle), e.g. to load one chromosome"
+    )
 
     return parser.parse_args()
 
@@ -96,44 +140,44 @@ def main():
     
     engine, session = connection_setup(db_path)
 
-    # Collect all genes from DB into dictionary (chromosomes as keys)
-    gene_dict = dict()
-    for gene in session.query(Gene).all():
-        try:
-            gene_dict[gene.chr].append(gene)
-        except KeyError:
-            gene_dict[gene.chr] = [gene]
+    # Index all genes from DB by their region including the upstream flank
+    genes, transcripts_by_gene = load_genes(session)
+    genes_by_region = gene_index(genes, upstream=UPSTREAM)
 
     trpanel = session.query(TRPanel).filter(TRPanel.name == 'gangstr_crc_hg38').one()
     print(trpanel)
 
-    for file_name, repeat_list in load_repeatlists(input_path):
+    next_repeat_id = IdAllocator(session, Repeat)
+    throughput = Throughput()
+    batch = RepeatBatch()
+    for file_name, repeat_list in load_repeatlists(input_path, targets=args.targets):
         print(f"Inserting repeats from file '{file_name}'")
         repeat_chrom = file_name.split("_")[0]
         for repeat in repeat_list.repeats:
-            gene_count = 0            
-            for gene in gene_dict[repeat_chrom]:                
+            repeat_id = None
+            repeat_end = repeat.begin + repeat.repeat_region_length - 1
+            for gene in genes_by_region.overlapping(repeat_chrom, repeat.begin, repeat_end):
                 if repeat_in_element(repeat=repeat, element=gene, upstream=UPSTREAM):
-                    # The repeat could be mapped to a gene, check if this is the first 
-                    # time the repeat maps to a gene (gene_count == 1), if so: make DB entry for repeat
-                    gene_count += 1              
-                    if gene_count == 1:                       
-                        db_repeat = make_db_repeat(repeat, score_type)                                    
-                    
-                        # Add relationships to gene and tr panel 
-                        gene.repeats.append(db_repeat)
-
-                        db_repeat.trpanel_id = trpanel.id
-                        trpanel.repeats.append(db_repeat)
-                        
-
-                    for transcript in gene.transcripts:
+                    # The repeat could be mapped to a gene, the first time this happens make the
+                    # DB entry for the repeat and link it to that gene
+                    if repeat_id is None:
+                        repeat_id = next_repeat_id()
+                        batch.repeats.append(make_repeat_row(repeat, score_type, repeat_id, repeat_chrom, trpanel.id))
+                        batch.gene_links.append((repeat_id, gene.id))
+
+                    for transcript in transcripts_by_gene.get(gene.id, []):
                         # Add repeat to all of the genes transcripts that it maps to
                         if repeat_in_element(repeat=repeat, element=transcript):
-                            transcript.repeats.append(db_repeat)
-            if gene_count == 0:
+                            batch.transcript_links.append((repeat_id, transcript.id))
+            if repeat_id is None:
                 print(f"WARNING: repeat {repeat} could not be mapped to any of the genes in the database")
+            if len(batch.repeats) >= BATCH_SIZE:
+                batch.flush(session, throughput)
+                print(throughput.report())
+    batch.flush(session, throughput)
     session.commit()
+    print(f"Inserted {throughput.report()}")
+    bump_dataset_version(session)
 
 if __name__ == "__main__":
     main()
@@ -1,39 +1,15 @@
 #!/usr/bin/env python3
 import argparse
+import sys
+sys.path.append("..")
+
 from gtf_to_sql import connection_setup
+from dataset_version import bump_dataset_version
 import pandas as pd
 
-from repeats.models import CRCVariation, Repeat
-
-def make_db_variation(df_row, session):
-    try:
-        var_already_in_db = session.query(CRCVariation).filter_by(
-            tcga_barcode = df_row["patient"],
-            sample_type = df_row["sample_type"],
-            start = df_row['start'],
-            end = df_row['end']).one()
-        return "Already exists in the database"
-    except:
-        # initialize instance of database CRCVariation
-        db_variation = CRCVariation(
-            tcga_barcode = df_row["patient"],
-            sample_type = df_row["sample_type"],
-            start = df_row['start'],
-            end = df_row['end'],
-            reference = df_row["ref"],
-            alt = df_row["alt"],
-            repeat_id = df_row["repeat_id"]
-        )
-
-        #try:
-        repeat_id = df_row["repeat_id"]
-        print(repeat_id)
-        if repeat_id != '.':
-            repeat = session.query(Repeat).get(int(repeat_id))
-            repeat.crcvariations.append(db_variation)
-        #except:
-        #    print("This might be a PERF repeat, " + df_row["repeat_id"])
-        return True
+from strAPI.repeats.models import CRCVariation
+from update_repeats import make_db_variations
+from upsert import upsert_frame
 
 def cla_parser():
     parser = argparse.ArgumentParser()
@@ -59,9 +35,12 @@ def main():
 
     df_var = pd.read_csv(input_path)
 
-    df_var.apply(lambda row : make_db_variation(row, session), axis = 1)
+    # repeats that already have a variation keep it, see update_repeats.py for replacing them
+    variations = upsert_frame(session, CRCVariation, make_db_variations(df_var, session), update=False)
+    print(f"Inserted {variations} variations out of {len(df_var)}, skipping those already in the database")
   
     session.commit()
+    bump_dataset_version(session)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,31 @@
+"""dataset version stamp
+
+Revision ID: 5c1e8f2a7b34
+Revises: 09734b51018c
+Create Date: 2026-10-18 09:30:12.417305
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c1e8f2a7b34'
+down_revision = '09734b51018c'
+
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+def upgrade():
+    dataset_version = op.create_table('dataset_version',
+    sa.Column('id', sa.Integer(), nullable=True),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(dataset_version, [{'id': 1, 'version': 1, 'updated_at': datetime.utcnow()}])
+
+
+def downgrade():
+    op.drop_table('dataset_version')
@@ -0,0 +1,50 @@
+"""interval bins for genes and repeats
+
+Revision ID: 8d2f61c0a9e7
+Revises: 5c1e8f2a7b34
+Create Date: 2026-10-18 11:05:47.902114
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d2f61c0a9e7'
+down_revision = '5c1e8f2a7b34'
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# UCSC bin of the start-end interval, as computed by strAPI.utils.binning.region_bin()
+REGION_BIN_SQL = """CASE
+    WHEN (start - 1) / 131072 = ("end" - 1) / 131072 THEN 585 + (start - 1) / 131072
+    WHEN (start - 1) / 1048576 = ("end" - 1) / 1048576 THEN 73 + (start - 1) / 1048576
+    WHEN (start - 1) / 8388608 = ("end" - 1) / 8388608 THEN 9 + (start - 1) / 8388608
+    WHEN (start - 1) / 67108864 = ("end" - 1) / 67108864 THEN 1 + (start - 1) / 67108864
+    ELSE 0 END"""
+
+
+def upgrade():
+    with op.batch_alter_table('genes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bin', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_genes_bin'), ['bin'], unique=False)
+        batch_op.create_index('ix_genes_chr_bin', ['chr', 'bin'], unique=False)
+
+    with op.batch_alter_table('repeats', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bin', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_repeats_bin'), ['bin'], unique=False)
+        batch_op.create_index('ix_repeats_chr_bin', ['chr', 'bin'], unique=False)
+
+    op.execute(f"UPDATE genes SET bin = {REGION_BIN_SQL}")
+    op.execute(f"UPDATE repeats SET bin = {REGION_BIN_SQL}")
+
+
+def downgrade():
+    with op.batch_alter_table('repeats', schema=None) as batch_op:
+        batch_op.drop_index('ix_repeats_chr_bin')
+        batch_op.drop_index(batch_op.f('ix_repeats_bin'))
+        batch_op.drop_column('bin')
+
+    with op.batch_alter_table('genes', schema=None) as batch_op:
+        batch_op.drop_index('ix_genes_chr_bin')
+        batch_op.drop_index(batch_op.f('ix_genes_bin'))
+        batch_op.drop_column('bin')
@@ -0,0 +1,60 @@
+"""repeat_summary table
+
+Revision ID: b71e4d93c2a5
+Revises: 8d2f61c0a9e7
+Create Date: 2026-10-18 13:40:12.318554
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b71e4d93c2a5'
+down_revision = '8d2f61c0a9e7'
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+def upgrade():
+    op.create_table('repeat_summary',
+    sa.Column('id', sa.Integer(), nullable=True),
+    sa.Column('variability_rank', sa.Integer(), nullable=False),
+    sa.Column('repeat_id', sa.Integer(), nullable=False),
+    sa.Column('gene_id', sa.Integer(), nullable=True),
+    sa.Column('chr', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('start', sa.Integer(), nullable=False),
+    sa.Column('end', sa.Integer(), nullable=False),
+    sa.Column('bin', sa.Integer(), nullable=True),
+    sa.Column('msa', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('motif', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('period', sa.Integer(), nullable=False),
+    sa.Column('copies', sa.Integer(), nullable=False),
+    sa.Column('ensembl_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('strand', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('gene_name', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('gene_desc', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('total_calls', sa.Integer(), nullable=True),
+    sa.Column('frac_variable', sa.Float(), nullable=True),
+    sa.Column('avg_size_diff', sa.Float(), nullable=True),
+    sa.Column('trpanel_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('repeat_summary', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_repeat_summary_id'), ['id'], unique=False)
+        batch_op.create_index('ix_repeat_summary_gene_rank', ['gene_id', 'variability_rank'], unique=False)
+        batch_op.create_index('ix_repeat_summary_chr_bin_start', ['chr', 'bin', 'start'], unique=False)
+
+    with op.batch_alter_table('dataset_version', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('summary_version', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('dataset_version', schema=None) as batch_op:
+        batch_op.drop_column('summary_version')
+
+    with op.batch_alter_table('repeat_summary', schema=None) as batch_op:
+        batch_op.drop_index('ix_repeat_summary_chr_bin_start')
+        batch_op.drop_index('ix_repeat_summary_gene_rank')
+        batch_op.drop_index(batch_op.f('ix_repeat_summary_id'))
+
+    op.drop_table('repeat_summary')
@@ -0,0 +1,27 @@
+"""unique repeat_id of crcvariations
+
+Revision ID: 3e9a4c7d1f26
+Revises: b71e4d93c2a5
+Create Date: 2026-10-18 15:10:41.902317
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e9a4c7d1f26'
+down_revision = 'b71e4d93c2a5'
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+def upgrade():
+    # a repeat has one variation summary, keep the latest one of repeats that got several
+    op.execute(
+        "DELETE FROM crcvariations WHERE id NOT IN (SELECT MAX(id) FROM crcvariations GROUP BY repeat_id)"
+    )
+    op.create_index('uq_crcvariations_repeat_id', 'crcvariations', ['repeat_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_crcvariations_repeat_id', table_name='crcvariations')
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+""" Rebuild the repeat_summary table, the denormalized copy of the /repeats rows (see RepeatSummary in
+strAPI/repeats/models.py). Run it after all imports, the API falls back to joining the source
+tables whenever an import changed the dataset version after the last refresh.
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import time
+from sqlalchemy import select, insert, delete, func, text
+
+from strAPI.repeats.models import Repeat, Gene, GenesRepeatsLink, CRCVariation, RepeatSummary
+from gtf_to_sql import connection_setup
+from dataset_version import bump_dataset_version
+
+SUMMARY_COLUMNS = [
+    "variability_rank", "repeat_id", "gene_id", "chr", "start", "end", "bin", "msa", "motif", "period",
+    "copies", "ensembl_id", "strand", "gene_name", "gene_desc", "total_calls", "frac_variable",
+    "avg_size_diff", "trpanel_id"
+]
+
+def summary_rows_select():
+    """ Rows of repeat_summary in the /repeats sort order (strAPI.repeat_rows.VARIABILITY_KEYS) """
+    variability_rank = func.row_number().over(order_by=[
+        func.coalesce(CRCVariation.frac_variable, -1).desc(),
+        func.coalesce(CRCVariation.total_calls, -1),
+        Repeat.id,
+        func.coalesce(GenesRepeatsLink.gene_id, -1)
+    ])
+    return select(
+            variability_rank,
+            Repeat.id,
+            GenesRepeatsLink.gene_id,
+            Repeat.chr,
+            Repeat.start,
+            Repeat.end,
+            Repeat.bin,
+            Repeat.msa,
+            Repeat.motif,
+            Repeat.l_effective,
+            Repeat.n_effective,
+            Gene.ensembl_id,
+            Gene.strand,
+            Gene.name,
+            Gene.description,
+            CRCVariation.total_calls,
+            CRCVariation.frac_variable,
+            CRCVariation.avg_size_diff,
+            Repeat.trpanel_id
+        ).select_from(Repeat
+        ).join(GenesRepeatsLink, GenesRepeatsLink.repeat_id == Repeat.id, isouter=True
+        ).join(Gene, Gene.id == GenesRepeatsLink.gene_id, isouter=True
+        ).join(CRCVariation, CRCVariation.repeat_id == Repeat.id, isouter=True
+        ).where(Repeat.l_effective <= 6)
+
+def refresh_repeat_summary(session):
+    """ Replace the content of repeat_summary in a single transaction, readers keep seeing the old rows
+    until it commits. Returns the number of rows inserted.
+    """
+    session.execute(delete(RepeatSummary))
+    result = session.execute(insert(RepeatSummary).from_select(SUMMARY_COLUMNS, summary_rows_select()))
+    session.commit()
+    if session.get_bind().dialect.name == "postgresql":
+        # fresh statistics, so the planner picks the summary indexes right away
+        session.execute(text("ANALYZE repeat_summary"))
+        session.commit()
+    return result.rowcount
+
+def cla_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--database", "-d", type=str, required=True, help="Path to where the repeat-containing database can be found"
+    )
+
+    return parser.parse_args()
+
+def main():
+    args = cla_parser()
+    db_path = args.database
+    db_path = db_path.replace("postgres://", "postgresql+psycopg2://")
+
+    engine, session = connection_setup(db_path)
+
+    start_time = time.time()
+    rows = refresh_repeat_summary(session)
+    print(f"Inserted {rows} rows into repeat_summary in {time.time() - start_time:.1f}s")
+
+    bump_dataset_version(session, summary_refreshed=True)
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,9 @@ import os
 
 
 from strAPI.repeats.models import *
-from sqlmodel import create_engine, SQLModel
+from sqlmodel import create_engine, SQLModel, Session
+
+from dataset_version import seed_dataset_version
 
 def cla_parser():
     parser = argparse.ArgumentParser()
@@ -30,6 +32,8 @@ def main():
 
     engine = create_engine(db_path, echo=True)
     SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed_dataset_version(session)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,55 @@
+""" Tests of bulk_load.py, run with `python -m pytest` from database_setup. The COPY tests need a
+PostgreSQL database, set WEBSTR_TEST_DATABASE_URL to run them, e.g.
+postgresql+psycopg2://postgres@localhost:5432/postgres
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Float, String
+from sqlalchemy.orm import Session
+
+from bulk_load import csv_line, bulk_insert
+
+TEST_DATABASE_URL = os.environ.get("WEBSTR_TEST_DATABASE_URL")
+
+metadata = MetaData()
+nullable_table = Table(
+    "bulk_load_test", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=True),
+    Column("count", Integer, nullable=True),
+    Column("score", Float, nullable=True),
+)
+
+class NullableModel(object):
+    __table__ = nullable_table
+
+ROWS = [
+    (1, None, None, None),
+    (2, "", 0, 0.0),
+    (3, 'say "hi", twice', 7, 2.5),
+]
+
+def test_csv_line_writes_none_unquoted():
+    assert csv_line(["a", None, 1, 2.5, ""]) == '"a",,1,2.5,""\n'
+    assert csv_line(['q"uote', "com,ma"]) == '"q""uote","com,ma"\n'
+
+def round_trip(url):
+    engine = create_engine(url)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    try:
+        with Session(engine) as session:
+            bulk_insert(session, NullableModel, ["id", "name", "count", "score"], ROWS)
+            session.commit()
+            return [tuple(row) for row in session.execute(nullable_table.select().order_by(nullable_table.c.id))]
+    finally:
+        metadata.drop_all(engine)
+        engine.dispose()
+
+def test_none_round_trip_sqlite():
+    assert round_trip("sqlite://") == ROWS
+
+@pytest.mark.skipif(TEST_DATABASE_URL is None, reason="WEBSTR_TEST_DATABASE_URL is not set")
+def test_none_round_trip_copy():
+    assert round_trip(TEST_DATABASE_URL) == ROWS
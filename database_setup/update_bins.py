@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+""" Fill in the interval bin (see strAPI/utils/binning.py) of genes and repeats that were imported
+without one, e.g. repeats loaded directly into SQL from a csv file. Region queries of the API still
+find rows without a bin (see bin_filter()), but they are checked on their coordinates alone, outside
+the bin index, so region queries get slower the more of them there are.
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+from sqlalchemy import text
+
+from strAPI.utils.binning import region_bin_sql
+from gtf_to_sql import connection_setup
+from dataset_version import bump_dataset_version
+
+def update_bins(session, table_name):
+    result = session.execute(text(f"UPDATE {table_name} SET bin = {region_bin_sql()} WHERE bin IS NULL"))
+    print(f"Updated bins of {result.rowcount} rows in table '{table_name}'")
+
+def cla_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--database", "-d", type=str, required=True, help="Path to where the repeat-containing database can be found"
+    )
+
+    return parser.parse_args()
+
+def main():
+    args = cla_parser()
+    db_path = args.database
+    db_path = db_path.replace("postgres://", "postgresql+psycopg2://") 
+
+    engine, session = connection_setup(db_path)
+
+    update_bins(session, "genes")
+    update_bins(session, "repeats")
+    session.commit()
+    bump_dataset_version(session)
+
+if __name__ == "__main__":
+    main()
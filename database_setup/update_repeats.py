@@ -1,32 +1,29 @@
 #!/usr/bin/env python3
 import argparse
 from gtf_to_sql import connection_setup
+from dataset_version import bump_dataset_version
 import pandas as pd
 import sys
 
 sys.path.append("..")
 
 from strAPI.repeats.models import Repeat, CRCVariation
+from upsert import upsert_frame, existing_ids
 
-def update_db_variation(df_row, session):
-        try:
-            repeat_id = df_row["repeat_id"]
-           
-            if repeat_id != '.':
-                repeat = session.query(Repeat).get(int(repeat_id))
-                db_variation = CRCVariation(
-                    instable_calls = df_row["instable_calls"],
-                    stable_calls = df_row["stable_calls"],
-                    total_calls = df_row["total_calls"],
-                    frac_variable = df_row["frac_variable"],
-                    avg_size_diff = df_row["avg_size_diff"],
-                    repeat_id = repeat_id
-                )
-                repeat.crcvariation = db_variation
-        except:
-            print("This might be a PERF repeat ")
-            print(df_row)
-        return True
+VARIATION_COLUMNS = ["repeat_id", "instable_calls", "stable_calls", "total_calls", "frac_variable", "avg_size_diff"]
+
+def make_db_variations(df_var, session):
+    """ crcvariations rows for the repeats of a locus variation data frame that are in the database,
+    rows without a repeat ('.') are skipped
+    """
+    df_var = df_var.loc[df_var["repeat_id"].astype(str) != '.']
+    df_var = df_var.assign(repeat_id=df_var["repeat_id"].astype(int))
+
+    in_db = df_var["repeat_id"].isin(existing_ids(session, Repeat, df_var["repeat_id"]))
+    if not in_db.all():
+        print(f"{(~in_db).sum()} repeats were not found in the database, these might be PERF repeats")
+        print(df_var.loc[~in_db])
+    return df_var.loc[in_db, VARIATION_COLUMNS]
 
 def cla_parser():
     parser = argparse.ArgumentParser()
@@ -52,9 +49,12 @@ def main():
 
     df_var = pd.read_csv(input_path)
 
-    df_var.apply(lambda row : update_db_variation(row, session), axis = 1)
+    # replaces the variation of repeats that already have one
+    variations = upsert_frame(session, CRCVariation, make_db_variations(df_var, session), update=True)
+    print(f"Inserted or updated {variations} variations out of {len(df_var)}")
   
     session.commit()
+    bump_dataset_version(session)
 
 if __name__ == "__main__":
     main()
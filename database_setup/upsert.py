@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+""" Idempotent batched writes for the import scripts. Rows are written with INSERT ... ON CONFLICT
+on the key columns of their table (UPSERT_KEYS), one statement per batch, so an import can be rerun
+and rows that are already in the database are updated or left alone instead of duplicated.
+Supported on PostgreSQL and SQLite (3.24 or newer).
+"""
+import sys
+sys.path.append("..")
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from strAPI.repeats.models import CRCVariation, CRCExprRepeatLenCorr, GenesRepeatsLink, RepeatTranscriptsLink, ExonTranscriptsLink
+from bulk_load import frame_rows, integer_columns
+
+# Columns identifying a row of each table, the conflict target of upsert(). They need a primary
+# key or unique index in the database.
+UPSERT_KEYS = {
+    CRCVariation: ["repeat_id"],
+    CRCExprRepeatLenCorr: ["repeat_id", "gene_id"],
+    GenesRepeatsLink: ["repeat_id", "gene_id"],
+    RepeatTranscriptsLink: ["repeat_id", "transcript_id"],
+    ExonTranscriptsLink: ["exon_id", "transcript_id"],
+}
+
+# Rows per statement, keeps the number of bound parameters below the limits of both databases
+BATCH_SIZE = 1000
+
+INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+def upsert(session, model, rows, update=True) -> int:
+    """ Write rows into the table of model with a single statement
+
+    Parameters
+    session:    Session connected to the database
+    model:      SQLModel table class with an entry in UPSERT_KEYS
+    rows:       List of dicts with the same keys, including the key columns. Keys must be unique
+                within the list.
+    update:     Overwrite the other columns of rows that are already in the table (True) or leave
+                those rows as they are (False)
+
+    Returns
+    Number of rows passed
+    """
+    if not rows:
+        return 0
+    dialect = session.get_bind().dialect.name
+    if dialect not in INSERTS:
+        raise NotImplementedError(f"Upserts are not supported for {dialect} databases")
+
+    keys = UPSERT_KEYS[model]
+    statement = INSERTS[dialect](model.__table__).values(rows)
+    update_columns = [column for column in rows[0] if column not in keys]
+    if update and update_columns:
+        statement = statement.on_conflict_do_update(
+            index_elements=keys,
+            set_={column: statement.excluded[column] for column in update_columns}
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=keys)
+    session.execute(statement)
+    return len(rows)
+
+def upsert_frame(session, model, frame, update=True, batch_size=BATCH_SIZE) -> int:
+    """ upsert() the rows of a pd.DataFrame whose columns are named after the table columns, batch_size
+    rows per statement. Of rows with the same key the last one is written when updating, the first
+    one otherwise. Returns the number of rows written
+    """
+    frame = frame.drop_duplicates(UPSERT_KEYS[model], keep="last" if update else "first")
+    frame = integer_columns(model, frame)
+    columns = list(frame.columns)
+    for batch_start in range(0, len(frame), batch_size):
+        rows = frame_rows(frame.iloc[batch_start:batch_start + batch_size])
+        upsert(session, model, [dict(zip(columns, row)) for row in rows], update=update)
+    return len(frame)
+
+def existing_ids(session, model, ids, batch_size=BATCH_SIZE) -> set:
+    """ The ids of model rows among ids, to drop rows that would reference missing rows """
+    ids = list(set(ids))
+    found = set()
+    for batch_start in range(0, len(ids), batch_size):
+        found.update(session.execute(
+            select(model.id).where(model.id.in_(ids[batch_start:batch_start + batch_size]))
+        ).scalars())
+    return found
@@ -0,0 +1,143 @@
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Response compression negotiated through Accept-Encoding: brotli when the brotli package is installed
+and the client accepts it, gzip otherwise. Streamed responses (csv/tsv exports) are compressed chunk
+by chunk and every chunk is flushed, so the client keeps receiving data while the export is running.
+Configured with environment variables:
+WEBSTR_COMPRESSION               0 to disable compression (default 1)
+WEBSTR_COMPRESSION_MINIMUM_SIZE  responses smaller than this many bytes are sent as is (default 1024)
+WEBSTR_GZIP_LEVEL                gzip level 1-9 (default 6)
+WEBSTR_BROTLI_QUALITY            brotli quality 0-11 (default 4, higher levels are too slow for streaming)
+"""
+COMPRESSION_ENABLED = os.environ.get("WEBSTR_COMPRESSION", "1") == "1"
+MINIMUM_SIZE = int(os.environ.get("WEBSTR_COMPRESSION_MINIMUM_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("WEBSTR_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("WEBSTR_BROTLI_QUALITY", 4))
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """ Content codings of an Accept-Encoding header with their q values """
+    encodings = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            encodings[coding.strip().lower()] = q
+    return encodings
+
+def choose_encoding(accept_encoding: str):
+    encodings = accepted_encodings(accept_encoding)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    candidates = [coding for coding in candidates if encodings.get(coding, encodings.get("*", 0)) > 0]
+    if not candidates:
+        return None
+    # ties go to brotli, it compresses better at the same speed
+    return max(candidates, key=lambda coding: encodings.get(coding, encodings.get("*", 0)))
+
+class GzipEncoder(object):
+    def __init__(self, level: int):
+        # wbits 16 + 15: zlib stream with gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH)
+
+class BrotliEncoder(object):
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.finish()
+
+class CompressionMiddleware(object):
+    """ ASGI middleware compressing response bodies, see the module description """
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE, gzip_level: int = GZIP_LEVEL,
+                 brotli_quality: int = BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def encoder(self, encoding: str):
+        if encoding == "br":
+            return BrotliEncoder(self.brotli_quality)
+        return GzipEncoder(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder = None
+
+        async def send_compressed(message):
+            nonlocal start_message, encoder
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether compression applies
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                # responses passed on by other middlewares arrive in chunks but keep their Content-Length
+                size = int(headers["content-length"]) if "content-length" in headers else len(body)
+                if ("content-encoding" in headers or start_message["status"] in (204, 304)
+                        or (size < self.minimum_size and ("content-length" in headers or not more_body))):
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+                encoder = self.encoder(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    body = encoder.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                    encoder = None
+                    await send(start_message)
+                    start_message = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start_message)
+                start_message = None
+            elif encoder is None:
+                # response that was not compressed
+                await send(message)
+                return
+
+            body = encoder.compress(body) if more_body else encoder.finish(body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
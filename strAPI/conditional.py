@@ -0,0 +1,48 @@
+import hashlib
+
+from starlette.responses import Response
+
+from .response_cache import current_dataset_version, normalized_query
+
+"""
+Conditional GET for the read-only data endpoints. Their responses only change when an import bumps the
+dataset version, so the ETag is derived from the version and the request alone. A request whose
+If-None-Match holds the current ETag gets a 304 before the endpoint (and its queries) runs.
+Databases without a dataset version (no dataset_version table or row, version 0) never change version,
+their responses are sent without ETag.
+"""
+ETAG_PATHS = {
+    "/repeats", "/repeatinfo/", "/allfreqs/", "/allseq/", "/gene/", "/genefeatures/",
+    "/variations/", "/crc_expr_repeatlen_corr/", "/bed/"
+}
+
+def request_etag(version, request) -> str:
+    # Weak validator: the same data can be sent with different content encodings
+    digest = hashlib.sha1(f"{version}:{normalized_query(request)}".encode()).hexdigest()
+    return f'W/"{digest}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """ Weak comparison of an ETag with the list of tags in an If-None-Match header """
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag[2:]
+    return any(tag.strip().replace("W/", "", 1) == opaque_tag for tag in if_none_match.split(","))
+
+async def conditional_get(request, call_next):
+    """ Middleware adding ETags to data responses and answering matching If-None-Match requests with 304 """
+    if request.method != "GET" or request.url.path not in ETAG_PATHS:
+        return await call_next(request)
+
+    version = await current_dataset_version()
+    if not version:
+        return await call_next(request)
+
+    etag = request_etag(version, request)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers["ETag"] = etag
+    return response
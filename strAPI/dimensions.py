@@ -0,0 +1,149 @@
+import os
+import asyncio
+import logging
+import threading
+import time
+
+from sqlalchemy import inspect, select
+from sqlalchemy.exc import DBAPIError
+from starlette.concurrency import run_in_threadpool
+
+from .repeats.models import TRPanel, Genome, DatasetVersion
+from .repeats.database import engine
+
+# Panel names as they are shown to API users
+PANEL_DISPLAY_NAMES = {'hipstr_hg38': 'ensemble_tr'}
+
+# How often (seconds) the dataset version is checked for changes
+VERSION_CHECK_INTERVAL = float(os.environ.get("WEBSTR_DIMENSION_CACHE_INTERVAL", 60))
+
+class DimensionCache(object):
+    """ In-process copy of the small TRPanel and Genome tables. The tables are loaded once and reloaded
+    whenever the dataset version stamp in the database changes, which the database_setup scripts
+    increment after each import.
+    """
+    def __init__(self, engine, check_interval: float=VERSION_CHECK_INTERVAL):
+        self.engine = engine
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.version = None
+        self.repeat_summary_current = False
+        self.last_check = None
+        self.panel_names = dict()
+        self.panel_ids = dict()
+        self.genome_names = dict()
+        self.genome_ids = dict()
+        self.has_version_table = None
+        self.has_summary_version = None
+
+    def check_tables(self) -> None:
+        """ Look up once whether the database has the dataset_version table and its summary_version
+        column, databases set up before them are served without refreshes and without repeat_summary
+        """
+        inspector = inspect(self.engine)
+        if inspector.has_table(DatasetVersion.__tablename__):
+            columns = {column["name"] for column in inspector.get_columns(DatasetVersion.__tablename__)}
+            self.has_version_table = True
+            self.has_summary_version = "summary_version" in columns
+        else:
+            logging.warning("Dimension cache: no dataset_version table found, changes to panels and genomes require a restart")
+            self.has_version_table = False
+            self.has_summary_version = False
+
+    def get_versions(self):
+        """ (dataset version, version repeat_summary was refreshed for) from the database, database
+        errors are raised
+        """
+        if self.has_version_table is None:
+            self.check_tables()
+        if not self.has_version_table:
+            return 0, None
+        columns = [DatasetVersion.version]
+        if self.has_summary_version:
+            columns.append(DatasetVersion.summary_version)
+        with self.engine.connect() as connection:
+            row = connection.execute(select(*columns)).first()
+        if row is None:
+            return 0, None
+        return row[0], row[1] if self.has_summary_version else None
+
+    def load(self) -> None:
+        """ (Re)load panels and genomes from the database """
+        version, summary_version = self.get_versions()
+        with self.engine.connect() as connection:
+            panels = connection.execute(select(TRPanel.id, TRPanel.name)).all()
+            genomes = connection.execute(select(Genome.id, Genome.name)).all()
+
+        panel_names = {panel_id: PANEL_DISPLAY_NAMES.get(name, name) for panel_id, name in panels}
+        panel_ids = {name: panel_id for panel_id, name in panels}
+        panel_ids.update({display_name: panel_ids[name] for name, display_name in PANEL_DISPLAY_NAMES.items() if name in panel_ids})
+
+        with self.lock:
+            self.panel_names = panel_names
+            self.panel_ids = panel_ids
+            self.genome_names = {genome_id: name for genome_id, name in genomes}
+            self.genome_ids = {name: genome_id for genome_id, name in genomes}
+            self.version = version
+            # repeat_summary is only used while no import has run since its last refresh
+            self.repeat_summary_current = summary_version is not None and summary_version == version
+            self.last_check = time.monotonic()
+        logging.info(f"Dimension cache: loaded {len(panels)} panels and {len(genomes)} genomes (dataset version {version})")
+
+    def refresh(self) -> None:
+        """ Reload the tables if the dataset version changed since the last check. The version is
+        checked at most once per check_interval seconds.
+        """
+        if self.last_check is None:
+            self.load()
+            return
+        if time.monotonic() - self.last_check < self.check_interval:
+            return
+        try:
+            changed = self.get_versions()[0] != self.version
+            if changed:
+                self.load()
+        except DBAPIError as e:
+            # keep serving the last loaded tables and version, check again after check_interval
+            logging.warning(f"Dimension cache: could not check the dataset version, keeping version {self.version}: {e}")
+            changed = False
+        if not changed:
+            self.last_check = time.monotonic()
+
+    async def refresh_periodically(self) -> None:
+        """ Check the dataset version every check_interval seconds in the threadpool, so the tables are
+        current for the lookups that must not query the database, see loaded_panel_name()
+        """
+        while True:
+            # an interval of 0 checks on every request, the background check then runs every second
+            await asyncio.sleep(max(self.check_interval, 1))
+            try:
+                await run_in_threadpool(self.refresh)
+            except Exception:
+                logging.exception("Dimension cache: refresh failed")
+
+    def loaded_panel_name(self, panel_id: int) -> str:
+        """ Display name of the TRPanel with the given id from the loaded tables, without refresh or
+        database access. For code that runs on the event loop, like run_sync callbacks of the async engine.
+        Panels added since the last load are named by their id until the next refresh reloads the tables.
+        """
+        return self.panel_names.get(panel_id, str(panel_id))
+
+    def panel_name(self, panel_id: int) -> str:
+        """ Display name of the TRPanel with the given id, see loaded_panel_name() """
+        self.refresh()
+        return self.loaded_panel_name(panel_id)
+
+    def panel_id(self, name: str) -> int:
+        """ Id of the TRPanel with the given name, display names are accepted as well """
+        self.refresh()
+        return self.panel_ids[name]
+
+    def genome_name(self, genome_id: int) -> str:
+        self.refresh()
+        return self.genome_names[genome_id]
+
+    def genome_id(self, name: str) -> int:
+        self.refresh()
+        return self.genome_ids[name]
+
+dimension_cache = DimensionCache(engine)
@@ -0,0 +1,220 @@
+import csv
+import io
+from datetime import date, datetime
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Number of rows fetched from the database cursor for every chunk of streamed output
+CHUNK_SIZE = 2000
+# Rows per Parquet row group, larger groups compress and scan better
+PARQUET_ROW_GROUP_SIZE = 50000
+
+DELIMITERS = {"csv": ",", "tsv": "\t"}
+COLUMNAR_FORMATS = ["arrow", "parquet"]
+EXPORT_FORMATS = list(DELIMITERS) + COLUMNAR_FORMATS
+# Value of the format query parameter of the endpoints that support all export formats
+EXPORT_FORMAT_REGEX = "^(" + "|".join(EXPORT_FORMATS) + ")$"
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "tsv": "text/tab-separated-values",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet"
+}
+FILE_EXTENSIONS = {"csv": "csv", "tsv": "tsv", "arrow": "arrows", "parquet": "parquet"}
+
+def stream_result(db, statement, chunk_size: int=CHUNK_SIZE):
+    """ Execute a statement using a server-side cursor (on drivers that support it, e.g. psycopg2) and
+    yield the result in lists of at most chunk_size rows. The full result is never held in memory.
+    """
+    result = db.execute(statement.execution_options(stream_results=True))
+    yield from result.partitions(chunk_size)
+
+async def stream_result_async(db, statement, chunk_size: int=CHUNK_SIZE):
+    """ Same as stream_result(), for an AsyncSession """
+    result = await db.stream(statement)
+    async for partition in result.partitions(chunk_size):
+        yield partition
+
+class DelimitedWriter(object):
+    """ Writes the header line and blocks of delimited lines for chunks of rows
+
+    Parameters
+    headers (list): Column names
+    to_values:      Function converting a row into a sequence of values in header order
+    delimiter:      Field delimiter
+    """
+    def __init__(self, headers, to_values=tuple, delimiter=","):
+        self.headers = headers
+        self.to_values = to_values
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, delimiter=delimiter)
+
+    def flush(self) -> str:
+        lines = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate(0)
+        return lines
+
+    def header(self) -> str:
+        self.writer.writerow(self.headers)
+        return self.flush()
+
+    def rows(self, chunk) -> str:
+        self.writer.writerows(self.to_values(row) for row in chunk)
+        return self.flush()
+
+    def footer(self) -> str:
+        return ""
+
+class ChunkSink(io.RawIOBase):
+    """ Write-only file collecting the bytes written by pyarrow until they are taken out with drain().
+    tell() keeps counting across drains, Parquet writes absolute offsets into its footer.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def arrow_type(column_type):
+    """ Arrow type of an SQLAlchemy column type, columns of unknown type are exported as strings """
+    try:
+        python_type = column_type.python_type
+    except (NotImplementedError, AttributeError):
+        return pyarrow.string()
+    if python_type is bool:
+        return pyarrow.bool_()
+    if python_type is int:
+        return pyarrow.int64()
+    if python_type is float:
+        return pyarrow.float64()
+    if python_type is datetime:
+        return pyarrow.timestamp("us")
+    if python_type is date:
+        return pyarrow.date32()
+    return pyarrow.string()
+
+class ColumnarWriter(object):
+    """ Writes chunks of rows as Arrow IPC stream record batches or Parquet row groups, with the same
+    interface as DelimitedWriter
+
+    Parameters
+    headers (list): Column names
+    to_values:      Function converting a row into a sequence of values in header order
+    column_types:   Dict of column name to SQLAlchemy type, other columns are exported as strings
+    file_format:    arrow or parquet
+    """
+    def __init__(self, headers, to_values=tuple, column_types=None, file_format="arrow"):
+        if pyarrow is None:
+            raise HTTPException(status_code=501, detail=f"{file_format} export requires pyarrow to be installed on the server")
+        column_types = column_types or {}
+        self.schema = pyarrow.schema([
+            (header, arrow_type(column_types[header]) if header in column_types else pyarrow.string())
+            for header in headers
+        ])
+        self.to_values = to_values
+        self.sink = ChunkSink()
+        if file_format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(self.sink, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_stream(self.sink, self.schema)
+
+    def header(self) -> bytes:
+        return self.sink.drain()
+
+    def rows(self, chunk) -> bytes:
+        columns = list(zip(*[self.to_values(row) for row in chunk])) or [[] for _ in self.schema]
+        self.writer.write_batch(pyarrow.record_batch(
+            [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema
+        ))
+        return self.sink.drain()
+
+    def footer(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+def export_chunks(row_chunks, writer):
+    """ Generator that yields the header and then one block of output per chunk of rows. The header
+    is yielded before the first chunk is requested, so the first bytes go out before the query has
+    finished.
+    """
+    yield writer.header()
+    for chunk in row_chunks:
+        yield writer.rows(chunk)
+    yield writer.footer()
+
+async def export_chunks_async(row_chunks, writer):
+    yield writer.header()
+    async for chunk in row_chunks:
+        yield writer.rows(chunk)
+    yield writer.footer()
+
+def export_response(db, statement, headers, to_values=tuple, file_format="csv", filename="export"):
+    """ StreamingResponse with the result of the statement as a file download in one of EXPORT_FORMATS:
+    csv, tsv, Arrow IPC stream (load with pyarrow.ipc.open_stream) or Parquet. Arrow and Parquet
+    columns get the types of the statement's columns. db can be a Session or an AsyncSession.
+    """
+    chunk_size = CHUNK_SIZE
+    if file_format in COLUMNAR_FORMATS:
+        column_types = {column.key: column.type for column in statement.selected_columns}
+        writer = ColumnarWriter(headers, to_values, column_types, file_format)
+        if file_format == "parquet":
+            chunk_size = PARQUET_ROW_GROUP_SIZE
+    else:
+        writer = DelimitedWriter(headers, to_values, DELIMITERS[file_format])
+
+    if isinstance(db, Session):
+        content = export_chunks(stream_result(db, statement, chunk_size), writer)
+    else:
+        content = export_chunks_async(stream_result_async(db, statement, chunk_size), writer)
+    return StreamingResponse(
+        content,
+        media_type=MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{FILE_EXTENSIONS[file_format]}"'}
+    )
+
+def bed_chunks(bed_lines, chunk_size: int=CHUNK_SIZE):
+    """ Generator that yields bed lines in blocks of chunk_size lines """
+    lines = []
+    for line in bed_lines:
+        lines.append(line + "\n")
+        if len(lines) >= chunk_size:
+            yield "".join(lines)
+            lines = []
+    yield "".join(lines)
+
+def bed_response(bedmaker, filename="repeats"):
+    """ StreamingResponse with the bed file of the repeats passing the thresholds of a BedMaker as a
+    file download, in karyotypic and position order like write_bed() (see
+    BedMaker.karyotypic_bed_lines()). The repeats are read from a server-side cursor and sent batch by batch.
+    """
+    return StreamingResponse(
+        bed_chunks(bedmaker.karyotypic_bed_lines()),
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.bed"'}
+    )
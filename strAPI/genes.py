@@ -1,4 +1,5 @@
 from . repeats.models import Gene, Transcript
+from . utils.binning import bin_filter
 
 #genebuffer set in webstr codeto remove redundancy 
 
@@ -14,29 +15,39 @@ def get_exons_by_transcript(db, cds_only, transcript_obj):
     elif transcript_obj.gene.strand == "-":
         return list(sorted(exons, key=lambda x : x.start, reverse=True))
 
-def get_gene_info(db, gene_names, ensembl_ids, region_query):
-    genes = []
+def parse_region_query(region_query):
+    """ Split a region query of the form 1:182393-1014541 into ('chr1', 182393, 1014541) """
+    region_split = region_query.split(':')
+    chrom = 'chr' + region_split[0]
+    coord_split = region_split[1].split('-')
+    start = int(coord_split[0])
+    end = int(coord_split[1])
+    return chrom, start, end
+
+def gene_filter(gene_names, ensembl_ids, region_query):
+    """ Filter clauses on Gene selecting genes by name, by ensembl id or by region, in that order of
+    precedence. Returns None if no selection was given.
+    """
     if gene_names:
-        genes = db.query(Gene).filter(Gene.name.in_(gene_names)).all()
+        return [Gene.name.in_(gene_names)]
     elif ensembl_ids:
-        genes =  db.query(Gene).filter(Gene.ensembl_id.in_(ensembl_ids)).all()  
+        return [Gene.ensembl_id.in_(ensembl_ids)]
     # Example chr1:182393-1014541
-  
     elif region_query: 
-        region_split = region_query.split(':')
-        chrom = 'chr' + region_split[0]
-        coord_split = region_split[1].split('-')
-        start = int(coord_split[0])
-        end = int(coord_split[1])
-
-   
-        genes = db.query(Gene).where(
+        chrom, start, end = parse_region_query(region_query)
+        return [
             Gene.chr == chrom,
+            bin_filter(Gene.bin, start, end),
             Gene.end >= start,  # include genes that overlap @ start
             Gene.start <= end  # include genes that overlap @ end
-        ).all()
-    
-    return genes
+        ]
+    return None
+
+def get_gene_info(db, gene_names, ensembl_ids, region_query):
+    clauses = gene_filter(gene_names, ensembl_ids, region_query)
+    if clauses is None:
+        return []
+    return db.query(Gene).where(*clauses).all()
 
 def get_genes_with_exons(db, genes):
 
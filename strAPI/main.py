@@ -1,9 +1,8 @@
 import os
-import io
-import csv
+import asyncio
 import logging
+import secrets
 import sys
-from sqlalchemy.orm import joinedload
 
 # workaround to make relative imports work with __main__
 if __name__ == '__main__':
@@ -12,23 +11,31 @@ if __name__ == '__main__':
    del dirname
 
 from . import genes as gn
+from . import repeat_rows as rr
+from . import export
+from . import pagination as pg
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .dimensions import dimension_cache
+from .response_cache import response_cache
+from .conditional import conditional_get
+from .compression import CompressionMiddleware, COMPRESSION_ENABLED
+from .utils.bedmaker import BedMaker, BedTR
 
 from typing import List, Optional
 
 from fastapi.openapi.utils import get_openapi
 from fastapi.staticfiles import StaticFiles
-from fastapi import Depends, FastAPI, Query
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import RedirectResponse
-from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 import sqlalchemy
-from sqlmodel import Session, select 
-from sqlalchemy import case
+from sqlmodel import Session, select
 
 
 from .repeats import models, schemas
-from .repeats.database import get_db
+from .repeats.database import get_db, get_db_or_async, run_query, fetch_all, get_pool_stats
 
 description = """
 WebSTR-API: Database of Human genome-wide variation in Short Tandem Repeats (STRs) 
@@ -115,19 +122,65 @@ def custom_openapi():
 
 
 app.openapi = custom_openapi
+# Middleware added last runs first
+# Serves repeated /repeats, /genefeatures/ and /repeatinfo/ requests from memory until the next import
+app.middleware("http")(response_cache)
+# ETags from the dataset version, If-None-Match requests are answered before the cache or the database
+app.middleware("http")(conditional_get)
+# Cached and streamed responses alike are compressed on the way out
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+# Outermost, so cache hits and 304 responses get the CORS headers as well
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
     allow_credentials=True,
+    expose_headers=[pg.NEXT_CURSOR_HEADER, "Link", "ETag"],
 )
 
 
+@app.on_event("startup")
+def load_dimension_cache():
+    dimension_cache.load()
+
+dimension_refresh_task = None
+
+@app.on_event("startup")
+async def start_dimension_refresh():
+    # keeps the dimension cache current without database access from requests on the event loop
+    global dimension_refresh_task
+    dimension_refresh_task = asyncio.create_task(dimension_cache.refresh_periodically())
+
+@app.on_event("shutdown")
+async def stop_dimension_refresh():
+    if dimension_refresh_task is not None:
+        dimension_refresh_task.cancel()
+
+
 @app.get("/")
 def main():
     return RedirectResponse(url="/docs/")
 
+# Token that /internal/ requests must send in the X-Internal-Token header, without it the routes are disabled
+INTERNAL_TOKEN = os.environ.get("WEBSTR_INTERNAL_TOKEN")
+
+def require_internal_token(x_internal_token: str = Header(None)):
+    if not INTERNAL_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_internal_token is None or not secrets.compare_digest(x_internal_token, INTERNAL_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid X-Internal-Token")
+
+# Connection pool usage, for sizing the number of workers against the database
+@app.get("/internal/pool", include_in_schema=False, dependencies=[Depends(require_internal_token)])
+def pool_stats():
+    return get_pool_stats()
+
+@app.get("/internal/cache", include_in_schema=False, dependencies=[Depends(require_internal_token)])
+def cache_stats():
+    return response_cache.stats()
+
 # Get 100 genes (testing query)
 @app.get("/genes/", response_model=List[schemas.Gene], tags=["Genes"])
 def show_genes(db: Session = Depends(get_db)):
@@ -139,15 +192,21 @@ def show_genes(db: Session = Depends(get_db)):
     Retrieve gene information based on gene names 
 
     Returns
-    List of Genes
+    List of Genes, at most limit of them (default 1000); if there are more the X-Next-Cursor header
+    holds the cursor parameter for the next page
 
     TODO: 
     - Add querying by ensembl id and by region coordinates 
     - Add features flag and return corresponding transcripts and exons
 """ 
 @app.get("/gene/", response_model=List[schemas.Gene], tags=["Genes"])
-def show_genes(db: Session = Depends(get_db), gene_names: List[str] = Query(None), ensembl_ids: List[str] = Query(None), reqion_query: str = Query(None)):
-    return gn.get_gene_info(db, gene_names, ensembl_ids, reqion_query)
+def show_genes(request: Request, response: Response, db: Session = Depends(get_db), gene_names: List[str] = Query(None), ensembl_ids: List[str] = Query(None), reqion_query: str = Query(None), cursor: str = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    clauses = gn.gene_filter(gene_names, ensembl_ids, reqion_query)
+    if clauses is None:
+        return []
+    rows, next_cursor = pg.fetch_page(db, select(models.Gene).where(*clauses), [(models.Gene.id, False)], cursor, limit)
+    pg.set_next_cursor(request, response, next_cursor)
+    return [row[0] for row in rows]
     
 
 @app.get("/genefeatures/", response_model=List[schemas.GeneInfo], tags=["Genes"])
@@ -164,19 +223,23 @@ Retrieve allele frequencies for the given repeat id
         repeat_id
    
     Returns
-    List of Allele Frequencies
+    List of Allele Frequencies, or a csv, tsv, Arrow or Parquet file if format is given
 """
 @app.get("/allfreqs/", response_model=List[schemas.AlleleFrequency], tags=["Repeats"])
-def show_allele_freqs(repeat_id: int, db: Session = Depends(get_db)):
-    allfreqs = db.query(models.AlleleFrequency).filter(models.AlleleFrequency.repeat_id == repeat_id).all()
-    if allfreqs == []:
-       return []
-    return allfreqs
+async def show_allele_freqs(repeat_id: int, format: str = Query(None, regex=export.EXPORT_FORMAT_REGEX), db = Depends(get_db_or_async)):
+    if format:
+        headers = ['repeat_id', 'population', 'n_effective', 'frequency', 'het', 'num_called']
+        statement = select(*[getattr(models.AlleleFrequency, column) for column in headers]
+            ).where(models.AlleleFrequency.repeat_id == repeat_id
+            ).order_by(models.AlleleFrequency.id)
+        return export.export_response(db, statement, headers, file_format=format, filename=f"allfreqs_{repeat_id}")
+    statement = select(models.AlleleFrequency).where(models.AlleleFrequency.repeat_id == repeat_id)
+    return await run_query(db, fetch_all, statement)
 
 @app.get("/allseq/", response_model=List[schemas.AlleleSequence], tags=["Repeats"])
-def show_allele_seq(repeat_id: int, db: Session = Depends(get_db)):
-    allseq = db.query(models.AlleleSequence).filter(models.AlleleSequence.repeat_id == repeat_id).all()
-    return allseq
+async def show_allele_seq(repeat_id: int, db = Depends(get_db_or_async)):
+    statement = select(models.AlleleSequence).where(models.AlleleSequence.repeat_id == repeat_id)
+    return await run_query(db, fetch_all, statement)
 
 
 """ 
@@ -190,52 +253,11 @@ Retrieve repeat info given a repeat id
     Repeat info 
 """
 @app.get("/repeatinfo/", response_model=schemas.RepeatInfo, tags=["Repeats"])
-def show_repeat_info(repeat_id: int, db: Session = Depends(get_db)):
-    repeat = db.query(models.Repeat).filter(models.Repeat.id == repeat_id).one_or_none()
-
-    # Get CRC Variation associated with this repeat if available
-    crcvar = db.query(models.CRCVariation).filter(models.CRCVariation.repeat_id == repeat_id).first()
-
-    if crcvar is None:
-        crcvar_info = dict(total_calls=None, frac_variable = None, avg_size_diff = None)
-    else: 
-        crcvar_info = dict(crcvar)
- 
-    # Get genes associated with this repeat
-    statement = select(models.GenesRepeatsLink, models.Gene     
-    ).where(models.GenesRepeatsLink.repeat_id == repeat_id 
-    ).join(models.Gene).where(models.Gene.id == models.GenesRepeatsLink.gene_id) 
-    gene = db.exec(statement).first()
-    
-    if gene is not None:
-        gene_info = dict(gene[1])
-    else:
-        gene_info = {'ensembl_id': None, 'strand': None, 'name': None, 'description': None}
-    
-    tr_panel_name = db.query(models.TRPanel).get(repeat.trpanel_id).name
-    if tr_panel_name == 'hipstr_hg38':
-       tr_panel_name = 'ensemble_tr'
-
-    repeat_info = {
-        "repeat_id": repeat.id,
-        "chr": repeat.chr,
-        "start":  repeat.start,
-        "end":  repeat.end,
-        "msa": repeat.msa,
-        "motif": repeat.motif,
-        "period": repeat.l_effective,
-        "copies": repeat.n_effective,
-        "ensembl_id": gene_info["ensembl_id"],
-        "strand": gene_info["strand"],
-        "gene_name": gene_info["name"],
-        "gene_desc": gene_info["description"],
-        "total_calls": crcvar_info["total_calls"],
-        "frac_variable": crcvar_info["frac_variable"],
-        "avg_size_diff": crcvar_info["avg_size_diff"],
-        "panel": tr_panel_name
-    }
-
-    return repeat_info
+async def show_repeat_info(repeat_id: int, db = Depends(get_db_or_async)):
+    repeat_info = await run_query(db, rr.get_repeat_rows, rr.repeat_by_id(repeat_id))
+    if not repeat_info:
+        raise HTTPException(status_code=404, detail=f"Repeat {repeat_id} not found")
+    return repeat_info[0]
 
 
 """ 
@@ -246,188 +268,170 @@ Retrieve all repeats associated with a given gene
         Ensembl id of a gene for which the repeats will be retrieved
    
     Returns
-    List of Repeats
+    List of Repeats, at most limit of them (default 1000); if there are more the X-Next-Cursor header
+    holds the cursor parameter for the next page. With download, all repeats are streamed as a file.
 """
 #TODO: Test on an example when there are multiple genes associated with the repeat
 @app.get("/repeats", response_model=List[schemas.RepeatInfo], tags=["Repeats"])
-def show_repeats(gene_names: List[str] = Query(None), ensembl_ids: List[str] = Query(None), region_query: str = Query(None), download: Optional[bool] = False, db: Session = Depends(get_db)):  
-    def repeats_to_list(repeats, region_query):
-        rows = []
-        
-        for r in iter(repeats):
-      
-            repeat = r[0]
-            gene_info = r[1]
-
-            if gene_info:
-                if region_query:
-                    gene = dict(db.query(models.Gene).get(gene_info.gene_id))
-                else:
-                    gene = dict(gene_info)
-            else:
-                gene = dict(ensembl_id = None,
-                            strand=None,
-                            name=None,
-                            description=None)
-            if len(r) < 4:
-                crcvar_info = r[2]
-            elif len(r) == 4:
-                crcvar_info = r[3]
-            
-            if crcvar_info:
-                crcvar = dict(crcvar_info)
-            else:
-                crcvar = dict(total_calls=None, frac_variable = None, avg_size_diff = None)  
-
-            tr_panel_name = db.query(models.TRPanel).get(repeat.trpanel_id).name
-            if tr_panel_name == 'hipstr_hg38':
-                tr_panel_name = 'ensemble_tr'
-
-            rows.append({
-                "repeat_id": repeat.id,
-                "chr": repeat.chr,
-                "start":  repeat.start,
-                "end":  repeat.end,
-                "msa": repeat.msa,
-                "motif": repeat.motif,
-                "period": repeat.l_effective,
-                "copies": repeat.n_effective,
-                "ensembl_id": gene["ensembl_id"],
-                "strand": gene["strand"],
-                "gene_name": gene["name"],
-                "gene_desc": gene["description"],
-                "total_calls": crcvar["total_calls"],
-                "frac_variable": crcvar["frac_variable"],
-                "avg_size_diff": crcvar["avg_size_diff"],
-                "panel": tr_panel_name
-            })
-        return rows
-
-    def repeats_to_csv(repeats, region_query):
-        csvfile = io.StringIO()
-        headers = ['repeat_id','chr','start','end','msa','motif','motif', 'period','copies', 
-            'ensembl_id', 'strand','gene_name','gene_desc', 'total_calls',
-             'frac_variable', 'avg_size_diff', "panel"]
-        
-        writer = csv.DictWriter(csvfile, headers)
-        writer.writeheader()
-        for row in repeats_to_list(repeats, region_query):
-            writer.writerow(row)
-        csvfile.seek(0)
-        return(yield from csvfile)
-
-    # Retrieving things based on genes when gene_names
-    # TODO: 
-    # filter on period less than 7 
-    # join with panel name 
+async def show_repeats(request: Request, response: Response, gene_names: List[str] = Query(None), ensembl_ids: List[str] = Query(None), region_query: str = Query(None), download: Optional[bool] = False, format: str = Query("csv", regex=export.EXPORT_FORMAT_REGEX), cursor: str = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), db = Depends(get_db_or_async)):  
+    # Genes, repeats, CRC variation and panel name are fetched in a single query, from the precomputed
+    # repeat_summary table when it is up to date or else by joining the tables
+    use_summary = await run_in_threadpool(rr.use_repeat_summary)
+    keys = rr.SUMMARY_KEYS if use_summary else rr.VARIABILITY_KEYS
     if not region_query:
-        genes = gn.get_gene_info(db, gene_names, ensembl_ids, region_query)
-        gene_obj_ids = [gene.id for gene in genes]
-        
-    # When there is no region_query
-        statement = select(models.Repeat, models.Gene, models.GenesRepeatsLink, models.CRCVariation
-            ).join(models.Gene).where(models.Gene.id == models.GenesRepeatsLink.gene_id
-            ).join(models.Repeat).where(models.Repeat.id == models.GenesRepeatsLink.repeat_id
-            ).filter(models.Gene.id.in_(gene_obj_ids)
-            ).filter(models.Repeat.l_effective <= 6
-            ).join(models.CRCVariation, isouter=True
-            ).order_by(
-                case((models.CRCVariation.frac_variable.is_(None), 1), else_=0),
-                models.CRCVariation.frac_variable.desc(),
-                models.CRCVariation.total_calls
-            )
-
-
-    
-        repeats = db.exec(statement)
+        gene_clauses = gn.gene_filter(gene_names, ensembl_ids, region_query) or [sqlalchemy.false()]
+        gene_obj_ids = select(models.Gene.id).where(*gene_clauses)
+        statement = rr.summary_repeats_in_genes(gene_obj_ids) if use_summary else rr.repeats_in_genes(gene_obj_ids)
     else:
-        region_split = region_query.split(':')
-        chrom = 'chr' + region_split[0]
-        coord_split = region_split[1].split('-')
-        start = int(coord_split[0])
-        end = int(coord_split[1])
-        statement = select(models.Repeat, models.GenesRepeatsLink, models.CRCVariation
-            ).select_from(models.Repeat
-            ).filter(models.Repeat.chr == chrom, models.Repeat.start >= start, models.Repeat.end <= end, models.Repeat.l_effective <= 6
-            ).join(models.GenesRepeatsLink, isouter=True
-            ).join(models.CRCVariation, isouter=True
-            ).order_by(
-                case((models.CRCVariation.frac_variable.is_(None), 1), else_=0),
-                models.CRCVariation.frac_variable.desc(),
-                models.CRCVariation.total_calls
-    )
-    
-        
-        repeats = db.exec(statement)
-    if download:
-        return StreamingResponse(repeats_to_csv(repeats, region_query), media_type="text/csv")
+        chrom, start, end = gn.parse_region_query(region_query)
+        if use_summary:
+            statement = rr.summary_repeats_in_region(chrom, start, end)
+        else:
+            statement = rr.repeats_in_region(chrom, start, end)
+
+    if download or format in export.COLUMNAR_FORMATS:
+        return export.export_response(db, statement, rr.REPEAT_INFO_FIELDS, rr.repeat_info_values,
+            file_format=format, filename="repeats")
     else:
-        results = repeats_to_list(repeats, region_query)
-        return results
+        repeats, next_cursor = await run_query(db, rr.get_repeat_page, statement, cursor, limit, keys)
+        pg.set_next_cursor(request, response, next_cursor)
+        return repeats
+
+# Largest number of repeat ids and of regions accepted by a single /repeats/batch request, the total
+# length in bp of the regions and the number of repeats they may select
+BATCH_MAX_REPEAT_IDS = 1000
+BATCH_MAX_REGIONS = 100
+BATCH_MAX_SPAN = 10000000
+BATCH_MAX_REPEATS = MAX_PAGE_SIZE
 
 """ 
-Retrieve all variations given a repeat id 
+Retrieve repeat info, allele frequencies and allele sequences of many repeats at once
      
    Parameters
-   repeat (Repeat):
-        repeat_id
+   request (RepeatBatchRequest):
+        repeat_ids: list of repeat ids
+        regions: list of regions, e.g. 1:182393-1014541, all repeats (period <= 6) within them are included
    
     Returns
-    List of Variations 
+    RepeatBatch with repeat info, allele frequencies and allele sequences ordered by repeat id. Requests
+    whose regions span more than BATCH_MAX_SPAN bp or select more than BATCH_MAX_REPEATS repeats are
+    rejected, use /repeats for large regions.
 """
-@app.get("/variations/", response_model=List[schemas.CRCVariation], tags=["Variations"])
-def show_variation(repeat_id: int, db: Session = Depends(get_db)):
-   variations = db.query(models.CRCVariation).filter(models.CRCVariation.repeat_id == repeat_id).all()
-   return variations
+@app.post("/repeats/batch", response_model=schemas.RepeatBatch, tags=["Repeats"])
+async def show_repeats_batch(request: schemas.RepeatBatchRequest, db = Depends(get_db_or_async)):
+    if not request.repeat_ids and not request.regions:
+        raise HTTPException(status_code=400, detail="Provide repeat_ids or regions")
+    if len(request.repeat_ids) > BATCH_MAX_REPEAT_IDS or len(request.regions) > BATCH_MAX_REGIONS:
+        raise HTTPException(status_code=400,
+            detail=f"At most {BATCH_MAX_REPEAT_IDS} repeat ids and {BATCH_MAX_REGIONS} regions per request")
+    try:
+        regions = [gn.parse_region_query(region_query) for region_query in request.regions]
+    except (IndexError, ValueError):
+        raise HTTPException(status_code=400, detail="Regions must look like 1:182393-1014541")
+    if sum(max(end - start, 0) for _, start, end in regions) > BATCH_MAX_SPAN:
+        raise HTTPException(status_code=400, detail=f"Regions may span at most {BATCH_MAX_SPAN} bp per request")
+
+    if regions:
+        repeat_ids = await run_query(db, rr.select_repeat_ids,
+            rr.repeat_ids_selected(request.repeat_ids, regions), BATCH_MAX_REPEATS + 1)
+        if len(repeat_ids) > BATCH_MAX_REPEATS:
+            raise HTTPException(status_code=400,
+                detail=f"The regions hold more than {BATCH_MAX_REPEATS} repeats, split the request or use /repeats")
+    else:
+        repeat_ids = sorted(set(request.repeat_ids))
+    return await run_query(db, rr.get_repeat_batch, repeat_ids)
 
+# Value of the format query parameter of /bed/
+BED_FORMAT_REGEX = "^(" + "|".join(sorted(BedTR.supported_formats)) + ")$"
+
+def parse_thresholds(thresholds):
+    """ BedMaker thresholds from query values of the form unit_length:min_units """
+    if not thresholds:
+        return BedMaker.default_thresholds
+    try:
+        return dict(tuple(int(number) for number in threshold.split(":")) for threshold in thresholds)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Thresholds must look like 1:9, unit length:minimal number of perfect units")
 
 """ 
-Retrieve all STR variations found in the genes associated with given gene names
+Stream a bed file for genotyping the repeats in the given genes, region or panel
      
    Parameters
-   gene (Gene):
-        Gene name
+   gene_names, ensembl_ids:
+        Genes whose repeats are included
+   region_query:
+        Region, e.g. 1:182393-1014541, the repeats (period <= 6) within it are included
+   panel:
+        Name of a TRPanel, only its repeats are included
+   thresholds:
+        Minimal number of consecutive perfect units per unit length, e.g. thresholds=1:9&thresholds=2:4.
+        Repeats with a consensus unit of another length are left out. Default: BedMaker.default_thresholds
+   consensus_only:
+        Only stretches of units equal to the consensus unit are reported
+   format:
+        Output format, one of BedTR.supported_formats
    
     Returns
-    Streams a csv file of variations for the given gene
+    Streams a .bed file of the repeats passing the thresholds, ordered by chromosome and position
 """
-@app.get("/variations/", response_model=List[schemas.CRCVariation], tags=["Variations"])
-def show_str_variation_in_genes(gene_names: List[str] = Query(None), download: Optional[bool] = False, db: Session = Depends(get_db)):
-    def variations_to_csv(variations):
-        csvfile = io.StringIO()
-        headers = ['patient','sample_type','repeat_id','start','end','ref','alt']
-        rows = []
-        for var in variations:
-            rows.append(
-                {
-                    'patient': var.tcga_barcode,
-                    'sample_type': var.sample_type,
-                    'repeat_id': var.repeat_id,
-                    'start': var.start,
-                    'end': var.end,
-                    'ref': var.reference,
-                    'alt': var.alt
-                }
-            )
-        writer = csv.DictWriter(csvfile, headers)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
-        csvfile.seek(0)
-        return(yield from csvfile)
-    
-    genes =  db.query(models.Gene).with_entities(models.Gene.id).filter(models.Gene.name.in_(gene_names)).all()
-    gene_ids = [id[0] for id in genes]
-    repeats = db.query(models.Repeat).with_entities(models.Repeat.id).filter(models.Repeat.genes.any(
-            models.GenesRepeatsLink.gene_id.in_(gene_ids))).all()
-    repeat_ids = [id[0] for id in repeats]
-
-    variations = db.query(models.CRCVariation).filter(models.CRCVariation.repeat_id.in_(repeat_ids)).all()
+@app.get("/bed/", tags=["Repeats"])
+def show_bed(gene_names: List[str] = Query(None), ensembl_ids: List[str] = Query(None), region_query: str = Query(None), panel: str = Query(None), thresholds: List[str] = Query(None), consensus_only: bool = False, format: str = Query("GangSTR", regex=BED_FORMAT_REGEX), db: Session = Depends(get_db)):
+    if not (gene_names or ensembl_ids or region_query or panel):
+        raise HTTPException(status_code=400, detail="Provide gene_names, ensembl_ids, region_query or panel")
+    gene_clauses = gn.gene_filter(gene_names, ensembl_ids, None) or []
+    repeat_clauses = []
+    if region_query:
+        try:
+            repeat_clauses += rr.region_clauses(*gn.parse_region_query(region_query))
+        except (IndexError, ValueError):
+            raise HTTPException(status_code=400, detail="region_query must look like 1:182393-1014541")
+    if panel:
+        try:
+            repeat_clauses.append(models.Repeat.trpanel_id == dimension_cache.panel_id(panel))
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Panel {panel} not found")
+
+    bedmaker = BedMaker(db, consensus_only=consensus_only, thresholds=parse_thresholds(thresholds), out_format=format)
+    bedmaker.set_filters(gene_clauses, repeat_clauses)
+    return export.bed_response(bedmaker, filename=f"repeats_{format}")
 
-    if download:
-        return StreamingResponse(variations_to_csv(variations), media_type="text/csv")
+""" 
+Retrieve the STR variations of one repeat, or of all repeats in the genes with the given names
+     
+   Parameters
+   repeat_id (int):
+        Repeat id
+   gene_names (List[str]):
+        Gene names, used when no repeat_id is given
+   
+    Returns
+    List of Variations, at most limit of them (default 1000); the X-Next-Cursor header holds the cursor
+    for the next page. With download, all variations are streamed as a csv, tsv, Arrow or Parquet file.
+"""
+@app.get("/variations/", response_model=List[schemas.CRCVariation], tags=["Variations"])
+def show_variation(request: Request, response: Response, repeat_id: Optional[int] = None, gene_names: List[str] = Query(None), download: Optional[bool] = False, format: str = Query("csv", regex=export.EXPORT_FORMAT_REGEX), cursor: str = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), db: Session = Depends(get_db)):
+    if repeat_id is not None:
+        repeat_filter = models.CRCVariation.repeat_id == repeat_id
+    elif gene_names:
+        gene_repeat_ids = select(models.GenesRepeatsLink.repeat_id
+            ).join(models.Gene, models.Gene.id == models.GenesRepeatsLink.gene_id
+            ).where(models.Gene.name.in_(gene_names))
+        repeat_filter = models.CRCVariation.repeat_id.in_(gene_repeat_ids)
+    else:
+        raise HTTPException(status_code=400, detail="Provide repeat_id or gene_names")
+
+    if download or format in export.COLUMNAR_FORMATS:
+        headers = ['repeat_id', 'instable_calls', 'stable_calls', 'total_calls', 'frac_variable', 'avg_size_diff']
+        statement = select(*[getattr(models.CRCVariation, column) for column in headers]
+            ).where(repeat_filter
+            ).order_by(models.CRCVariation.repeat_id)
+        return export.export_response(db, statement, headers, file_format=format, filename="variations")
     else:
-        return variations
+        statement = select(models.CRCVariation).where(repeat_filter)
+        keys = [(models.CRCVariation.repeat_id, False), (models.CRCVariation.id, False)]
+        rows, next_cursor = pg.fetch_page(db, statement, keys, cursor, limit)
+        pg.set_next_cursor(request, response, next_cursor)
+        return [row[0] for row in rows]
 
 # for gene return all transcripts
 @app.get("/transcript/{gene}", response_model=List[schemas.Transcript], tags=["Genes"])
@@ -454,16 +458,26 @@ def get_sorted_exons(transcript: str, protein: bool = False, db: Session = Depen
 """ Retrieve all CRC Gene Expression Repeat Length Correlations
 
     Returns
-    List of correlations between genes and a specific repeat length in CRC patients
+    List of correlations between genes and a specific repeat length in CRC patients, strongest
+    correlations first. At most limit of them, the X-Next-Cursor header holds the cursor for the next page.
+    With format, all correlations are streamed as a csv, tsv, Arrow or Parquet file instead.
 """
 @app.get("/crc_expr_repeatlen_corr/", response_model=List[schemas.CRCExprRepeatLenCorr])
-def get_crc_expr_repeatlen_corr(db: Session = Depends(get_db), limit = 7000):
-
-    correlations = db.query(models.CRCExprRepeatLenCorr).order_by(
-        sqlalchemy.func.abs(models.CRCExprRepeatLenCorr.coefficient).desc()
-    ).limit(limit).options(
-        joinedload(models.CRCExprRepeatLenCorr.gene), joinedload(models.CRCExprRepeatLenCorr.repeat)
-    ).all()
-
-    return [{**c.gene.__dict__, **c.repeat.__dict__, **c.__dict__} for c in correlations]
+def get_crc_expr_repeatlen_corr(request: Request, response: Response, db: Session = Depends(get_db), cursor: str = Query(None), limit: int = Query(7000, ge=1, le=MAX_PAGE_SIZE), format: str = Query(None, regex=export.EXPORT_FORMAT_REGEX)):
+    corr = models.CRCExprRepeatLenCorr
+    statement = select(
+            corr.repeat_id, corr.gene_id, corr.coefficient, corr.intercept, corr.p_value, corr.p_value_corrected,
+            models.Gene.ensembl_id, models.Repeat.chr, models.Repeat.start, models.Gene.name, models.Gene.description
+        ).join(models.Gene, models.Gene.id == corr.gene_id
+        ).join(models.Repeat, models.Repeat.id == corr.repeat_id)
+    keys = [(sqlalchemy.func.abs(corr.coefficient), True), (corr.repeat_id, False), (corr.gene_id, False)]
+
+    if format:
+        statement = statement.order_by(*[expression.desc() if descending else expression for expression, descending in keys])
+        headers = [column.key for column in statement.selected_columns]
+        return export.export_response(db, statement, headers, file_format=format, filename="crc_expr_repeatlen_corr")
+
+    rows, next_cursor = pg.fetch_page(db, statement, keys, cursor, limit)
+    pg.set_next_cursor(request, response, next_cursor)
+    return rows
 
@@ -0,0 +1,93 @@
+import base64
+import binascii
+import hashlib
+import json
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+# Page sizes of the paginated list endpoints, clients can ask for smaller or larger pages up to the cap.
+# Only downloads return all rows, they are streamed.
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def keys_id(keys) -> str:
+    """ Short identifier of a list of sort keys, stored in the cursor so a cursor is only accepted by
+    the query it was made for
+    """
+    description = ",".join(f"{expression}{' desc' if descending else ''}" for expression, descending in keys)
+    return hashlib.sha1(description.encode()).hexdigest()[:8]
+
+def encode_cursor(keys, values) -> str:
+    """ Opaque cursor holding the sort keys identifier and the key values of the last row of a page """
+    content = {"keys": keys_id(keys), "values": list(values)}
+    return base64.urlsafe_b64encode(json.dumps(content).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, keys) -> list:
+    try:
+        content = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(content, dict) or not isinstance(content.get("values"), list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if content.get("keys") != keys_id(keys):
+        # e.g. a /repeats cursor from the repeat_summary table after an import made it stale
+        raise HTTPException(status_code=400, detail="Cursor does not belong to this query, the data may have changed since the first page. Start again without cursor")
+    if len(content["values"]) != len(keys):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return content["values"]
+
+def after_keys(keys, values):
+    """ Filter selecting the rows sorted after the row with the given key values. Expands the row
+    value comparison (k1, k2, ...) > (v1, v2, ...) so every key can have its own direction.
+    """
+    clauses = []
+    for i, (expression, descending) in enumerate(keys):
+        following = expression < values[i] if descending else expression > values[i]
+        equal_before = [keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_before, following))
+    return or_(*clauses)
+
+def fetch_page(db, statement, keys, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """ Keyset pagination: fetch the page of rows of statement that follows the cursor. Pages are
+    found through a filter on the sort keys, so deep pages cost no more than the first one (no OFFSET).
+
+    Parameters
+    db:         Session connected to the database
+    statement:  Select statement, its own ordering is replaced by the keys
+    keys:       List of (expression, descending) tuples to sort on, unique for every row
+    cursor:     Cursor returned with the previous page, None for the first page
+    limit:      Maximum number of rows in the page, None for all rows following the cursor
+
+    Returns
+    (rows, next_cursor) where next_cursor is None on the last page. The rows have the columns of
+    statement, the key values used for the cursor are left out.
+    """
+    statement = statement.add_columns(*[expression.label(f"page_key_{i}") for i, (expression, _) in enumerate(keys)])
+    if cursor:
+        statement = statement.where(after_keys(keys, decode_cursor(cursor, keys)))
+    statement = statement.order_by(None).order_by(
+        *[expression.desc() if descending else expression for expression, descending in keys]
+    )
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+
+    # the result is read twice: the rows without the key columns and the keys of the last row
+    result = db.execute(statement)
+    n_columns = len(result.keys()) - len(keys)
+    frozen = result.freeze()
+    rows = frozen().columns(*range(n_columns)).all()
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    key_values = frozen().columns(*range(n_columns, n_columns + len(keys))).all()
+    return rows[:limit], encode_cursor(keys, key_values[limit - 1])
+
+def set_next_cursor(request, response, next_cursor) -> None:
+    """ Return the cursor of the next page in the X-Next-Cursor header and as a Link rel="next" url """
+    if next_cursor is None:
+        return
+    response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    next_url = request.url.include_query_params(cursor=next_cursor)
+    response.headers["Link"] = f'<{next_url}>; rel="next"'
@@ -0,0 +1,183 @@
+from sqlmodel import select
+from sqlalchemy import and_, or_, func
+
+from .repeats.models import Repeat, Gene, GenesRepeatsLink, CRCVariation, AlleleFrequency, AlleleSequence, RepeatSummary
+from .dimensions import dimension_cache
+from .utils.binning import bin_filter
+from .pagination import fetch_page, DEFAULT_PAGE_SIZE
+
+# Fields of schemas.RepeatInfo, in output order
+REPEAT_INFO_FIELDS = [
+    'repeat_id', 'chr', 'start', 'end', 'msa', 'motif', 'period', 'copies',
+    'ensembl_id', 'strand', 'gene_name', 'gene_desc', 'total_calls',
+    'frac_variable', 'avg_size_diff', 'panel'
+]
+
+def repeat_info_select():
+    """ Base statement for RepeatInfo rows. Repeat, Gene and CRCVariation are joined in a single query
+    so building a row never triggers additional lookups, panel names come from the dimension cache.
+    Repeats without a gene or without CRC variation are kept (outer joins), a repeat associated
+    with several genes yields one row per gene.
+
+    Returns
+    Select statement whose labeled columns match the fields of schemas.RepeatInfo, except for
+    'trpanel_id' which row_to_repeat_info() converts into the panel name
+    """
+    return select(
+            Repeat.id.label("repeat_id"),
+            Repeat.chr,
+            Repeat.start,
+            Repeat.end,
+            Repeat.msa,
+            Repeat.motif,
+            Repeat.l_effective.label("period"),
+            Repeat.n_effective.label("copies"),
+            Gene.ensembl_id,
+            Gene.strand,
+            Gene.name.label("gene_name"),
+            Gene.description.label("gene_desc"),
+            CRCVariation.total_calls,
+            CRCVariation.frac_variable,
+            CRCVariation.avg_size_diff,
+            Repeat.trpanel_id
+        ).select_from(Repeat
+        ).join(GenesRepeatsLink, GenesRepeatsLink.repeat_id == Repeat.id, isouter=True
+        ).join(Gene, Gene.id == GenesRepeatsLink.gene_id, isouter=True
+        ).join(CRCVariation, CRCVariation.repeat_id == Repeat.id, isouter=True)
+
+# Sort keys of repeat rows as (expression, descending): most variable repeats first, repeats without
+# CRC variation data last. The keys are unique for every row so they double as keyset for pagination.
+VARIABILITY_KEYS = [
+    (func.coalesce(CRCVariation.frac_variable, -1), True),
+    (func.coalesce(CRCVariation.total_calls, -1), False),
+    (Repeat.id, False),
+    (func.coalesce(GenesRepeatsLink.gene_id, -1), False)
+]
+
+def order_by_variability(statement):
+    return statement.order_by(
+        *[expression.desc() if descending else expression for expression, descending in VARIABILITY_KEYS]
+    )
+
+def repeats_in_genes(gene_ids):
+    """ Statement for all repeats (period <= 6) associated with the given Gene ids """
+    statement = repeat_info_select().where(
+        GenesRepeatsLink.gene_id.in_(gene_ids),
+        Repeat.l_effective <= 6
+    )
+    return order_by_variability(statement)
+
+def region_clauses(chrom, start, end):
+    """ Filter clauses on Repeat selecting repeats (period <= 6) located completely within chrom:start-end """
+    return [
+        Repeat.chr == chrom,
+        bin_filter(Repeat.bin, start, end),
+        Repeat.start >= start,
+        Repeat.end <= end,
+        Repeat.l_effective <= 6
+    ]
+
+def repeats_in_region(chrom, start, end):
+    """ Statement for all repeats (period <= 6) located completely within chrom:start-end """
+    statement = repeat_info_select().where(*region_clauses(chrom, start, end))
+    return order_by_variability(statement)
+
+# Sort key of repeat_summary rows, the precomputed equivalent of VARIABILITY_KEYS
+SUMMARY_KEYS = [(RepeatSummary.variability_rank, False)]
+
+def use_repeat_summary() -> bool:
+    """ True if the repeat_summary table was refreshed after the last import and can replace the joins """
+    dimension_cache.refresh()
+    return dimension_cache.repeat_summary_current
+
+def summary_select():
+    """ Same columns as repeat_info_select(), read from the denormalized repeat_summary table """
+    return select(*[getattr(RepeatSummary, field).label(field) for field in REPEAT_INFO_FIELDS if field != 'panel'],
+                  RepeatSummary.trpanel_id)
+
+def summary_repeats_in_genes(gene_ids):
+    """ repeats_in_genes() on repeat_summary: a range scan of the (gene_id, variability_rank) index """
+    return summary_select().where(RepeatSummary.gene_id.in_(gene_ids)).order_by(RepeatSummary.variability_rank)
+
+def summary_repeats_in_region(chrom, start, end):
+    """ repeats_in_region() on repeat_summary, which only holds repeats with period <= 6 """
+    return summary_select().where(
+        RepeatSummary.chr == chrom,
+        bin_filter(RepeatSummary.bin, start, end),
+        RepeatSummary.start >= start,
+        RepeatSummary.end <= end
+    ).order_by(RepeatSummary.variability_rank)
+
+def repeat_by_id(repeat_id):
+    """ Statement for a single RepeatInfo row of the given repeat id """
+    return repeat_info_select().where(Repeat.id == repeat_id).limit(1)
+
+def repeat_ids_selected(repeat_ids, regions):
+    """ Statement selecting the ids of the given repeats plus those of all repeats within the
+    regions, a list of (chrom, start, end) tuples. Used as a subquery of the batch lookups.
+    """
+    selections = []
+    if repeat_ids:
+        selections.append(Repeat.id.in_(repeat_ids))
+    for chrom, start, end in regions:
+        selections.append(and_(*region_clauses(chrom, start, end)))
+    return select(Repeat.id).where(or_(*selections))
+
+def select_repeat_ids(db, statement, limit):
+    """ The first limit repeat ids, in id order, selected by a repeat_ids_selected() statement """
+    return db.exec(statement.order_by(Repeat.id).limit(limit)).all()
+
+def row_to_repeat_info(row):
+    # runs inside run_sync() with the async engine, the dimension cache is refreshed in the background
+    repeat_info = dict(row._mapping)
+    repeat_info["panel"] = dimension_cache.loaded_panel_name(repeat_info.pop("trpanel_id"))
+    return repeat_info
+
+def repeat_info_values(row):
+    """ RepeatInfo values of a row in REPEAT_INFO_FIELDS order, used for csv/tsv export """
+    repeat_info = row_to_repeat_info(row)
+    return [repeat_info[field] for field in REPEAT_INFO_FIELDS]
+
+def get_repeat_rows(db, statement):
+    """ Execute a statement built by this module and convert the result into RepeatInfo dicts.
+
+    Parameters
+    db:         Session connected to the database
+    statement:  Statement returned by repeats_in_genes(), repeats_in_region() or repeat_by_id()
+
+    Returns
+    List of dicts with the fields of schemas.RepeatInfo
+    """
+    return [row_to_repeat_info(row) for row in db.exec(statement)]
+
+def get_repeat_page(db, statement, cursor=None, limit=DEFAULT_PAGE_SIZE, keys=VARIABILITY_KEYS):
+    """ Like get_repeat_rows(), for one page of the rows (see pagination.fetch_page()). The rows are
+    sorted by keys, SUMMARY_KEYS for statements on repeat_summary.
+
+    Returns
+    (list of RepeatInfo dicts, cursor of the next page or None)
+    """
+    rows, next_cursor = fetch_page(db, statement, keys, cursor, limit)
+    return [row_to_repeat_info(row) for row in rows], next_cursor
+
+def get_repeat_batch(db, repeat_ids):
+    """ Repeat info, allele frequencies and allele sequences of many repeats at once. Every table
+    is read with a single IN query, whatever the number of repeats.
+
+    Parameters
+    db:          Session connected to the database
+    repeat_ids:  List of repeat ids or a statement selecting them, see repeat_ids_selected()
+
+    Returns
+    Dict with the fields of schemas.RepeatBatch, all lists are ordered by repeat id
+    """
+    repeats = get_repeat_rows(db, repeat_info_select().where(Repeat.id.in_(repeat_ids)).order_by(Repeat.id))
+    allfreqs = db.exec(select(AlleleFrequency).where(AlleleFrequency.repeat_id.in_(repeat_ids)
+        ).order_by(AlleleFrequency.repeat_id, AlleleFrequency.id)).all()
+    allseqs = db.exec(select(AlleleSequence).where(AlleleSequence.repeat_id.in_(repeat_ids)
+        ).order_by(AlleleSequence.repeat_id, AlleleSequence.id)).all()
+    return {
+        "repeats": repeats,
+        "allele_frequencies": allfreqs,
+        "allele_sequences": allseqs
+    }
@@ -1,9 +1,12 @@
 import os
 import logging
 import sys
+import time
+import threading
 from io import StringIO
 
 from sqlmodel import create_engine, Session, SQLModel
+from starlette.concurrency import run_in_threadpool
 
 from alembic.config import Config as AlembicConfig
 from alembic.script import ScriptDirectory as AlembicScriptDirectory
@@ -48,7 +51,85 @@ def check_db_version(engine, config_file: str = os.path.join(os.path.split(__fil
   This can require changing database url in alembic.ini and running alembic upgrade head
   """) 
 
-engine = create_engine(final_db_url, echo=False)
+"""
+Connection pool settings, all optional:
+WEBSTR_DATABASE_POOL_SIZE          connections kept open in the pool (default 5)
+WEBSTR_DATABASE_MAX_OVERFLOW       connections opened on top of the pool size under load (default 10)
+WEBSTR_DATABASE_POOL_TIMEOUT       seconds to wait for a free connection before failing (default 30)
+WEBSTR_DATABASE_POOL_RECYCLE       seconds after which a connection is replaced (default 1800)
+WEBSTR_DATABASE_POOL_PRE_PING      1 to test connections on checkout, drops stale connections after a
+                                   database restart (default 1)
+WEBSTR_DATABASE_STATEMENT_TIMEOUT  PostgreSQL statement_timeout in milliseconds (default unset)
+SQLite databases use the default SQLAlchemy pool and ignore these settings.
+"""
+def engine_options(database_url: str, async_driver: bool = False) -> dict:
+  if database_url.startswith("sqlite"):
+    # sessions are created and used in different threadpool workers
+    return {"connect_args": {"check_same_thread": False}} if not async_driver else {}
+
+  options = {
+    "pool_size": int(os.environ.get("WEBSTR_DATABASE_POOL_SIZE", 5)),
+    "max_overflow": int(os.environ.get("WEBSTR_DATABASE_MAX_OVERFLOW", 10)),
+    "pool_timeout": int(os.environ.get("WEBSTR_DATABASE_POOL_TIMEOUT", 30)),
+    "pool_recycle": int(os.environ.get("WEBSTR_DATABASE_POOL_RECYCLE", 1800)),
+    "pool_pre_ping": os.environ.get("WEBSTR_DATABASE_POOL_PRE_PING", "1") == "1",
+  }
+  statement_timeout = os.environ.get("WEBSTR_DATABASE_STATEMENT_TIMEOUT", "")
+  if statement_timeout:
+    if async_driver:
+      options["connect_args"] = {"server_settings": {"statement_timeout": statement_timeout}}
+    else:
+      options["connect_args"] = {"options": f"-c statement_timeout={int(statement_timeout)}"}
+  return options
+
+class PoolWaitStats(object):
+  """
+  Time spent waiting for a connection from the pool, recorded by the session dependencies
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.checkouts = 0
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+
+  def record(self, seconds: float) -> None:
+    with self.lock:
+      self.checkouts += 1
+      self.total_wait += seconds
+      self.max_wait = max(self.max_wait, seconds)
+
+  def as_dict(self) -> dict:
+    with self.lock:
+      return {
+        "checkouts": self.checkouts,
+        "total_wait_ms": round(self.total_wait * 1000, 3),
+        "avg_wait_ms": round(self.total_wait * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+        "max_wait_ms": round(self.max_wait * 1000, 3),
+      }
+
+pool_wait_stats = PoolWaitStats()
+
+def connect_session(session) -> None:
+  # Check out the connection right away to measure how long the pool makes us wait for it
+  started = time.perf_counter()
+  session.connection()
+  pool_wait_stats.record(time.perf_counter() - started)
+
+def pool_status(engine) -> dict:
+  """
+  Current state of the connection pool of an engine. Pools without a fixed size (SQLite) only
+  report their class name.
+  """
+  pool = engine.pool
+  status = {"pool": type(pool).__name__}
+  for stat in ("size", "checkedin", "checkedout", "overflow"):
+    if hasattr(pool, stat):
+      status[stat] = getattr(pool, stat)()
+  if hasattr(pool, "timeout"):
+    status["timeout"] = pool.timeout()
+  return status
+
+engine = create_engine(final_db_url, echo=False, **engine_options(final_db_url))
 
 """
 WARNING: Alembic functionality was teste but not used by default. Treat it as a POC for future versions.
@@ -58,4 +139,68 @@ if os.environ.get("WEBSTR_DATABASE_MIGRATIONS_ENABLE", "")  == "1":
 
 def get_db():
   with Session(engine) as session:
+    connect_session(session)
     yield session
+
+"""
+Optional async database access, enabled with WEBSTR_DATABASE_ASYNC=1. Requires asyncpg for PostgreSQL
+or aiosqlite for SQLite databases. Endpoints that depend on get_db_or_async() and execute their
+queries through run_query() then wait for the database without occupying a threadpool worker.
+"""
+ASYNC_DRIVERS = {
+  "postgres": "postgresql+asyncpg",
+  "postgresql": "postgresql+asyncpg",
+  "sqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(database_url: str) -> str:
+  scheme, location = database_url.split("://", 1)
+  dialect = scheme.split("+")[0]
+  if dialect not in ASYNC_DRIVERS:
+    raise ValueError(f"No async driver configured for database dialect '{dialect}'")
+  return f"{ASYNC_DRIVERS[dialect]}://{location}"
+
+async_engine = None
+if os.environ.get("WEBSTR_DATABASE_ASYNC", "") == "1":
+  from sqlalchemy.ext.asyncio import create_async_engine
+  async_engine = create_async_engine(async_database_url(final_db_url), echo=False,
+                                     **engine_options(final_db_url, async_driver=True))
+  logging.info(f"Database: async engine enabled ({async_engine.url.drivername})")
+
+async def get_db_or_async():
+  """
+  Yields an AsyncSession if the async engine is enabled, a regular Session otherwise
+  """
+  if async_engine is not None:
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    async with AsyncSession(async_engine) as session:
+      started = time.perf_counter()
+      await session.connection()
+      pool_wait_stats.record(time.perf_counter() - started)
+      yield session
+  else:
+    session = Session(engine)
+    try:
+      await run_in_threadpool(connect_session, session)
+      yield session
+    finally:
+      # closing returns the connection to the pool (rollback), keep that off the event loop
+      await run_in_threadpool(session.close)
+
+async def run_query(db, query_function, *args):
+  """
+  Run query_function(session, *args) on a session from get_db_or_async(). Sync sessions run it in
+  the threadpool, async sessions run it on the event loop using the async driver.
+  """
+  if isinstance(db, Session):
+    return await run_in_threadpool(query_function, db, *args)
+  return await db.run_sync(query_function, *args)
+
+def fetch_all(db, statement):
+  return db.exec(statement).all()
+
+def get_pool_stats() -> dict:
+  stats = {"engine": pool_status(engine), "wait": pool_wait_stats.as_dict()}
+  if async_engine is not None:
+    stats["async_engine"] = pool_status(async_engine.sync_engine)
+  return stats
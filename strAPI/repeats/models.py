@@ -1,5 +1,6 @@
+from datetime import datetime
 from typing import Optional, List, Dict
-from sqlalchemy import Integer, CheckConstraint, UniqueConstraint, ForeignKeyConstraint
+from sqlalchemy import Integer, CheckConstraint, UniqueConstraint, ForeignKeyConstraint, Index
 from sqlmodel import SQLModel, Field, Relationship, JSON, Column
 
 class ExonTranscriptsLink(SQLModel, table=True):
@@ -61,7 +62,12 @@ class Transcript(SQLModel, table=True):
 
 class Gene(SQLModel, table=True):
     __tablename__ = "genes"
-    __table_args__ = (UniqueConstraint("ensembl_version_id"), CheckConstraint("strand in ('+', '-')"))
+    __table_args__ = (
+        UniqueConstraint("ensembl_version_id"),
+        CheckConstraint("strand in ('+', '-')"),
+        # interval index for region queries, see strAPI/utils/binning.py
+        Index("ix_genes_chr_bin", "chr", "bin"),
+    )
 
     id: int = Field(default=None, primary_key=True)
     ensembl_id: str = Field(nullable=False)
@@ -73,6 +79,7 @@ class Gene(SQLModel, table=True):
     strand: str = Field(nullable=False)
     start: int = Field(nullable=False)
     end: int = Field(nullable=False)    
+    bin: Optional[int] = Field(default=None) # UCSC bin of start-end, see strAPI/utils/binning.py
 
     # one to many Genome -> Genes
     genome_id: int = Field(foreign_key ="genomes.id")
@@ -127,6 +134,8 @@ class Exon(SQLModel, table=True):
 
 class CRCVariation(SQLModel, table=True):
     __tablename__ = "crcvariations"
+    # one variation summary per repeat, also the conflict target of the upserts in database_setup
+    __table_args__ = (Index("uq_crcvariations_repeat_id", "repeat_id", unique=True),)
 
     id: int = Field(primary_key=True)   
     instable_calls: Optional[int] = Field(default = None)
@@ -202,6 +211,8 @@ class AlleleSequence(SQLModel, table=True):
 
 class Repeat(SQLModel, table=True):
     __tablename__ = "repeats"
+    # interval index for region queries, see strAPI/utils/binning.py
+    __table_args__ = (Index("ix_repeats_chr_bin", "chr", "bin"),)
 
     id: int = Field(primary_key=True)   
     source: Optional[str] = Field(default="unknown")# e.g. which detector found this Repeat?
@@ -210,6 +221,7 @@ class Repeat(SQLModel, table=True):
     motif: str = Field(nullable=True)
     start: int = Field(nullable=False)
     end: int = Field(nullable=False)
+    bin: Optional[int] = Field(default=None) # UCSC bin of start-end, see strAPI/utils/binning.py
     l_effective: int = Field(nullable=False)
     n_effective: int = Field(nullable=False)
     region_length: int = Field(nullable=False)
@@ -378,3 +390,59 @@ class CRCExprRepeatLenCorr(SQLModel, table=True):
 
 
 
+
+
+"""
+Version stamp of the imported dataset. The database_setup scripts increment it after every import,
+so that the API can tell when cached data (e.g. panel and genome names) is outdated.
+"""
+class DatasetVersion(SQLModel, table=True):
+    __tablename__ = "dataset_version"
+
+    # a single row, no indexes, as created by the migrations
+    id: int = Field(default=None, primary_key=True, index=False)
+    version: int = Field(nullable=False, default=1, index=False)
+    updated_at: datetime = Field(nullable=False, default_factory=datetime.utcnow, index=False)
+    # dataset version the repeat_summary table was last refreshed for
+    summary_version: Optional[int] = Field(default=None, index=False)
+
+    def __repr__(self):
+        return "DatasetVersion(version={}, updated_at={})".format(
+            self.version,
+            self.updated_at
+        )
+
+
+"""
+Denormalized copy of the rows served by /repeats: every repeat with period <= 6 joined with its genes and
+CRC variation, one row per repeat and gene. Rebuilt by database_setup/refresh_repeat_summary.py, the API
+only reads it while summary_version in dataset_version matches the current version.
+"""
+class RepeatSummary(SQLModel, table=True):
+    __tablename__ = "repeat_summary"
+    __table_args__ = (
+        Index("ix_repeat_summary_gene_rank", "gene_id", "variability_rank"),
+        Index("ix_repeat_summary_chr_bin_start", "chr", "bin", "start"),
+    )
+
+    id: int = Field(default=None, primary_key=True)
+    # position in the /repeats sort order: most variable repeats first, repeats without CRC variation last
+    variability_rank: int = Field(nullable=False, index=False)
+    repeat_id: int = Field(nullable=False, index=False)
+    gene_id: Optional[int] = Field(default=None, index=False)
+    chr: str = Field(nullable=False, index=False)
+    start: int = Field(nullable=False, index=False)
+    end: int = Field(nullable=False, index=False)
+    bin: Optional[int] = Field(default=None, index=False)
+    msa: Optional[str] = Field(default=None, index=False)
+    motif: Optional[str] = Field(default=None, index=False)
+    period: int = Field(nullable=False, index=False)
+    copies: int = Field(nullable=False, index=False)
+    ensembl_id: Optional[str] = Field(default=None, index=False)
+    strand: Optional[str] = Field(default=None, index=False)
+    gene_name: Optional[str] = Field(default=None, index=False)
+    gene_desc: Optional[str] = Field(default=None, index=False)
+    total_calls: Optional[int] = Field(default=None, index=False)
+    frac_variable: Optional[float] = Field(default=None, index=False)
+    avg_size_diff: Optional[float] = Field(default=None, index=False)
+    trpanel_id: int = Field(nullable=False, index=False)
@@ -94,13 +94,22 @@ class AlleleSequence(BaseModel):
     class Config:
         orm_mode = True
 
+class RepeatBatchRequest(BaseModel):
+    repeat_ids: List[int] = []
+    regions: List[str] = []
+
+class RepeatBatch(BaseModel):
+    repeats: List[RepeatInfo]
+    allele_frequencies: List[AlleleFrequency]
+    allele_sequences: List[AlleleSequence]
+
 class CRCVariation(BaseModel):
-    tcga_barcode: str
-    sample_type: str
-    start: int
-    end: int
-    reference: int
-    alt: int
+    id: int
+    instable_calls: Optional[int]
+    stable_calls: Optional[int]
+    total_calls: Optional[int]
+    frac_variable: Optional[float]
+    avg_size_diff: Optional[float]
     repeat_id: int
 
     class Config:
@@ -0,0 +1,213 @@
+import os
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+
+from .dimensions import dimension_cache
+from .export import COLUMNAR_FORMATS
+
+"""
+Cache of complete JSON responses of the read-only endpoints. Keys are built from the path, the sorted
+query parameters and the dataset version, so all entries go stale as soon as an import bumps the
+version. Configured with environment variables:
+WEBSTR_RESPONSE_CACHE       memory (default), redis or none
+WEBSTR_RESPONSE_CACHE_SIZE  maximum number of entries of the memory backend (default 1024)
+WEBSTR_RESPONSE_CACHE_MAX_BYTES
+                            maximum total size of the entries of the memory backend (default 256 MB)
+WEBSTR_RESPONSE_CACHE_MAX_ENTRY_BYTES
+                            responses larger than this are not cached but streamed through (default 8 MB)
+WEBSTR_RESPONSE_CACHE_TTL   seconds an entry is kept (default 3600)
+WEBSTR_RESPONSE_CACHE_URL   redis://host:port/db for the redis backend, shared by all workers
+"""
+CACHED_PATHS = {"/repeats", "/genefeatures/", "/repeatinfo/"}
+
+# Response headers stored along with the body
+CACHED_HEADERS = ["content-type", "x-next-cursor", "link"]
+
+class MemoryBackend(object):
+    """ In-process LRU cache bounded by the number of entries and their total size in bytes, entries
+    also expire ttl seconds after they were stored
+    """
+    def __init__(self, max_entries: int, ttl: float, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.size -= len(value)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.size += len(value)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "bytes": self.size,
+                "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+class RedisBackend(object):
+    """ Cache shared by all API workers, eviction is left to redis (e.g. maxmemory-policy allkeys-lru) """
+    def __init__(self, url: str, ttl: float):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+
+    def get(self, key: str):
+        return self.client.get("webstr:" + key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.client.set("webstr:" + key, value, ex=self.ttl)
+
+    def clear(self) -> None:
+        # Entries of older dataset versions are never read again and expire on their own
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+async def current_dataset_version():
+    """ Dataset version stamp, re-read from the database at most every WEBSTR_DIMENSION_CACHE_INTERVAL seconds """
+    await run_in_threadpool(dimension_cache.refresh)
+    return dimension_cache.version
+
+def normalized_query(request) -> str:
+    """ Path and query parameters sorted by name and value, so equivalent requests compare equal """
+    query = "&".join(f"{name}={value}" for name, value in sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+def make_backend():
+    backend = os.environ.get("WEBSTR_RESPONSE_CACHE", "memory")
+    ttl = float(os.environ.get("WEBSTR_RESPONSE_CACHE_TTL", 3600))
+    if backend == "none":
+        return None
+    if backend == "redis":
+        return RedisBackend(os.environ["WEBSTR_RESPONSE_CACHE_URL"], ttl)
+    if backend != "memory":
+        raise ValueError(f"Unknown WEBSTR_RESPONSE_CACHE backend '{backend}'")
+    return MemoryBackend(int(os.environ.get("WEBSTR_RESPONSE_CACHE_SIZE", 1024)), ttl,
+                         int(os.environ.get("WEBSTR_RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024)))
+
+def encode_entry(response: Response, body: bytes) -> bytes:
+    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+    return json.dumps(headers).encode() + b"\n" + body
+
+def decode_entry(entry: bytes) -> Response:
+    headers, body = entry.split(b"\n", 1)
+    headers = json.loads(headers)
+    return Response(body, media_type=headers.pop("content-type", None), headers=headers)
+
+class ResponseCache(object):
+    def __init__(self, backend, max_entry_bytes: int):
+        self.backend = backend
+        self.max_entry_bytes = max_entry_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.too_large = 0
+        self.version = None
+
+    def count(self, hit: bool) -> None:
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        stats = {"enabled": self.backend is not None, "hits": self.hits, "misses": self.misses,
+                 "too_large": self.too_large, "max_entry_bytes": self.max_entry_bytes, "dataset_version": self.version}
+        if self.backend is not None:
+            stats["backend"] = type(self.backend).__name__
+            stats.update(self.backend.stats())
+        return stats
+
+    @staticmethod
+    def cacheable(request) -> bool:
+        # downloads are streamed, they are not held in memory
+        return (request.method == "GET" and request.url.path in CACHED_PATHS
+                and request.query_params.get("download", "false").lower() in ("false", "0")
+                and request.query_params.get("format") not in COLUMNAR_FORMATS)
+
+    async def dataset_version(self):
+        """ Current dataset version, entries of older versions are dropped from the memory backend """
+        version = await current_dataset_version()
+        if version != self.version:
+            if self.version is not None:
+                logging.info(f"Response cache: dataset version changed to {version}, clearing cache")
+                self.backend.clear()
+            self.version = version
+        return version
+
+    async def __call__(self, request, call_next):
+        """ Middleware serving cached responses of the CACHED_PATHS endpoints """
+        if self.backend is None or not self.cacheable(request):
+            return await call_next(request)
+
+        key = f"v{await self.dataset_version()}:{normalized_query(request)}"
+        entry = await run_in_threadpool(self.backend.get, key)
+        self.count(entry is not None)
+        if entry is not None:
+            return decode_entry(entry)
+
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+        chunks = []
+        size = 0
+        body_iterator = response.body_iterator
+        async for chunk in body_iterator:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > self.max_entry_bytes:
+                # too large to keep, send what was read so far and stream the rest without buffering
+                with self.lock:
+                    self.too_large += 1
+                return StreamingResponse(self.remaining_body(chunks, body_iterator), status_code=response.status_code,
+                                         headers=dict(response.headers), media_type=response.media_type)
+        body = b"".join(chunks)
+        await run_in_threadpool(self.backend.set, key, encode_entry(response, body))
+        return Response(body, status_code=response.status_code, headers=dict(response.headers),
+                        media_type=response.media_type)
+
+    @staticmethod
+    async def remaining_body(chunks, body_iterator):
+        for chunk in chunks:
+            yield chunk
+        async for chunk in body_iterator:
+            yield chunk
+
+response_cache = ResponseCache(make_backend(),
+                               int(os.environ.get("WEBSTR_RESPONSE_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)))
@@ -0,0 +1,77 @@
+""" API tests, run with `python -m pytest strAPI/tests` from the root folder of this repo. The API is
+served from a small SQLite database built here, before strAPI.main reads DATABASE_URL.
+"""
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="webstr_test_"), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_PATH}"
+os.environ["WEBSTR_RESPONSE_CACHE"] = "memory"
+
+from sqlmodel import SQLModel, Session, create_engine
+
+from strAPI.repeats.models import (Genome, TRPanel, Gene, Repeat, GenesRepeatsLink, CRCVariation,
+    AlleleFrequency, DatasetVersion)
+from strAPI.utils.binning import region_bin
+
+# name, chromosome, start, end and number of repeats of the fixture genes
+GENES = [
+    ("KRAS", "chr12", 25205246, 25250936, 30),
+    ("BAX", "chr19", 48954815, 48961798, 5),
+    ("MSH6", "chr2", 47695530, 47810101, 12),
+]
+# repeats on chr12 that are not linked to a gene
+INTERGENIC_REPEATS = 4
+
+def repeat(repeat_id, chrom, start, motif, copies):
+    end = start + len(motif) * copies - 1
+    return Repeat(id=repeat_id, source="test", chr=chrom, start=start, end=end, bin=region_bin(start, end),
+        msa=",".join([motif] * copies), motif=motif, l_effective=len(motif), n_effective=copies,
+        region_length=end - start + 1, score_type="test", score=1.0, p_value=0.0, divergence=0.0, trpanel_id=1)
+
+def build_database(database_url):
+    engine = create_engine(database_url)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Genome(id=1, name="GRCh38.p2", organism="Homo sapiens", version="p2"))
+        session.add(TRPanel(id=1, name="hipstr_hg38", method="HipSTR", genome_id=1))
+        repeat_id = 0
+        for gene_id, (name, chrom, start, end, n_repeats) in enumerate(GENES, start=1):
+            session.add(Gene(id=gene_id, ensembl_id=f"ENSG{gene_id:011d}", ensembl_version_id=f"ENSG{gene_id:011d}.1",
+                name=name, description=f"{name} gene", chr=chrom, strand="+", start=start, end=end,
+                bin=region_bin(start, end), genome_id=1))
+            for i in range(n_repeats):
+                repeat_id += 1
+                session.add(repeat(repeat_id, chrom, start + 1000 * i, ["A", "AC", "AGC"][i % 3], 10 + i % 4))
+                session.add(GenesRepeatsLink(repeat_id=repeat_id, gene_id=gene_id))
+                if i % 2 == 0:
+                    session.add(CRCVariation(id=repeat_id, repeat_id=repeat_id, instable_calls=i, stable_calls=100,
+                        total_calls=100 + i, frac_variable=(i % 7) / 10, avg_size_diff=0.5))
+                session.add(AlleleFrequency(id=repeat_id, population="1000 Genomes AFR", n_effective=10,
+                    frequency=0.5, het=0.4, num_called=100, repeat_id=repeat_id))
+        for i in range(INTERGENIC_REPEATS):
+            repeat_id += 1
+            intergenic = repeat(repeat_id, "chr12", 25300000 + 1000 * i, "AT", 12)
+            if i == INTERGENIC_REPEATS - 1:
+                # imported without running update_bins.py
+                intergenic.bin = None
+            session.add(intergenic)
+        session.add(DatasetVersion(id=1, version=1, updated_at=datetime.utcnow()))
+        session.commit()
+    engine.dispose()
+
+build_database(os.environ["DATABASE_URL"])
+
+@pytest.fixture()
+def client():
+    from fastapi.testclient import TestClient
+    from strAPI.main import app
+    from strAPI.response_cache import response_cache
+
+    if response_cache.backend is not None:
+        response_cache.backend.clear()
+    with TestClient(app) as client:
+        yield client
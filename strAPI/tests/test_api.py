@@ -0,0 +1,84 @@
+import csv
+import io
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlmodel import Session
+
+from strAPI import repeat_rows as rr
+from strAPI.repeats.database import engine
+from .conftest import INTERGENIC_REPEATS
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "database_setup"))
+from refresh_repeat_summary import refresh_repeat_summary
+
+def test_repeatinfo(client):
+    response = client.get("/repeatinfo/?repeat_id=1")
+    assert response.status_code == 200
+    repeat = response.json()
+    assert (repeat["repeat_id"], repeat["chr"], repeat["start"]) == (1, "chr12", 25205246)
+    assert repeat["panel"] == "ensemble_tr"
+    assert client.get("/repeatinfo/?repeat_id=100000").status_code == 404
+
+def test_region_query_includes_rows_without_bin(client):
+    response = client.get("/repeats?region_query=12:25299000-25310000")
+    assert response.status_code == 200
+    assert len(response.json()) == INTERGENIC_REPEATS
+    narrow = client.get("/repeats?region_query=12:25299000-25300100")
+    assert [repeat["start"] for repeat in narrow.json()] == [25300000]
+
+def test_repeats_batch(client):
+    response = client.post("/repeats/batch", json={"repeat_ids": [2, 1], "regions": ["19:48954815-48956000"]})
+    assert response.status_code == 200
+    batch = response.json()
+    repeat_ids = [repeat["repeat_id"] for repeat in batch["repeats"]]
+    assert repeat_ids == sorted(repeat_ids)
+    assert {1, 2} < set(repeat_ids)
+    assert [frequency["repeat_id"] for frequency in batch["allele_frequencies"]] == repeat_ids
+
+def test_repeats_batch_validation(client):
+    assert client.post("/repeats/batch", json={}).status_code == 400
+    assert client.post("/repeats/batch", json={"regions": ["chr12"]}).status_code == 400
+    assert client.post("/repeats/batch", json={"regions": ["1:1-20000000"]}).status_code == 400
+    assert client.post("/repeats/batch", json={"repeat_ids": list(range(1001))}).status_code == 400
+
+def test_columnar_exports(client):
+    download = client.get("/repeats?gene_names=KRAS&download=true&format=tsv")
+    assert download.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(download.text), delimiter="\t"))
+
+    arrow = client.get("/repeats?gene_names=KRAS&format=arrow")
+    assert arrow.status_code == 200
+    assert arrow.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(arrow.content).read_all()
+    assert table.num_rows == len(rows) == 30
+
+    parquet = client.get("/repeats?gene_names=KRAS&format=parquet")
+    assert parquet.status_code == 200
+    table = pq.read_table(io.BytesIO(parquet.content))
+    assert table.column("repeat_id").to_pylist() == [int(row["repeat_id"]) for row in rows]
+
+def test_gzip_compression(client):
+    response = client.get("/repeats?gene_names=KRAS&download=true", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    plain = client.get("/repeats?gene_names=KRAS&download=true", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.text == response.text
+
+def test_repeat_summary_matches_joins():
+    with Session(engine) as session:
+        refresh_repeat_summary(session)
+        gene_ids = [1, 2, 3]
+        joined, _ = rr.get_repeat_page(session, rr.repeats_in_genes(gene_ids), limit=1000)
+        summary, _ = rr.get_repeat_page(session, rr.summary_repeats_in_genes(gene_ids), limit=1000,
+                                        keys=rr.SUMMARY_KEYS)
+        assert len(joined) == 47
+        assert summary == joined
+        region = ("chr12", 25200000, 25400000)
+        joined, _ = rr.get_repeat_page(session, rr.repeats_in_region(*region), limit=1000)
+        summary, _ = rr.get_repeat_page(session, rr.summary_repeats_in_region(*region), limit=1000,
+                                        keys=rr.SUMMARY_KEYS)
+        assert summary == joined
@@ -0,0 +1,31 @@
+import os
+
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm import Session
+
+from strAPI.utils.bedmaker import BedMaker, KARYOTYPIC_ORDER
+from .conftest import GENES, INTERGENIC_REPEATS
+
+def bed_positions(lines):
+    fields = [line.split("\t") for line in lines if line]
+    return [(KARYOTYPIC_ORDER.index(f[0]), int(f[1]), int(f[2])) for f in fields]
+
+def test_panel_bed_is_in_karyotypic_order(client):
+    response = client.get("/bed/?panel=hipstr_hg38")
+    assert response.status_code == 200
+    positions = bed_positions(response.text.split("\n"))
+    assert positions == sorted(positions)
+    assert [KARYOTYPIC_ORDER[p[0]] for p in positions][0] == "chr2"
+    # repeats outside genes are included
+    assert len(positions) == sum(gene[4] for gene in GENES) + INTERGENIC_REPEATS
+
+def test_gene_linked_bed_lines():
+    engine = create_engine(os.environ["DATABASE_URL"])
+    with Session(engine) as session:
+        bedmaker = BedMaker(session)
+        all_lines = list(bedmaker.karyotypic_bed_lines())
+        bedmaker.set_filters(gene_linked=True)
+        gene_lines = list(bedmaker.karyotypic_bed_lines())
+    engine.dispose()
+    assert len(all_lines) - len(gene_lines) == INTERGENIC_REPEATS
+    assert bed_positions(gene_lines) == sorted(bed_positions(gene_lines))
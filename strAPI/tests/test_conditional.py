@@ -0,0 +1,19 @@
+ORIGIN = {"Origin": "https://webstr.example.org"}
+
+def test_not_modified_has_cors_headers(client):
+    first = client.get("/genefeatures/?gene_names=BAX", headers=ORIGIN)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert "etag" in first.headers["access-control-expose-headers"].lower()
+
+    second = client.get("/genefeatures/?gene_names=BAX", headers={**ORIGIN, "If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["etag"] == etag
+    assert second.headers["access-control-allow-origin"] in ("*", ORIGIN["Origin"])
+    assert "etag" in second.headers["access-control-expose-headers"].lower()
+
+def test_etag_changes_with_the_query(client):
+    first = client.get("/repeats?gene_names=BAX")
+    second = client.get("/repeats?gene_names=MSH6")
+    assert first.headers["etag"] != second.headers["etag"]
+    assert client.get("/repeats?gene_names=BAX", headers={"If-None-Match": second.headers["etag"]}).status_code == 200
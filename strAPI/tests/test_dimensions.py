@@ -0,0 +1,15 @@
+from strAPI.dimensions import DimensionCache
+from strAPI.repeats.database import engine
+
+def test_panel_names():
+    cache = DimensionCache(engine)
+    cache.load()
+    assert cache.panel_name(1) == "ensemble_tr"
+    assert cache.panel_id("ensemble_tr") == cache.panel_id("hipstr_hg38") == 1
+
+def test_unknown_panel_is_named_by_its_id():
+    cache = DimensionCache(engine)
+    cache.load()
+    # e.g. a panel imported after the last load
+    assert cache.loaded_panel_name(2) == "2"
+    assert cache.panel_name(2) == "2"
@@ -0,0 +1,14 @@
+from strAPI import main
+
+def test_internal_routes_are_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(main, "INTERNAL_TOKEN", None)
+    assert client.get("/internal/cache").status_code == 404
+    assert client.get("/internal/pool", headers={"X-Internal-Token": ""}).status_code == 404
+
+def test_internal_routes_need_the_token(client, monkeypatch):
+    monkeypatch.setattr(main, "INTERNAL_TOKEN", "secret")
+    assert client.get("/internal/cache").status_code == 403
+    assert client.get("/internal/cache", headers={"X-Internal-Token": "wrong"}).status_code == 403
+    response = client.get("/internal/cache", headers={"X-Internal-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["enabled"]
@@ -0,0 +1,34 @@
+import csv
+import io
+
+def test_repeats_are_paged_by_default(client):
+    # the default page size is larger than the fixture, a full page has no next cursor
+    response = client.get("/repeats?gene_names=MSH6")
+    assert response.status_code == 200
+    assert len(response.json()) == 12
+    assert "x-next-cursor" not in response.headers
+
+def test_repeat_pages_cover_the_download(client):
+    download = client.get("/repeats?gene_names=KRAS&download=true")
+    assert download.status_code == 200
+    downloaded = {int(row["repeat_id"]) for row in csv.DictReader(io.StringIO(download.text))}
+
+    paged = []
+    params = {"gene_names": "KRAS", "limit": 7}
+    while True:
+        response = client.get("/repeats", params=params)
+        assert response.status_code == 200
+        assert len(response.json()) <= 7
+        paged.extend(repeat["repeat_id"] for repeat in response.json())
+        if "x-next-cursor" not in response.headers:
+            break
+        assert response.headers["link"].endswith('; rel="next"')
+        params["cursor"] = response.headers["x-next-cursor"]
+    assert len(paged) == len(set(paged)) == 30
+    assert set(paged) == downloaded
+
+def test_limit_is_capped(client):
+    assert client.get("/repeats?gene_names=KRAS&limit=10001").status_code == 422
+
+def test_invalid_cursor(client):
+    assert client.get("/gene/?gene_names=KRAS&cursor=nonsense").status_code == 400
@@ -0,0 +1,33 @@
+from strAPI.response_cache import MemoryBackend, response_cache
+
+ORIGIN = {"Origin": "https://webstr.example.org"}
+
+def test_cache_hit_has_cors_headers(client):
+    hits = response_cache.hits
+    first = client.get("/repeats?gene_names=KRAS", headers=ORIGIN)
+    second = client.get("/repeats?gene_names=KRAS", headers=ORIGIN)
+    assert response_cache.hits == hits + 1
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    for response in (first, second):
+        assert response.headers["access-control-allow-origin"] in ("*", ORIGIN["Origin"])
+
+def test_memory_backend_byte_budget():
+    backend = MemoryBackend(max_entries=10, ttl=60, max_bytes=10)
+    backend.set("a", b"12345")
+    backend.set("b", b"123456")
+    assert backend.get("a") is None
+    assert backend.get("b") == b"123456"
+    backend.set("c", b"12345678901")
+    assert backend.get("c") is None
+    assert backend.stats()["bytes"] == 6
+
+def test_large_response_is_not_cached(client, monkeypatch):
+    monkeypatch.setattr(response_cache, "max_entry_bytes", 100)
+    too_large = response_cache.too_large
+    first = client.get("/repeats?gene_names=KRAS&limit=20")
+    second = client.get("/repeats?gene_names=KRAS&limit=20")
+    assert response_cache.too_large == too_large + 2
+    assert first.status_code == second.status_code == 200
+    assert len(first.json()) == 20
+    assert first.json() == second.json()
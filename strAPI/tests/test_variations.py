@@ -0,0 +1,29 @@
+import csv
+import io
+
+# KRAS has 30 repeats, every other one has a CRC variation
+KRAS_VARIATIONS = 15
+
+def test_variations_of_repeat(client):
+    response = client.get("/variations/?repeat_id=3")
+    assert response.status_code == 200
+    assert [variation["repeat_id"] for variation in response.json()] == [3]
+
+def test_variations_in_genes_download(client):
+    response = client.get("/variations/?gene_names=KRAS&download=true")
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == KRAS_VARIATIONS
+    assert [int(row["repeat_id"]) for row in rows] == sorted(int(row["repeat_id"]) for row in rows)
+
+def test_variations_in_genes_pages(client):
+    first = client.get("/variations/?gene_names=KRAS&limit=5")
+    assert first.status_code == 200
+    assert len(first.json()) == 5
+    second = client.get("/variations/", params={"gene_names": "KRAS", "limit": 5,
+                                                "cursor": first.headers["x-next-cursor"]})
+    assert second.status_code == 200
+    assert not {v["id"] for v in first.json()} & {v["id"] for v in second.json()}
+
+def test_variations_need_a_filter(client):
+    assert client.get("/variations/").status_code == 400
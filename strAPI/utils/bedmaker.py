@@ -1,11 +1,24 @@
 #!/usr/bin/env python3
 import argparse
+import heapq
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
+from sqlalchemy import select
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm import sessionmaker
 
-from setup_db import Gene
-from gtf_to_sql import connection_setup
+from strAPI.repeats.models import Gene, Repeat, GenesRepeatsLink
+from strAPI.utils.msa import find_stretches
+
+# Order of the chromosomes in bed files written by write_bed()
+KARYOTYPIC_ORDER = [f"chr{i}" for i in range(1, 23)] + ["chrX", "chrY", "chrM"]
 
 class BedMaker(object):      
     # Default threshold values for STRs, taken from Lai & Sun, 2003
@@ -19,18 +32,22 @@ class BedMaker(object):
         6: 4
     }
     # All allowed values for chromosomes
-    allowed_chromosomes = {f"chr{i}" for i in range(1, 23)}.union({"chrX", "chrY", "chrM"})
+    allowed_chromosomes = set(KARYOTYPIC_ORDER)
+    # Number of repeats fetched from the database and processed together in threshold_filter()
+    batch_size = 10000
    
     def __init__(self, 
                 db_session, 
                 consensus_only: bool=False, 
                 thresholds: dict=default_thresholds,
-                chromosomes=allowed_chromosomes):
+                chromosomes=allowed_chromosomes,
+                out_format: str="GangSTR"):
         self.db_session = db_session   
         self.consensus_only = consensus_only
         self.set_thresholds(thresholds)
         self.set_chromosomes(chromosomes)
-        self.gene_selection = None
+        self.set_out_format(out_format)
+        self.set_filters()
 
     def set_thresholds(self, thresh_dict: dict) -> None:
         # Check if all keys and values in supplied dictionary are integers
@@ -45,12 +62,39 @@ class BedMaker(object):
             raise ValueError("Unrecognized target chromosome specified")
         self.chromosomes = target_chromosomes
 
-    def set_gene_selection(self):
-        gene_selection = dict()
-        for chrom in self.chromosomes:
-            for gene in self.db_session.query(Gene).filter_by(chr=chrom).all():
-                gene_selection[gene.ensembl_id] = gene
-        self.gene_selection = gene_selection
+    def set_out_format(self, out_format: str) -> None:
+        if not out_format in BedTR.supported_formats:
+            raise ValueError(f"Specified output format '{out_format}' is not supported")
+        self.out_format = out_format
+
+    def set_filters(self, gene_clauses=(), repeat_clauses=(), gene_linked: bool=False) -> None:
+        """ Restrict the bed file to part of the repeats
+
+        Parameters
+        gene_clauses:   Filter clauses on Gene, only repeats linked to a selected gene are included
+        repeat_clauses: Filter clauses on Repeat
+        gene_linked:    Only include repeats linked to a gene, implied by gene_clauses
+        """
+        self.gene_clauses = list(gene_clauses)
+        self.repeat_clauses = list(repeat_clauses)
+        self.gene_linked = gene_linked
+
+    def repeat_query(self, chromosomes=None):
+        """ Query for all repeats on one of chromosomes (default self.chromosomes), every repeat once,
+        ordered by chromosome and position. The filters of set_filters() are applied, genes are only
+        joined when there are gene clauses or gene_linked is set, so repeats outside genes are
+        included otherwise.
+        """
+        chromosomes = self.chromosomes if chromosomes is None else chromosomes
+        statement = select(Repeat.chr, Repeat.id, Repeat.start, Repeat.msa)
+        if self.gene_clauses or self.gene_linked:
+            linked_repeats = select(GenesRepeatsLink.repeat_id).join(
+                Gene, Gene.id == GenesRepeatsLink.gene_id
+            ).where(*self.gene_clauses).distinct().subquery()
+            statement = statement.join(linked_repeats, linked_repeats.c.repeat_id == Repeat.id)
+        return statement.where(
+            Repeat.chr.in_(list(chromosomes)), *self.repeat_clauses
+        ).order_by(Repeat.chr, Repeat.start, Repeat.id)
 
     def threshold_filter(self):
         """ Generator function that yields repeats containing a subsequence of consecutive 
@@ -60,29 +104,90 @@ class BedMaker(object):
         bed_tr (BedTR)          Representation of STR that passes threshold filters and
                                 can be added to bed file                 
         """
-        if not self.gene_selection:
-            raise AttributeError("Gene selection needs to be set before bed file can be generated")
-        seen_repeats = set()
-        for gene in self.gene_selection.values():
-            for repeat in gene.repeats:
-                if repeat.id in seen_repeats:
+        # a single query, read batch_size rows at a time (server side cursor on PostgreSQL)
+        result = self.db_session.execute(
+            self.repeat_query().execution_options(stream_results=True)
+        ).yield_per(self.batch_size)
+        for batch in result.partitions():
+            yield from self.filter_batch(batch)
+
+    def sorted_bed_lines(self, chromosomes=None):
+        """ Generator function that yields the bed lines of threshold_filter() sorted by chromosome
+        (in query order) and by start and end position within it. The query orders the repeats by
+        start and every stretch starts within its repeat, so a line is yielded as soon as a batch of
+        repeats starts after it; only the lines of the repeats that can still overlap are held.
+        """
+        result = self.db_session.execute(
+            self.repeat_query(chromosomes).execution_options(stream_results=True)
+        ).yield_per(self.batch_size)
+        pending = []        # heap of (start, end, bed line)
+        chromosome = None
+        for batch in result.partitions():
+            for bed_tr in self.filter_batch(batch):
+                if bed_tr.chromosome != chromosome:
+                    while pending:
+                        yield heapq.heappop(pending)[2]
+                    chromosome = bed_tr.chromosome
+                heapq.heappush(pending, (bed_tr.start, bed_tr.end, bed_tr.get_bed_line()))
+            # later repeats, and so their stretches, start at or after the last repeat of the batch
+            if batch[-1].chr == chromosome:
+                while pending and pending[0][0] < batch[-1].start:
+                    yield heapq.heappop(pending)[2]
+        while pending:
+            yield heapq.heappop(pending)[2]
+
+    def karyotypic_bed_lines(self):
+        """ Generator function that yields the bed lines of all self.chromosomes in KARYOTYPIC_ORDER,
+        sorted by position within each chromosome (one query per chromosome), as write_bed() orders them
+        """
+        for chromosome in KARYOTYPIC_ORDER:
+            if chromosome in self.chromosomes:
+                yield from self.sorted_bed_lines([chromosome])
+
+    def passes_thresholds(self, bed_tr) -> bool:
+        try:
+            return bed_tr.longest_cs >= self.thresholds[len(bed_tr.consensus_unit)]
+        except KeyError:
+            # repeat.l_effective is not part of the self.threshold range currently active
+            return False
+
+    def filter_batch(self, batch):
+        """ Same as get_bed_trs() followed by the threshold filter for a list of repeat rows (chr, id,
+        start and msa), but with the msas of all repeats processed at once by find_stretches(). BedTRs
+        are only made for the stretches that pass the thresholds, they are yielded in the order of the batch.
+        """
+        stretches = find_stretches([repeat.msa for repeat in batch], [repeat.start for repeat in batch], self.consensus_only)
+        irregular = set(stretches.irregular.tolist())
+        # stretches are ordered by repeat, first stretch of every repeat in the batch
+        first_stretch = np.searchsorted(stretches.msa, np.arange(len(batch) + 1))
+        for idx, repeat in enumerate(batch):
+            if idx in irregular:
+                yield from filter(self.passes_thresholds, self.get_bed_trs(repeat, repeat.chr))
+                continue
+            consensus_unit = stretches.consensus_units[idx]
+            if len(consensus_unit) not in self.thresholds:
+                continue
+            units = None
+            for stretch in range(first_stretch[idx], first_stretch[idx + 1]):
+                if stretches.longest_cs[stretch] < self.thresholds[len(consensus_unit)]:
                     continue
-                seen_repeats.add(repeat.id)
-                bed_tr_list = self.get_bed_trs(repeat, gene.chr)
-                for bed_tr in bed_tr_list:
-                    try:  
-                        if bed_tr.longest_cs >= self.thresholds[len(bed_tr.consensus_unit)]:
-                            yield bed_tr
-                    except KeyError:
-                        # repeat.l_effective is not part of the self.threshold range currently active
-                        continue
+                if units is None:
+                    units = [unit.replace("-", "") for unit in repeat.msa.split(",")]
+                first_unit = stretches.first_unit[stretch]
+                bed_tr = BedTR(repeat.chr, consensus_unit, repeat.id, out_format=self.out_format)
+                bed_tr.units = units[first_unit:first_unit + stretches.n_units[stretch]]
+                bed_tr.start = int(stretches.start[stretch])
+                bed_tr.end = int(stretches.end[stretch])
+                bed_tr.purity = stretches.purity[stretch]
+                bed_tr.longest_cs = int(stretches.longest_cs[stretch])
+                yield bed_tr
 
     def send_to_bed(self) -> None:
         """ Print string representations of STRs that pass the threshold filters
-        to stdout
+        to stdout, in karyotypic and position order
         """
-        for bed_tr in self.threshold_filter():            
-            print(bed_tr.get_bed_line())
+        for line in self.karyotypic_bed_lines():
+            print(line)
 
     def get_consensus_unit(self, msa: str) -> str:    
         """ Given a comma-separated set of units representing a multiple sequence
@@ -128,7 +233,7 @@ class BedMaker(object):
         """
         consensus_unit = self.get_consensus_unit(db_repeat.msa)
         bed_tr_list = []
-        current_bed_tr = BedTR(chromosome, consensus_unit, db_repeat.id, out_format="GangSTR")
+        current_bed_tr = BedTR(chromosome, consensus_unit, db_repeat.id, out_format=self.out_format)
         current_pos = db_repeat.start
 
         for unit in db_repeat.msa.split(","):            
@@ -138,7 +243,7 @@ class BedMaker(object):
                 if self.consensus_only and not current_unit == consensus_unit:
                     if len(current_bed_tr.units) > 0:
                         bed_tr_list.append(current_bed_tr)
-                    current_bed_tr = BedTR(chromosome, consensus_unit, db_repeat.id, out_format="GangSTR")
+                    current_bed_tr = BedTR(chromosome, consensus_unit, db_repeat.id, out_format=self.out_format)
                     current_pos += len(current_unit)
                     continue
                 if len(current_bed_tr.units) == 0:
@@ -147,7 +252,7 @@ class BedMaker(object):
             else:
                 if len(current_bed_tr.units) > 0:
                     bed_tr_list.append(current_bed_tr)
-                current_bed_tr = BedTR(chromosome, consensus_unit, db_repeat.id, out_format="GangSTR")
+                current_bed_tr = BedTR(chromosome, consensus_unit, db_repeat.id, out_format=self.out_format)
             current_pos += len(current_unit)
 
         # Check if last entry in bed_tr_list equals the current_bed_tr
@@ -246,6 +351,98 @@ class BedTR(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+def connection_setup(database):
+    """ Engine and session for the database url, like gtf_to_sql.connection_setup() """
+    engine = create_engine(database, echo=False)
+    Session = sessionmaker(bind=engine)
+    return engine, Session()
+
+def write_chromosome_bed(database, chromosome, consensus_only, thresholds, gene_linked, bed_path) -> int:
+    """ Write the bed lines of one chromosome sorted by position to bed_path, using a database
+    connection of its own so it can run in a worker process. Returns the number of lines.
+    """
+    engine, session = connection_setup(database)
+    n_lines = 0
+    try:
+        bedmaker = BedMaker(db_session=session, consensus_only=consensus_only, thresholds=thresholds, chromosomes=[chromosome])
+        bedmaker.set_filters(gene_linked=gene_linked)
+        with open(bed_path, "w") as f:
+            for line in bedmaker.sorted_bed_lines():
+                f.write(line + "\n")
+                n_lines += 1
+    finally:
+        session.close()
+        engine.dispose()
+    return n_lines
+
+def compression_tool() -> str:
+    """ 'pysam' if it is installed, otherwise 'htslib' if its bgzip and tabix tools are on the PATH """
+    try:
+        import pysam
+        return "pysam"
+    except ImportError:
+        pass
+    if shutil.which("bgzip") is None or shutil.which("tabix") is None:
+        raise RuntimeError("Compressed output needs either pysam or the bgzip and tabix tools of htslib")
+    return "htslib"
+
+def compress_and_index(bed_path) -> str:
+    """ Compress bed_path with bgzip and build its tabix index, see compression_tool(). The
+    uncompressed file is removed.
+
+    The start column holds the 1-based repeat starts of the database, so the index is built with
+    explicit 1-based columns rather than the 0-based bed preset, which would shift every region
+    query by one base.
+
+    Returns
+    Path of the compressed file, the index is the same path + '.tbi'
+    """
+    if compression_tool() == "pysam":
+        import pysam
+        return pysam.tabix_index(bed_path, seq_col=0, start_col=1, end_col=2, zerobased=False, force=True)
+    subprocess.run(["bgzip", "--force", bed_path], check=True)
+    subprocess.run(["tabix", "--force", "-s", "1", "-b", "2", "-e", "3", bed_path + ".gz"], check=True)
+    return bed_path + ".gz"
+
+def write_bed(database, output_file, consensus_only=False, thresholds=BedMaker.default_thresholds,
+              chromosomes=KARYOTYPIC_ORDER, workers=None, compress=False, gene_linked=True) -> str:
+    """ Write the bed file of the repeats passing the thresholds with one worker process per
+    chromosome. The output of the chromosomes is appended to output_file in karyotypic order, each
+    one as soon as it and all chromosomes before it are finished, lines within a chromosome are
+    sorted by position.
+
+    Parameters
+    database:       Database url, every worker opens a connection of its own
+    output_file:    Path of the bed file
+    workers:        Number of worker processes, defaults to the number of CPUs
+    compress:       Compress the bed file with bgzip and index it with tabix, see compress_and_index()
+    gene_linked:    Only include repeats linked to a gene, False for all repeats
+
+    Returns
+    Path of the bed file that was written
+    """
+    if compress:
+        # fail before building the file
+        compression_tool()
+    chromosomes = [chrom for chrom in KARYOTYPIC_ORDER if chrom in chromosomes]
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(write_chromosome_bed, database, chrom, consensus_only, thresholds, gene_linked, os.path.join(tmp_dir, f"{chrom}.bed"))
+            for chrom in chromosomes
+        ]
+        with open(output_file, "w") as out:
+            for chrom, future in zip(chromosomes, futures):
+                n_lines = future.result()
+                with open(os.path.join(tmp_dir, f"{chrom}.bed")) as f:
+                    shutil.copyfileobj(f, out)
+                out.flush()
+                print(f"{chrom}: {n_lines} repeats", file=sys.stderr)
+
+    if compress:
+        return compress_and_index(output_file)
+    return output_file
+
 def parse_cla():
     parser = argparse.ArgumentParser()
 
@@ -255,6 +452,18 @@ def parse_cla():
     parser.add_argument(
         "-p", "--perfect", action='store_true', help="True/False flag to control whether only perfect STRs will be considered (default: False)"
     )
+    parser.add_argument(
+        "-o", "--output", type=str, default=None, help="Write the .bed file here, building the chromosomes in parallel, instead of printing it to stdout"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None, help="Number of chromosomes built at the same time with --output (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "-z", "--bgzip", action='store_true', help="With --output, compress the .bed file with bgzip and index it with tabix (needs pysam or htslib)"
+    )
+    parser.add_argument(
+        "-i", "--intergenic", action='store_true', help="Also include repeats that are not linked to a gene (default: only repeats in genes)"
+    )
 
     return parser.parse_args()
 
@@ -262,9 +471,7 @@ def parse_cla():
 
 def main():
     args = parse_cla()
-    
-    engine, session = connection_setup(args.database)
-    bedmaker = BedMaker(db_session=session, consensus_only=args.perfect)
+    db_path = args.database.replace("postgres://", "postgresql+psycopg2://")
     thresholds = {
         1: 9,
         2: 4,
@@ -273,8 +480,19 @@ def main():
         5: 3,
         6: 3
     }
+
+    if args.output:
+        bed_path = write_bed(db_path, args.output, consensus_only=args.perfect, thresholds=thresholds,
+            workers=args.workers, compress=args.bgzip, gene_linked=not args.intergenic)
+        print(f"Wrote {bed_path}", file=sys.stderr)
+        return
+    if args.bgzip:
+        raise ValueError("Compressed output needs a file, specify it with --output")
+
+    engine, session = connection_setup(db_path)
+    bedmaker = BedMaker(db_session=session, consensus_only=args.perfect)
     bedmaker.set_thresholds(thresholds)
-    bedmaker.set_gene_selection()
+    bedmaker.set_filters(gene_linked=not args.intergenic)
 
     bedmaker.send_to_bed()
 
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+""" UCSC genome browser binning scheme (Kent et al., 2002), used to index genomic intervals for
+overlap queries. Every interval is assigned the smallest bin that fully contains it. Bins form a
+hierarchy of 5 levels: 128kb, 1Mb, 8Mb, 64Mb and 512Mb. An interval overlapping a region can
+only live in a bin that overlaps that region, which gives at most one contiguous range of bin
+numbers per level. Coordinates are 1-based and inclusive, as stored in the database.
+"""
+from sqlalchemy import or_
+
+# Offsets of the bin numbers at each level, smallest bins first
+BIN_OFFSETS = [512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0]
+FIRST_SHIFT = 17  # smallest bins are 2^17 = 128kb wide
+NEXT_SHIFT = 3    # every next level is 2^3 = 8 times wider
+MAX_COORDINATE = 2 ** 29
+
+def region_bin(start: int, end: int) -> int:
+    """ Smallest bin that fully contains the interval start-end """
+    if end > MAX_COORDINATE:
+        raise ValueError(f"Coordinate {end} exceeds the maximum supported by the binning scheme ({MAX_COORDINATE})")
+    start_bin = (start - 1) >> FIRST_SHIFT
+    end_bin = (end - 1) >> FIRST_SHIFT
+    for offset in BIN_OFFSETS:
+        if start_bin == end_bin:
+            return offset + start_bin
+        start_bin >>= NEXT_SHIFT
+        end_bin >>= NEXT_SHIFT
+
+def overlapping_bin_ranges(start: int, end: int) -> list:
+    """ Ranges (first, last) of bin numbers that can contain intervals overlapping start-end,
+    one range per level
+    """
+    start_bin = (max(start, 1) - 1) >> FIRST_SHIFT
+    end_bin = (min(end, MAX_COORDINATE) - 1) >> FIRST_SHIFT
+    bin_ranges = []
+    for offset in BIN_OFFSETS:
+        bin_ranges.append((offset + start_bin, offset + end_bin))
+        start_bin >>= NEXT_SHIFT
+        end_bin >>= NEXT_SHIFT
+    return bin_ranges
+
+def bin_filter(bin_column, start: int, end: int):
+    """ SQL filter on bin_column selecting the bins of all intervals that may overlap start-end.
+    Combine with the exact coordinate predicates, the filter only narrows down the index scan.
+    Rows whose bin was never filled in (databases from before the bin column, rows imported directly
+    into SQL without running update_bins.py) are kept as well.
+    """
+    return or_(
+        *[bin_column.between(first, last) for first, last in overlapping_bin_ranges(start, end)],
+        bin_column.is_(None)
+    )
+
+def region_bin_sql(start_column: str='start', end_column: str='"end"') -> str:
+    """ SQL expression computing region_bin() from the start and end columns of a table, for
+    filling the bin column of rows that were imported directly into the database
+    """
+    sql_cases = []
+    shift = FIRST_SHIFT
+    for offset in BIN_OFFSETS[:-1]:
+        bin_size = 2 ** shift
+        sql_cases.append(
+            f"WHEN ({start_column} - 1) / {bin_size} = ({end_column} - 1) / {bin_size} "
+            f"THEN {offset} + ({start_column} - 1) / {bin_size}"
+        )
+        shift += NEXT_SHIFT
+    return "CASE " + " ".join(sql_cases) + f" ELSE {BIN_OFFSETS[-1]} END"
@@ -1,34 +1,62 @@
 #!/usr/bin/env python3
 
 import argparse
+import time
 
-from setup_db import Gene
-from strAPI.database_setup.gtf_to_sql import connection_setup
+from sqlalchemy import select
 
-def make_str_bed(session, output_file, autosomes=True):
-    """ Veeery inefficient as we go per chr, then sort the Genes and then also
-    sort the Repeats. However, it will result in a nicely ordered .bed file and this is likely only
-    done once for a database
+from strAPI.repeats.models import Gene, Repeat, GenesRepeatsLink
+from strAPI.utils.bedmaker import KARYOTYPIC_ORDER, connection_setup
+
+# Repeats fetched from the database and written to the .bed file at once
+BATCH_SIZE = 10000
+# Size of the output file buffer in bytes
+WRITE_BUFFER_SIZE = 1 << 20
+
+def chromosome_repeats(chrom):
+    """ Query for the repeats linked to a gene on chrom, every repeat once, sorted by position """
+    repeat_ids = select(GenesRepeatsLink.repeat_id).join(
+        Gene, Gene.id == GenesRepeatsLink.gene_id
+    ).where(Gene.chr == chrom).distinct().subquery()
+    return select(Repeat.start, Repeat.end, Repeat.l_effective, Repeat.n_effective, Repeat.id).join(
+        repeat_ids, repeat_ids.c.repeat_id == Repeat.id
+    ).order_by(Repeat.start, Repeat.end, Repeat.id)
+
+def make_str_bed(session, output_file, autosomes_only=False, batch_size=BATCH_SIZE):
+    """ Write the repeats linked to genes to a .bed file, ordered by chromosome (karyotypic order)
+    and position. Each chromosome is read with a single query on a server-side cursor and written
+    batch_size repeats at a time.
+
+    Parameters
+    session:        Session connected to the database
+    output_file:    Path of the .bed file
+    autosomes_only: Leave out chrX, chrY and chrM
+
+    Returns
+    Number of repeats written
     """
-    chrs = [f"chr{i}" for i in range(1, 23)]
-    if not autosomes: # generate bed file only for autosomes? Or sex chrs and mitochondrial as well?
-        chrs += ["chrX", "chrY", "chrM"]
-    with open(output_file, "w") as o:
-        for chrom in chrs: # iterate over all chrs
-            chrom_genes = session.query(Gene).filter_by(chr=chrom).all()
-            sorted_chrom_genes = list(sorted(chrom_genes, key=lambda x: x.start))
-            for gene in sorted_chrom_genes:
-                repeats = list(sorted([repeat for repeat in gene.repeats], key=lambda x: x.start))
-            for repeat in repeats:
-                line = "\t".join([
-                    chrom, 
-                    str(repeat.start), 
-                    str(repeat.end), 
-                    str(repeat.l_effective), 
-                    str(repeat.n_effective), 
-                    str(repeat.id)])
-                line += "\n"
-                o.write(line)
+    chrs = [chrom for chrom in KARYOTYPIC_ORDER if not autosomes_only or chrom not in {"chrX", "chrY", "chrM"}]
+    total = 0
+    start_time = time.time()
+    with open(output_file, "w", buffering=WRITE_BUFFER_SIZE) as o:
+        for chrom in chrs:
+            chrom_start_time = time.time()
+            n_repeats = 0
+            result = session.execute(
+                chromosome_repeats(chrom).execution_options(stream_results=True)
+            ).yield_per(batch_size)
+            for repeats in result.partitions():
+                o.write("".join(
+                    f"{chrom}\t{repeat.start}\t{repeat.end}\t{repeat.l_effective}\t{repeat.n_effective}\t{repeat.id}\n"
+                    for repeat in repeats
+                ))
+                n_repeats += len(repeats)
+            seconds = time.time() - chrom_start_time
+            print(f"{chrom}: {n_repeats} repeats in {seconds:.1f}s ({n_repeats / max(seconds, 1e-6):.0f} repeats/s)")
+            total += n_repeats
+    seconds = time.time() - start_time
+    print(f"Wrote {total} repeats to {output_file} in {seconds:.1f}s ({total / max(seconds, 1e-6):.0f} repeats/s)")
+    return total
 
 def cla_parser():
     parser = argparse.ArgumentParser()
@@ -39,17 +67,21 @@ def cla_parser():
     parser.add_argument(
         "--bed", "-b", type=str, required=True, help="Path to where the .bed file of repeats will be generated"
     )
+    parser.add_argument(
+        "--autosomes_only", action="store_true", help="Only include the repeats on autosomes, not those on chrX, chrY and chrM"
+    )
 
     return parser.parse_args()
 
 def main():
     args = cla_parser()
     db_path = args.database
+    db_path = db_path.replace("postgres://", "postgresql+psycopg2://")
     output_file = args.bed
 
     engine, session = connection_setup(db_path)
 
-    make_str_bed(session, output_file, autosomes=True)      
+    make_str_bed(session, output_file, autosomes_only=args.autosomes_only)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+""" In-memory interval index for assigning repeats to genes and transcripts during imports. Intervals
+are grouped per chromosome by their UCSC bin (see binning.py), so an overlap query only looks at the
+intervals in the few bins that can overlap it instead of at every interval on the chromosome.
+Coordinates are 1-based and inclusive.
+"""
+from .binning import region_bin, overlapping_bin_ranges
+from .constants import UPSTREAM, CHROMOSOME_LENGTHS
+
+def gene_region(gene, upstream=UPSTREAM):
+    """ Region of a gene including the upstream flank on its strand: before the start on the
+    + strand, after the end on the - strand (clipped to the chromosome)
+    """
+    region_start, region_end = gene.start, gene.end
+    if upstream:
+        if gene.strand == "+":
+            region_start = max(region_start - upstream, 1)
+        else:
+            region_end = min(region_end + upstream, CHROMOSOME_LENGTHS[gene.chr])
+    return region_start, region_end
+
+class IntervalIndex(object):
+    """ Static index of intervals with an item attached to each. Build it with add(), query it with
+    overlapping(). Results come back in the order the items were added.
+    """
+    def __init__(self):
+        self.bins = dict()  # chrom -> bin -> [(order, start, end, item)]
+        self.count = 0
+
+    def add(self, chrom: str, start: int, end: int, item) -> None:
+        self.bins.setdefault(chrom, dict()).setdefault(region_bin(start, end), []).append(
+            (self.count, start, end, item))
+        self.count += 1
+
+    def overlapping(self, chrom: str, start: int, end: int) -> list:
+        """ Items whose interval overlaps chrom:start-end """
+        chrom_bins = self.bins.get(chrom)
+        if not chrom_bins:
+            return []
+        matches = []
+        for first_bin, last_bin in overlapping_bin_ranges(start, end):
+            if last_bin - first_bin < len(chrom_bins):
+                bins = (chrom_bins.get(bin_number) for bin_number in range(first_bin, last_bin + 1))
+            else:
+                bins = (intervals for bin_number, intervals in chrom_bins.items() if first_bin <= bin_number <= last_bin)
+            for intervals in bins:
+                if intervals:
+                    matches.extend(entry for entry in intervals if entry[1] <= end and entry[2] >= start)
+        matches.sort(key=lambda entry: entry[0])
+        return [entry[3] for entry in matches]
+
+def gene_index(genes, upstream=UPSTREAM) -> IntervalIndex:
+    """ IntervalIndex of genes (objects or rows with chr, strand, start and end) over their region
+    including the upstream flank, see gene_region()
+    """
+    index = IntervalIndex()
+    for gene in genes:
+        index.add(gene.chr, *gene_region(gene, upstream), gene)
+    return index
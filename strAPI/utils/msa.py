@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+""" Consensus units and stretch statistics for the multiple sequence alignments (msa) of many repeats
+at once, the array version of BedMaker.get_consensus_unit(), BedMaker.get_bed_trs() and the purity
+and longest stretch of BedTR.
+
+The msas of a batch are encoded as one uint8 array holding the units of every repeat one after the
+other, so every step is a numpy operation over the whole batch instead of a Python loop per column
+and unit. Results are identical to the per repeat methods. Msas these cannot handle (units of
+different length, non ASCII characters or an empty consensus unit) are marked as irregular and left
+to the per repeat methods.
+"""
+import numpy as np
+
+GAP = ord("-")
+
+def offsets(lengths):
+    """ Start of every part in an array made of consecutive parts with the given lengths """
+    return np.cumsum(lengths) - lengths
+
+def shifted(flags):
+    """ The flag of the previous entry, False for the first one """
+    previous = np.zeros(len(flags), dtype=bool)
+    previous[1:] = flags[:-1]
+    return previous
+
+class MsaBatch(object):
+    """ The msas of a list of repeats (comma separated units of equal length) as one array
+
+    Attributes
+    regular:        Boolean array, False for the msas that could not be encoded
+    n_units:        Number of units of every msa, 0 for irregular ones
+    width:          Length of the units (columns of the alignment) of every msa
+    chars:          uint8 array with all units of all regular msas, row by row
+    unit_msa:       Index of the msa every unit belongs to
+    """
+    def __init__(self, msas):
+        self.msas = list(msas)
+        self.regular = np.ones(len(self.msas), dtype=bool)
+        self.n_units = np.zeros(len(self.msas), dtype=np.int64)
+        self.width = np.zeros(len(self.msas), dtype=np.int64)
+        encoded = []
+        for idx, msa in enumerate(self.msas):
+            if msa is None or not msa.isascii():
+                self.regular[idx] = False
+                continue
+            n_units = msa.count(",") + 1
+            width = (len(msa) - n_units + 1) // n_units
+            if width == 0 or any(len(unit) != width for unit in msa.split(",")):
+                self.regular[idx] = False
+                continue
+            self.n_units[idx] = n_units
+            self.width[idx] = width
+            encoded.append(msa.replace(",", ""))
+        self.chars = np.frombuffer("".join(encoded).encode("ascii"), dtype=np.uint8)
+        self.unit_msa = np.repeat(np.arange(len(self.msas)), self.n_units)
+        # first unit of every msa and first character of every unit
+        self.unit_offset = offsets(self.n_units)
+        self.unit_start = offsets(self.width[self.unit_msa])
+
+    def consensus(self):
+        """ Consensus unit of every regular msa: per column of the alignment the most common
+        character, columns where half or more of the units have a gap are skipped. Of characters
+        that are equally common the one in the first unit wins, as with Counter.most_common().
+
+        Returns
+        (list of consensus units, None for irregular msas; uint8 array with all consensus units;
+        start of every consensus unit in that array)
+        """
+        # global column number of every character: columns of earlier msas, then its own column
+        column_offset = offsets(self.width)
+        n_columns = int(self.width.sum())
+        char_unit = np.repeat(np.arange(len(self.unit_msa)), self.width[self.unit_msa])
+        char_msa = self.unit_msa[char_unit]
+        char_column = column_offset[char_msa] + np.arange(len(self.chars)) - self.unit_start[char_unit]
+        column_msa = np.repeat(np.arange(len(self.msas)), self.width)
+
+        # count every character per column, first_idx is where it occurs first (earliest unit)
+        keys, first_idx, counts = np.unique(char_column * 256 + self.chars, return_index=True, return_counts=True)
+        key_column, key_char = keys // 256, (keys % 256).astype(np.uint8)
+        gaps = np.zeros(n_columns, dtype=np.int64)
+        gaps[key_column[key_char == GAP]] = counts[key_char == GAP]
+        keep = 2 * gaps < self.n_units[column_msa]
+
+        # per column the character with the highest count, the earliest one on ties
+        nucleotides = key_char != GAP
+        key_column, key_char = key_column[nucleotides], key_char[nucleotides]
+        order = np.lexsort((first_idx[nucleotides], -counts[nucleotides], key_column))
+        best = order[key_column[order] != np.concatenate(([-1], key_column[order][:-1]))]
+        column_char = np.zeros(n_columns, dtype=np.uint8)
+        column_char[key_column[best]] = key_char[best]
+
+        consensus_chars = column_char[keep]
+        consensus_len = np.bincount(column_msa[keep], minlength=len(self.msas))
+        consensus_start = offsets(consensus_len)
+        consensus_units = [
+            consensus_chars[start:start + length].tobytes().decode("ascii") if regular else None
+            for regular, start, length in zip(self.regular, consensus_start, consensus_len)
+        ]
+        return consensus_units, consensus_chars, consensus_start
+
+class Stretches(object):
+    """ Stretches of consecutive units with the length of the consensus unit found in a MsaBatch,
+    in the order of the msas and their units. All attributes are arrays with one entry per stretch,
+    except for consensus_units and irregular.
+    """
+    def __init__(self, msa, first_unit, n_units, start, end, purity, longest_cs, consensus_units, irregular):
+        self.msa = msa                          # index of the msa in the batch
+        self.first_unit = first_unit            # index of the first unit of the stretch in its msa
+        self.n_units = n_units
+        self.start = start
+        self.end = end
+        self.purity = purity
+        self.longest_cs = longest_cs            # most consecutive units equal to the consensus
+        self.consensus_units = consensus_units  # per msa
+        self.irregular = irregular              # indices of the msas for the per repeat methods
+
+def find_stretches(msas, starts, consensus_only=False) -> Stretches:
+    """ Stretches, purity and longest perfect stretch of many repeats, see BedMaker.get_bed_trs()
+
+    Parameters
+    msas:           Msas of the repeats
+    starts:         Start positions of the repeats
+    consensus_only: Only units equal to the consensus unit make up stretches
+
+    Returns
+    Stretches of all repeats that are not irregular
+    """
+    batch = MsaBatch(msas)
+    consensus_units, consensus_chars, consensus_start = batch.consensus()
+    consensus_len = np.array([len(unit) if unit is not None else 0 for unit in consensus_units], dtype=np.int64)
+    batch.regular &= consensus_len > 0
+    irregular = np.flatnonzero(~batch.regular)
+
+    # length of the units without their gaps
+    not_gap = batch.chars != GAP
+    unit_len = np.add.reduceat(not_gap.astype(np.int64), batch.unit_start) if len(batch.chars) else np.zeros(0, dtype=np.int64)
+    unit_consensus_len = consensus_len[batch.unit_msa]
+    # the units of an empty consensus are never compared, their msas are irregular
+    same_len = (unit_len == unit_consensus_len) & batch.regular[batch.unit_msa]
+
+    # mismatches against the consensus of the units with its length, the non gap characters of a
+    # unit are compared one by one with the consensus
+    nucleotides = batch.chars[not_gap]
+    nucleotide_start = offsets(unit_len)
+    compared = np.flatnonzero(same_len)
+    compared_len = unit_len[compared]
+    position = np.arange(int(compared_len.sum())) - np.repeat(offsets(compared_len), compared_len)
+    mismatch = (
+        nucleotides[np.repeat(nucleotide_start[compared], compared_len) + position] !=
+        consensus_chars[np.repeat(consensus_start[batch.unit_msa[compared]], compared_len) + position]
+    )
+    unit_mismatches = np.zeros(len(batch.unit_msa), dtype=np.int64)
+    unit_mismatches[compared] = np.bincount(np.repeat(np.arange(len(compared)), compared_len),
+        weights=mismatch, minlength=len(compared)).astype(np.int64)
+    perfect = same_len & (unit_mismatches == 0)
+
+    # stretches are runs of consecutive units within an msa
+    in_stretch = perfect if consensus_only else same_len
+    first_of_msa = np.zeros(len(batch.unit_msa), dtype=bool)
+    first_of_msa[batch.unit_offset[batch.n_units > 0]] = True
+    previous = shifted(in_stretch) & ~first_of_msa
+    stretch_first = np.flatnonzero(in_stretch & ~previous)
+    unit_stretch = np.cumsum(in_stretch & ~previous) - 1
+    stretch_units = unit_stretch[in_stretch]
+    n_units = np.bincount(stretch_units, minlength=len(stretch_first))
+    mismatches = np.bincount(stretch_units, weights=unit_mismatches[in_stretch], minlength=len(stretch_first))
+
+    # longest run of perfect units within every stretch
+    previous_perfect = shifted(perfect) & previous
+    run_start = perfect & ~previous_perfect
+    unit_run = np.cumsum(run_start) - 1
+    run_length = np.bincount(unit_run[perfect], minlength=int(run_start.sum()))
+    longest_run = np.zeros(len(stretch_first), dtype=np.int64)
+    np.maximum.at(longest_run, unit_stretch[run_start], run_length)
+
+    stretch_msa = batch.unit_msa[stretch_first]
+    unit_pos = offsets(unit_len)
+    msa_pos = unit_pos[batch.unit_offset[stretch_msa]]
+    start = np.asarray(starts, dtype=np.int64)[stretch_msa] + unit_pos[stretch_first] - msa_pos
+    stretch_consensus_len = consensus_len[stretch_msa]
+    end = start + stretch_consensus_len * n_units - 1
+    # same float operations and rounding as BedTR.set_purity()
+    purity = [
+        round(1 - (int(n_mismatches) / int(seq_len)), 2)
+        for n_mismatches, seq_len in zip(mismatches, stretch_consensus_len * n_units)
+    ]
+    longest_cs = np.where(np.array(purity) == 1.0, n_units, longest_run)
+
+    return Stretches(
+        msa=stretch_msa,
+        first_unit=stretch_first - batch.unit_offset[stretch_msa],
+        n_units=n_units,
+        start=start,
+        end=end,
+        purity=purity,
+        longest_cs=longest_cs,
+        consensus_units=consensus_units,
+        irregular=irregular
+    )